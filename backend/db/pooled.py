@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+
+from django.db import OperationalError
+
+
+# Connections shared by the threads of a worker process. A thread takes one when it
+# first queries during a request and gives it back when Django closes it at the end
+# of the request, so a worker with many threads needs no more connections than it
+# has concurrent queries. Pools are per process, gunicorn workers forked from a
+# preloaded app don't share sockets.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    def __init__(self, size, timeout, check_after):
+        self.size = size
+        self.timeout = timeout
+        # idle connections older than this are checked before being handed out again
+        self.check_after = check_after
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = []
+        self.created = self.reused = self.discarded = 0
+
+    def get(self, connect, is_usable):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError(f"No database connection free after {self.timeout}s, the pool size is {self.size}.")
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    connection, returned = self.idle.pop()
+                if self.check_after is not None and time.monotonic() - returned > self.check_after and not is_usable(connection):
+                    self.close(connection)
+                    continue
+                self.reused += 1
+                return connection
+            connection = connect()
+            self.created += 1
+            return connection
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, connection, discard=False):
+        try:
+            if discard:
+                self.close(connection)
+            else:
+                with self.lock:
+                    self.idle.append((connection, time.monotonic()))
+        finally:
+            self.slots.release()
+
+    def close(self, connection):
+        self.discarded += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self.lock:
+            idle = len(self.idle)
+        return {
+            'size': self.size,
+            'idle': idle,
+            # a semaphore doesn't expose its value, count the slots in use from the totals
+            'in_use': self.created - self.discarded - idle,
+            'created': self.created,
+            'reused': self.reused,
+            'discarded': self.discarded,
+        }
+
+
+def get_pool(alias, size, timeout, check_after):
+    key = (alias, os.getpid())
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(size, timeout, check_after)
+        return _pools[key]
+
+
+def pool_stats():
+    """Stats of the pools of this process, by database alias"""
+    pid = os.getpid()
+    return {alias: pool.stats() for (alias, pool_pid), pool in list(_pools.items()) if pool_pid == pid}
@@ -0,0 +1,64 @@
+from django.db.backends.postgresql import base
+
+from psycopg2 import extensions
+
+from backend.db.pooled import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """The PostgreSQL backend taking its connections from a pool shared by the threads
+    of the process, see backend/db/pooled.py. Set CONN_MAX_AGE to 0 so connections are
+    given back at the end of every request. OPTIONS takes ``pool_size``,
+    ``pool_timeout`` in seconds and ``pool_check_after``, the seconds after which an idle
+    connection is checked with a query before it's reused, when CONN_HEALTH_CHECKS is on."""
+    POOL_OPTIONS = {'pool_size': 10, 'pool_timeout': 10, 'pool_check_after': 30}
+
+    @property
+    def pool(self):
+        options = {name: self.settings_dict['OPTIONS'].get(name, default) for name, default in self.POOL_OPTIONS.items()}
+        return get_pool(
+            self.alias, options['pool_size'], options['pool_timeout'],
+            options['pool_check_after'] if self.settings_dict['CONN_HEALTH_CHECKS'] else None,
+        )
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for name in self.POOL_OPTIONS:
+            params.pop(name, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        connected = []
+
+        def connect():
+            connected.append(True)
+            return super(DatabaseWrapper, self).get_new_connection(conn_params)
+
+        connection = self.pool.get(connect, self.usable)
+        # connection_created is sent for every checkout, backend/db/stats.py tells them apart
+        self.from_pool = not connected
+        return connection
+
+    @staticmethod
+    def usable(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Exception:
+            return False
+
+    def _close(self):
+        if self.connection is None:
+            return
+        connection = self.connection
+        status = connection.get_transaction_status()
+        discard = connection.closed or self.errors_occurred or status == extensions.TRANSACTION_STATUS_UNKNOWN
+        if not discard and status != extensions.TRANSACTION_STATUS_IDLE:
+            # don't hand an open transaction to the next thread
+            try:
+                connection.rollback()
+            except Exception:
+                discard = True
+        with self.wrap_database_errors:
+            self.pool.put(connection, discard=discard)
@@ -0,0 +1,75 @@
+import threading
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from backend import metrics
+from .pooled import pool_stats
+
+
+# How often requests find their database connection still open, per process. With
+# persistent connections almost every request reuses one, without them every request
+# that queries opens its own, unless it takes an idle one from the pool.
+_lock = threading.Lock()
+_requests = Counter()
+_opened = Counter()
+_pooled = Counter()
+_reused = Counter()
+
+CONNECTIONS = metrics.Counter(
+    'db_connections_total', 'Database connections opened, taken from the pool, or kept open and reused by a request',
+    ['alias', 'state'],
+)
+
+
+def count_connection(sender, connection, **kwargs):
+    # the pooled backend sends connection_created for every checkout, only some connect
+    pooled = getattr(connection, 'from_pool', False)
+    with _lock:
+        (_pooled if pooled else _opened)[connection.alias] += 1
+    CONNECTIONS.inc(alias=connection.alias, state='pooled' if pooled else 'opened')
+
+
+def stats():
+    with _lock:
+        aliases = sorted(set(_opened) | set(_pooled) | set(_reused) | set(connections))
+        return {
+            'requests': _requests['total'],
+            'connections': {
+                alias: {'opened': _opened[alias], 'pooled': _pooled[alias], 'reused': _reused[alias]} for alias in aliases
+            },
+            'pools': pool_stats(),
+        }
+
+
+class ConnectionStatsMiddleware:
+    """Count the requests and the connections they open or reuse"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(count_connection, dispatch_uid='backend.db.stats')
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # old connections have just been closed by the request_started signal
+        reused = [connection.alias for connection in connections.all(initialized_only=True) if connection.connection is not None]
+        with _lock:
+            _requests['total'] += 1
+            _reused.update(reused)
+        for alias in reused:
+            CONNECTIONS.inc(alias=alias, state='reused')
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # an ASGI request runs its queries on a thread of its own, which starts without
+        # connections: they are all opened, or taken from a pool
+        with _lock:
+            _requests['total'] += 1
+        return await self.get_response(request)
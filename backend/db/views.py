@@ -0,0 +1,13 @@
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .stats import stats
+
+
+class DatabaseStatsView(APIView):
+    """Database connection usage of the worker process answering the request"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(stats())
@@ -0,0 +1,23 @@
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+def add_execute_wrapper(wrapper, connection):
+    """Wrap every query of a connection. The wrapper goes first, so the
+    execute_wrapper() blocks open on the connection still pop their own."""
+    if wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, wrapper)
+
+
+def wrap_connections(wrapper):
+    """add_execute_wrapper() on the connections opened from now on"""
+    def connected(sender, connection, **kwargs):
+        add_execute_wrapper(wrapper, connection)
+    connection_created.connect(connected, weak=False, dispatch_uid=f'{wrapper.__module__}.{wrapper.__qualname__}')
+
+
+def wrap_open_connections(wrapper):
+    """add_execute_wrapper() on the connections of this thread that are already open,
+    like those kept from before the wrapper was installed"""
+    for connection in connections.all(initialized_only=True):
+        add_execute_wrapper(wrapper, connection)
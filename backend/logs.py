@@ -0,0 +1,19 @@
+import json
+import logging
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, with the ``profile`` of backend.profiling passed
+    in ``extra`` as a nested object"""
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if hasattr(record, 'profile'):
+            data['profile'] = record.profile
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
@@ -0,0 +1,385 @@
+import atexit
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+
+from .db.wrappers import wrap_connections, wrap_open_connections
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where gunicorn doesn't run either
+    fcntl = None
+
+
+# Prometheus metrics served on /metrics in the text exposition format. Counters and
+# histograms are kept in the memory of each process. With METRICS_DIR set, as
+# gunicorn.conf.py does, every process also writes its values to a file of its own
+# there, from a thread every FLUSH_SECONDS when they changed and when it exits, and
+# /metrics adds up the files
+# of all the workers and of the management commands. The files of exited processes
+# are folded into ARCHIVE so restarted workers don't pile them up. Gauges, like the
+# outbox queue depth, are read by collectors when /metrics is scraped.
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FLUSH_SECONDS = 5
+ARCHIVE = 'archive.json'
+LOCK_FILE = 'metrics.lock'
+
+_lock = threading.Lock()
+_metrics = {}
+_collectors = []
+# the file of this process in METRICS_DIR, renamed in a forked child, and whether its
+# values changed since they were written there
+_process = {'pid': None, 'file': None, 'retired': False, 'changed': False}
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        with _lock:
+            if name in _metrics:
+                raise ValueError(f"There already is a metric called {name}")
+            _metrics[name] = self
+
+    def key(self, labels):
+        if labels.keys() != set(self.labels):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labels) or 'none'}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def describe(self):
+        return {'kind': self.kind, 'documentation': self.documentation, 'labels': list(self.labels)}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with _lock:
+            check_process()
+            self.values[key] = self.values.get(key, 0) + amount
+        changed()
+
+    def copy_values(self):
+        return dict(self.values)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        # the first bucket whose upper bound the value doesn't exceed, the last one is +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            check_process()
+            counts = self.values.setdefault(key, {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0})
+            counts['buckets'][index] += 1
+            counts['sum'] += value
+        changed()
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def copy_values(self):
+        return {key: {'buckets': list(value['buckets']), 'sum': value['sum']} for key, value in self.values.items()}
+
+    def describe(self):
+        return {**super().describe(), 'buckets': list(self.buckets)}
+
+
+def register_collector(collector):
+    """Add a function returning gauges read when /metrics is scraped, as a list of
+    ``(name, documentation, [(labels, value), ...])``"""
+    _collectors.append(collector)
+    return collector
+
+
+def check_process():
+    # a forked child starts counting from zero, the parent's values are the parent's
+    if _process['pid'] != os.getpid():
+        if _process['pid'] is not None:
+            for metric in _metrics.values():
+                metric.values.clear()
+        _process.update(pid=os.getpid(), file=f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json', retired=False, changed=False)
+        # threads don't survive a fork, every process starts its own
+        if settings.METRICS_DIR:
+            threading.Thread(target=flush_periodically, name='metrics-flush', daemon=True).start()
+
+
+def snapshot():
+    """The values of this process, in the format of the METRICS_DIR files"""
+    with _lock:
+        check_process()
+        return {
+            name: {**metric.describe(), 'values': [[list(key), value] for key, value in metric.copy_values().items()]}
+            for name, metric in _metrics.items()
+        }
+
+
+def merge(total, metrics):
+    """Add the values of a snapshot to ``total``"""
+    for name, metric in metrics.items():
+        values = total.setdefault(name, {**metric, 'values': []})['values']
+        positions = {tuple(key): position for position, (key, _) in enumerate(values)}
+        for key, value in metric['values']:
+            position = positions.get(tuple(key))
+            if position is None:
+                positions[tuple(key)] = len(values)
+                values.append([key, value])
+            elif metric['kind'] == 'histogram':
+                current = values[position][1]
+                values[position][1] = {
+                    'buckets': [a + b for a, b in zip(current['buckets'], value['buckets'])],
+                    'sum': current['sum'] + value['sum'],
+                }
+            else:
+                values[position][1] += value
+    return total
+
+
+def read_json(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        # gone with its process, or a file from an older version
+        return {}
+
+
+def write_json(path, data):
+    temporary = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+
+@contextmanager
+def directory_lock(directory):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), 'a') as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def changed():
+    _process['changed'] = True
+
+
+def flush_periodically():
+    """Write the values of this process every FLUSH_SECONDS if they changed, so those of
+    an idle process are written too"""
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        if not _process['changed'] or _process['retired']:
+            continue
+        try:
+            # not while the process retires or /metrics collects
+            with directory_lock(settings.METRICS_DIR):
+                flush()
+        except OSError:
+            logger.exception("Could not write the metrics to %s", settings.METRICS_DIR)
+
+
+def flush():
+    """Write the values of this process to its file in METRICS_DIR"""
+    _process['changed'] = False
+    data = snapshot()
+    if _process['retired']:
+        # the values are in the archive already
+        return
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    write_json(os.path.join(settings.METRICS_DIR, _process['file']), data)
+
+
+@atexit.register
+def retire():
+    """Fold the values of this process into the archive as it exits"""
+    if not settings.configured or not settings.METRICS_DIR or _process['pid'] != os.getpid() or _process['retired']:
+        return
+    directory = settings.METRICS_DIR
+    with directory_lock(directory):
+        archive = read_json(os.path.join(directory, ARCHIVE))
+        write_json(os.path.join(directory, ARCHIVE), merge(archive, snapshot()))
+        _process['retired'] = True
+        try:
+            os.remove(os.path.join(directory, _process['file']))
+        except FileNotFoundError:
+            pass
+
+
+def collect():
+    """The values of every process, or of this one without METRICS_DIR"""
+    if not settings.METRICS_DIR:
+        return snapshot()
+    directory = settings.METRICS_DIR
+    total = {}
+    with directory_lock(directory):
+        with _lock:
+            check_process()
+        flush()
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.json'):
+                merge(total, read_json(os.path.join(directory, name)))
+    return total
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def render(metrics, gauges=()):
+    """The text exposition format of collected metrics and gauges"""
+    lines = []
+    for name, metric in sorted(metrics.items()):
+        lines.append(f"# HELP {name} {metric['documentation']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for key, value in sorted(metric['values']):
+            labels = dict(zip(metric['labels'], key))
+            if metric['kind'] != 'histogram':
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+                continue
+            count = 0
+            for bound, observations in zip(metric['buckets'] + [math.inf], value['buckets']):
+                count += observations
+                lines.append(f'{name}_bucket{format_labels({**labels, "le": format_value(float(bound))})} {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(value["sum"])}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+    for name, documentation, samples in gauges:
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in samples:
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def collect_gauges():
+    gauges = []
+    for collector in _collectors:
+        try:
+            gauges += collector()
+        except Exception:
+            logger.exception("Metrics collector %s failed", collector.__qualname__)
+    return gauges
+
+
+@require_GET
+def metrics_view(request):
+    """Every metric in the Prometheus text format, for scrapers sending METRICS_TOKEN as a
+    bearer token. Nobody can read them without METRICS_TOKEN set."""
+    if not settings.METRICS_TOKEN or not constant_time_compare(
+        request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}',
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(render(collect(), collect_gauges()), content_type=CONTENT_TYPE)
+
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests answered, by view, action, method and status',
+                   ['view', 'action', 'method', 'status'])
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time taken to answer HTTP requests', ['view', 'action'])
+DB_QUERIES = Counter('db_queries_total', 'SQL queries run by requests', ['alias'])
+DB_QUERY_SECONDS = Histogram('db_query_duration_seconds', 'Time taken by the SQL queries of requests', ['alias'],
+                             buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+
+
+def record_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        alias = context['connection'].alias
+        DB_QUERIES.inc(alias=alias)
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start, alias=alias)
+
+
+def view_labels(request):
+    """The view and action of a request: the viewset and its action, the API view and
+    its method handler or the module and name of a view function"""
+    match = request.resolver_match
+    method = request.method.lower()
+    if match is None:
+        return 'unmatched', method
+    view = match.func
+    cls = getattr(view, 'cls', None) or getattr(view, 'view_class', None)
+    if cls is None:
+        return f'{view.__module__}.{view.__name__}', method
+    return cls.__name__, (getattr(view, 'actions', None) or {}).get(method, method)
+
+
+class MetricsMiddleware:
+    """Count and time every request by view and action and the SQL queries they run"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        wrap_connections(record_query)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        wrap_open_connections(record_query)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        # the connections of an ASGI request are opened for it, wrap_connections() wraps them
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, start)
+        return response
+
+    def observe(self, request, response, start):
+        view, action = view_labels(request)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, view=view, action=action)
+        REQUESTS.inc(view=view, action=action, method=request.method, status=response.status_code)
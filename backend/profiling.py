@@ -0,0 +1,203 @@
+import cProfile
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.crypto import constant_time_compare
+
+from rest_framework.serializers import BaseSerializer
+
+from .db.wrappers import wrap_connections, wrap_open_connections
+
+
+# Where the time of a request goes. ProfilingMiddleware times every request, the SQL
+# queries it runs and the serializers it renders, sends the timings back in a
+# Server-Timing header and logs them for a sample of the requests and for every slow
+# one. Requests carrying PROFILING_HEADER with the PROFILING_TOKEN, and a sample of the
+# others, are also run under cProfile, their profile saved to PROFILING_DIR.
+logger = logging.getLogger(__name__)
+
+# the most repeated queries logged per request
+TOP_QUERIES = 3
+# functions of a profile written to the log
+PROFILE_LINES = 20
+
+_profile = ContextVar('request_profile', default=None)
+# only one cProfile can run at a time
+_profiler_lock = threading.Lock()
+_original_data = BaseSerializer.data
+
+
+class RequestProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.query_count = 0
+        self.query_time = 0.0
+        self.queries = Counter()
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def add_query(self, sql, duration):
+        self.query_count += 1
+        self.query_time += duration
+        self.queries[sql] += 1
+
+    def duplicates(self):
+        """The queries run more than once, by their SQL without the parameters, most repeated first"""
+        return [{'sql': sql, 'count': count} for sql, count in self.queries.most_common(TOP_QUERIES) if count > 1]
+
+
+def record_query(execute, sql, params, many, context):
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - start)
+
+
+def timed_data(self):
+    """BaseSerializer.data, timed, nested serializers are timed with the outermost one"""
+    profile = _profile.get()
+    if profile is None:
+        return _original_data.fget(self)
+    profile.serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_data.fget(self)
+    finally:
+        profile.serializer_depth -= 1
+        if not profile.serializer_depth:
+            profile.serializer_time += time.perf_counter() - start
+
+
+def install():
+    """Time the serializers of every DRF view, async ones included, which render
+    through BaseSerializer.data. Called once by RentingConfig.ready() with PROFILING on."""
+    if BaseSerializer.data is _original_data:
+        BaseSerializer.data = property(timed_data)
+
+
+def response_size(response):
+    if response.streaming:
+        return None
+    return len(response.content)
+
+
+class ProfilingMiddleware:
+    """Time the request, its SQL queries and serializers, see the comment above. Under
+    ASGI cProfile follows the event loop, so it profiles the async views and not the
+    threads the sync ones run in."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        wrap_connections(record_query)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        wrap_open_connections(record_query)
+        profile = RequestProfile()
+        token = _profile.set(profile)
+        profiler = self.start_profiler(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.stop_profiler(profiler)
+            _profile.reset(token)
+        if profiler is not None:
+            self.save_profile(request, profiler)
+        return self.report(request, response, profile)
+
+    async def __acall__(self, request):
+        # the queries of an ASGI request run on a thread of its own, on connections
+        # opened for it, which wrap_connections() wraps
+        profile = RequestProfile()
+        token = _profile.set(profile)
+        profiler = self.start_profiler(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop_profiler(profiler)
+            _profile.reset(token)
+        if profiler is not None:
+            await sync_to_async(self.save_profile)(request, profiler)
+        return self.report(request, response, profile)
+
+    def report(self, request, response, profile):
+        """Send the timings back in the Server-Timing header and log them if the request was slow or sampled"""
+        total = time.perf_counter() - profile.start
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = ', '.join([
+                f'total;dur={total * 1000:.1f}',
+                f'db;dur={profile.query_time * 1000:.1f};desc="{profile.query_count} queries"',
+                f'serializer;dur={profile.serializer_time * 1000:.1f}',
+            ])
+        if total * 1000 >= settings.PROFILING_SLOW_REQUEST_MS or random.random() < settings.PROFILING_LOG_SAMPLE_RATE:
+            logger.info("request profile", extra={'profile': {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'total_ms': round(total * 1000, 2),
+                'db_ms': round(profile.query_time * 1000, 2),
+                'queries': profile.query_count,
+                'duplicate_queries': profile.duplicates(),
+                'serializer_ms': round(profile.serializer_time * 1000, 2),
+                'response_bytes': response_size(response),
+            }})
+        return response
+
+    def start_profiler(self, request):
+        requested = settings.PROFILING_TOKEN and constant_time_compare(
+            request.headers.get(settings.PROFILING_HEADER, ''), settings.PROFILING_TOKEN,
+        )
+        if not (requested or random.random() < settings.PROFILING_PROFILE_SAMPLE_RATE):
+            return None
+        if not _profiler_lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler, like a debugger's, is already running
+            _profiler_lock.release()
+            return None
+        return profiler
+
+    def stop_profiler(self, profiler):
+        if profiler is not None:
+            profiler.disable()
+            _profiler_lock.release()
+
+    def save_profile(self, request, profiler):
+        """Write the profile for snakeviz or pstats and log its slowest functions"""
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        name = '{}-{}-{}-{}.prof'.format(
+            time.strftime('%Y%m%d-%H%M%S'), uuid.uuid4().hex[:8], request.method,
+            request.path.strip('/').replace('/', '_') or 'root',
+        )
+        path = os.path.join(settings.PROFILING_DIR, name)
+        profiler.dump_stats(path)
+        stats = pstats.Stats(profiler)
+        functions = [
+            {'function': pstats.func_std_string(function), 'calls': calls, 'cumulative_ms': round(cumulative * 1000, 2)}
+            for function, (_, calls, _, cumulative, _) in sorted(stats.stats.items(), key=lambda item: -item[1][3])[:PROFILE_LINES]
+        ]
+        logger.info("request cProfile", extra={'profile': {'method': request.method, 'path': request.path, 'file': path, 'functions': functions}})
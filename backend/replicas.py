@@ -0,0 +1,119 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from rest_framework.permissions import SAFE_METHODS
+
+
+# Writes and most reads go to the default database. Views using ReplicaReadMixin
+# serve the actions named in ``replica_actions`` from one of the DATABASE_REPLICAS
+# instead. A client that just wrote something is pinned to the default database for
+# REPLICA_PIN_SECONDS, by a cookie and, once signed in, by their user id, so they
+# always see their own changes even while the replicas lag behind.
+# The user id pins are kept in the default cache, which must be shared by every
+# process like the search cache (see CACHES in backend/settings.py): with a cache
+# local to each worker a signed in client writing through one worker and reading
+# through another on a device without the cookie would read a lagging replica.
+PIN_COOKIE = 'db-pin'
+PIN_CACHE_KEY = 'backend:db-pin:{pk}'
+
+_read_replica = ContextVar('read_replica', default=False)
+
+
+def pin(request, response):
+    """Send the client's reads to the default database for a while"""
+    response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        cache.set(PIN_CACHE_KEY.format(pk=user.pk), True, timeout=settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(request):
+    if PIN_COOKIE in request.COOKIES:
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user is not None and user.is_authenticated and cache.get(PIN_CACHE_KEY.format(pk=user.pk)))
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Read from a replica inside the block, for views that can't use ReplicaReadMixin"""
+    token = _read_replica.set(bool(enabled and settings.DATABASE_REPLICAS))
+    try:
+        yield
+    finally:
+        _read_replica.reset(token)
+
+
+class ReplicaRouter:
+    """Route the reads of replica views to a random replica, everything else to the default database"""
+    def db_for_read(self, model, **hints):
+        if settings.DATABASE_REPLICAS and _read_replica.get():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the default database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinMiddleware:
+    """Pin clients to the default database after a successful write"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.wrote(request, response):
+            pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.wrote(request, response):
+            await sync_to_async(pin)(request, response)
+        return response
+
+    def wrote(self, request, response):
+        return (settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS and response.status_code < 400
+                and not getattr(request, 'read_only', False))
+
+
+class ReplicaReadMixin:
+    """Serve the read only ``replica_actions`` of a viewset from a replica, unless the
+    client is pinned to the default database"""
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.replica_actions:
+            # the actions only read, even when posted to like the search
+            request._request.read_only = True
+            if settings.DATABASE_REPLICAS and not is_pinned(request):
+                self.replica_token = _read_replica.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        token = getattr(self, 'replica_token', None)
+        if token is not None:
+            _read_replica.reset(token)
+            self.replica_token = None
+        return response
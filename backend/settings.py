@@ -51,6 +51,9 @@ INSTALLED_APPS = SYSTEM_APPS + PROJECT_APPS + THIRD_PARTY_APPS
 
 
 MIDDLEWARE = [
+    'backend.metrics.MetricsMiddleware',
+    'backend.profiling.ProfilingMiddleware',
+    'backend.db.stats.ConnectionStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware', # cors headers middleware
@@ -60,6 +63,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'backend.replicas.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -94,12 +98,105 @@ DATABASES = {
         'PASSWORD': os.environ.get('PASSWORD'),
         'NAME': os.environ.get('NAME'),
         'PORT': os.environ.get('PORT'),
+        # seconds a connection is kept open across requests, 0 closes it after every request
+        'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', 60)),
+        # check a kept connection still works before the first query of a request
+        'CONN_HEALTH_CHECKS': os.environ.get('CONN_HEALTH_CHECKS', 'true').lower() in ('1', 'true', 'yes'),
+        'OPTIONS': {},
         # "OPTIONS": {
         #     "init_command": "SET default_storage_engine=INNODB",
         # }
     }
 }
 
+# a pool of PostgreSQL connections shared by the threads of a worker, for gunicorn
+# --threads, connections go back to it after every request, see backend/db/pooled.py
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+if DB_POOL_SIZE and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default'].update(ENGINE='backend.db.pooled_postgresql', CONN_MAX_AGE=0)
+    DATABASES['default']['OPTIONS'].update(
+        pool_size=DB_POOL_SIZE,
+        pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    )
+
+# read replicas of the default database as a comma separated list of host[:port],
+# with REPLICA_USER and REPLICA_PASSWORD when they differ, see backend/replicas.py
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, os.environ.get('REPLICA_HOSTS', '').split(',')), 1):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'USER': os.environ.get('REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.environ.get('REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{number}')
+DATABASE_ROUTERS = ['backend.replicas.ReplicaRouter']
+# seconds a client reads from the default database after writing
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 15))
+
+# serve the read only hot paths with the async views of renting/async_views.py, turned
+# on by gunicorn.conf.py when it runs the ASGI server, with DB_POOL_SIZE or ASGI set
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'false').lower() in ('1', 'true', 'yes')
+
+
+# request timing, see backend/profiling.py, off unless turned on
+PROFILING = os.environ.get('PROFILING', 'false').lower() in ('1', 'true', 'yes')
+# send the timings to clients in a Server-Timing header
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes')
+# share of the requests logged, requests slower than PROFILING_SLOW_REQUEST_MS always are
+PROFILING_LOG_SAMPLE_RATE = float(os.environ.get('PROFILING_LOG_SAMPLE_RATE', 0.01))
+PROFILING_SLOW_REQUEST_MS = float(os.environ.get('PROFILING_SLOW_REQUEST_MS', 1000))
+# share of the requests run under cProfile, and those sent with PROFILING_HEADER set
+# to PROFILING_TOKEN, the profiles are saved to PROFILING_DIR
+PROFILING_PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILING_PROFILE_SAMPLE_RATE', 0))
+PROFILING_HEADER = 'X-Profile'
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')
+PROFILING_DIR = os.environ.get('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+# the request profiles are written as JSON lines to stderr, see backend/logs.py
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'backend.logs.JSONFormatter'},
+    },
+    'handlers': {
+        'json': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'backend.profiling': {'handlers': ['json'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Prometheus metrics on /metrics, see backend/metrics.py. Processes sharing a
+# METRICS_DIR, like the gunicorn workers, report their metrics together. Scrapers
+# must send METRICS_TOKEN as a bearer token, /metrics is closed while it's unset.
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The version counters of renting/cache.py, the cached users of JWT authentication
+# and the replica pins live in this cache, so every process must share it: the local
+# memory default only suits a single process like runserver. gunicorn.conf.py falls back
+# to a cache in files shared by the workers of the host, which can cull the counters
+# and pins with the other entries: production needs one like
+# django.core.cache.backends.redis.RedisCache in CACHE_BACKEND.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+if os.environ.get('CACHE_MAX_ENTRIES'):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.environ['CACHE_MAX_ENTRIES'])}
+# seconds anonymous rental search results are cached for, also sent as max-age on GET searches
+SEARCH_CACHE_TIMEOUT = int(os.environ.get('SEARCH_CACHE_TIMEOUT', 60))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -143,6 +240,23 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 # storage for files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# media files are stored under their content hash and shared, see renting/storage.py
+DEFAULT_FILE_STORAGE = 'renting.storage.ContentAddressedStorage'
+
+# renditions generated for uploaded images, see renting/images.py
+IMAGE_RENDITION_WIDTHS = [320, 640, 1280]
+# background threads generating them, 0 generates them on commit in the request thread
+IMAGE_PROCESSING_WORKERS = int(os.environ.get('IMAGE_PROCESSING_WORKERS', 2))
+
+# storage the chunks of resumable property image uploads are written to until the upload
+# completes, and their size limit, see renting/uploads.py. An upload only resumes on the
+# instances sharing this storage, like they share the media one: with several hosts use
+# a storage they all reach, e.g. storages.backends.s3.S3Storage.
+CHUNKED_UPLOAD_STORAGE = {
+    'BACKEND': os.environ.get('CHUNKED_UPLOAD_STORAGE', 'django.core.files.storage.FileSystemStorage'),
+    'OPTIONS': {'location': os.environ.get('CHUNKED_UPLOAD_DIR', os.path.join(BASE_DIR, 'uploads'))},
+}
+CHUNKED_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -156,8 +270,9 @@ swappable = 'AUTH_USER_MODEL'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        # the admin signs in with a session, the API with tokens, see users/authentication.py
+        'users.authentication.JWTAuthentication',
         'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_RENDERER_CLASSES': (
         'rest_framework.renderers.JSONRenderer',
@@ -190,6 +305,8 @@ SPECTACULAR_SETTINGS = {
 JWT_AUTH = {
     'JWT_EXPIRATION_DELTA': datetime.timedelta(hours=1),
     'JWT_REFRESH_EXPIRATION_DELTA': datetime.timedelta(days=7),
+    # seconds the user of a token is cached for
+    'JWT_USER_CACHE_TIMEOUT': 60,
     # Other...
 }
 REST_AUTH = {
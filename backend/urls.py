@@ -3,12 +3,17 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from backend.db.views import DatabaseStatsView
+from backend.metrics import metrics_view
+
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/rental/', include('renting.urls')),
     path('api/auth/', include('users.urls')),
+    path('api/db-stats/', DatabaseStatsView.as_view(), name='db-stats'),
+    path('metrics', metrics_view, name='metrics'),
 
     # # Optional API:
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
@@ -0,0 +1,66 @@
+# gunicorn -c gunicorn.conf.py
+#
+# With a pool of PostgreSQL connections (DB_POOL_SIZE, see backend/db/pooled.py) Uvicorn
+# workers run the ASGI application, each serving many requests at once: the async views
+# of renting/async_views.py wait on the database and the cache without holding the
+# worker, the other views run in threads. Under ASGI every request runs its queries on
+# a thread of its own, so connections can't be kept per thread and only the pool reuses
+# them. Without a pool, like on MySQL, sync workers run the WSGI application and keep
+# their connections for CONN_MAX_AGE. ASGI=true or false chooses either way.
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+asgi = os.environ.get('ASGI', 'true' if os.environ.get('DB_POOL_SIZE') else 'false').lower() in ('1', 'true', 'yes')
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+# restart workers now and then so a slow leak can't grow for ever
+max_requests = 2000
+max_requests_jitter = 200
+
+raw_env = []
+if asgi:
+    wsgi_app = 'backend.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    raw_env += ['ASYNC_VIEWS=' + os.environ.get('ASYNC_VIEWS', 'true'), 'CONN_MAX_AGE=0']
+else:
+    wsgi_app = 'backend.wsgi:application'
+
+# the workers must share the cache, see CACHES in backend/settings.py: unless told
+# otherwise they use one kept in files, which the workers of this host share. It culls
+# a third of its entries at random once it holds CACHE_MAX_ENTRIES, version counters
+# and replica pins included, and its incr() isn't atomic across processes, so set
+# CACHE_BACKEND to Redis or Memcached in production.
+file_cache = 'CACHE_BACKEND' not in os.environ
+if file_cache:
+    raw_env += [
+        'CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache',
+        'CACHE_LOCATION=' + os.environ.get('CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'find_renting_cache')),
+        # the default of 300 would cull on every few searches, counting the files
+        # on every write gets slower with more
+        'CACHE_MAX_ENTRIES=' + os.environ.get('CACHE_MAX_ENTRIES', '20000'),
+    ]
+
+# the workers write their metrics there for /metrics to add up, see backend/metrics.py
+metrics_dir = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'find_renting_metrics'))
+raw_env.append('METRICS_DIR=' + metrics_dir)
+
+
+def on_starting(server):
+    # counters start from zero with the server, like those of a single process
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    if workers > 1 and 'locmem' in os.environ.get('CACHE_BACKEND', '').lower():
+        raise RuntimeError(
+            f"CACHE_BACKEND is the local memory cache, which the {workers} workers don't share: "
+            "invalidations and replica pins would only reach the worker they happen in"
+        )
+    if workers > 1 and file_cache:
+        server.log.warning(
+            "No CACHE_BACKEND set, the %d workers share a cache in files, which can lose the "
+            "search version counters and replica pins: set it to Redis or Memcached", workers,
+        )
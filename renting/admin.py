@@ -1,5 +1,45 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.forms.models import BaseInlineFormSet
 from renting.models import *
+from renting.bulk import MESSAGE_COLUMNS, PAYMENT_COLUMNS, PROPERTY_COLUMNS, export_response
+from renting.search import search_properties
+
+
+def export_csv_action(columns, filename):
+    """An admin action streaming the selected rows, or the whole filtered list with
+    "select all", as CSV"""
+    @admin.action(description="Export selected %(verbose_name_plural)s as CSV")
+    def export_csv(modeladmin, request, queryset):
+        return export_response(request, queryset, columns, filename)
+    return export_csv
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """Edits one page of the related objects, chosen with ?<prefix>-page="""
+    per_page = 20
+    page_param = 'page'
+    page_number = None
+
+    def get_queryset(self):
+        if not hasattr(self, 'page'):
+            self.paginator = Paginator(super().get_queryset(), self.per_page)
+            self.page = self.paginator.get_page(self.page_number)
+            self.page_range = self.paginator.get_elided_page_range(self.page.number)
+        return self.page.object_list
+
+
+class PaginatedInline(admin.TabularInline):
+    formset = PaginatedInlineFormSet
+    template = 'admin/edit_inline/paginated_tabular.html'
+    per_page = 20
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.per_page = self.per_page
+        formset.page_param = f'{formset.get_default_prefix()}-page'
+        formset.page_number = request.GET.get(formset.page_param)
+        return formset
 
 
 # Register your models here.
@@ -11,55 +51,78 @@ class ManagerInline(admin.StackedInline):
 
 class UserLocationInline(admin.StackedInline):
     model = UserLocation
+    # thousands of cells, don't render them all as select options
+    autocomplete_fields = ('province', 'district', 'sector', 'cell',)
 
-class PropertyImageInline(admin.StackedInline):
+class PropertyImageInline(PaginatedInline):
     model = PropertyImages
+    fields = ('property_image', 'image',)
+    readonly_fields = ('image',)
     extra = 0
 
-class PropertyInline(admin.StackedInline):
+    def get_queryset(self, request):
+        # each row is labelled with the image's __str__, which includes the property
+        return super().get_queryset(request).select_related('property')
+
+class PropertyInline(PaginatedInline):
+    """The properties of a landlord or type, edited in full on their own page"""
     model = Property
-    inlines = [PropertyImageInline]
+    fields = ('title', 'property_type', 'district', 'renting_price', 'status',)
+    readonly_fields = ('property_type', 'district',)
+    show_change_link = True
     extra = 0
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('property_type', 'district')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 
 @admin.register(UserLocation)
 class UserLocationAdmin(admin.ModelAdmin):
     list_display = ('user', 'province', 'district', 'sector','cell',)
+    list_select_related = ('user', 'province', 'district', 'sector', 'cell',)
     list_filter = ('province', 'district',)
+    autocomplete_fields = ('user', 'province', 'district', 'sector', 'cell',)
     fieldsets = (
         ('LANDLORD INFO', {'fields': ('user', 'province', 'district','sector','cell',)}),
     )
     add_fieldsets = (
         ('REGISTER LANDLORD', {'fields': ('user', 'province', 'district','sector','cell',)}),
     )
-    search_fields = ('user',)
+    search_fields = ('user__email', 'user__first_name', 'user__last_name',)
     ordering = ('user',)
 
 
 @admin.register(Manager)
 class ManagerAdmin(admin.ModelAdmin):
     list_display = ('user', 'gender', 'phone_number', 'image',)
+    list_select_related = ('user',)
     list_filter = ('gender',)
+    autocomplete_fields = ('user',)
     fieldsets = (
         ('MANAGER INFO', {'fields': ('user', 'gender', 'phone_number','profile_image','image',)}),
     )
     add_fieldsets = (
         ('REGISTER MANAGER', {'fields': ('user', 'gender', 'phone_number','profile_image','image',)}),
     )
-    search_fields = ('user',)
+    search_fields = ('user__email', 'user__first_name', 'user__last_name',)
     ordering = ('user',)
 
 @admin.register(Landlord)
 class LandlordAdmin(admin.ModelAdmin):
     list_display = ('user', 'gender', 'phone_number', 'image',)
+    list_select_related = ('user',)
     list_filter = ('gender',)
+    autocomplete_fields = ('user',)
     fieldsets = (
         ('LANDLORD INFO', {'fields': ('user', 'gender', 'phone_number','profile_image',)}),
     )
     add_fieldsets = (
         ('REGISTER LANDLORD', {'fields': ('user', 'gender', 'phone_number','profile_image',)}),
     )
-    search_fields = ('user',)
+    search_fields = ('user__email', 'user__first_name', 'user__last_name',)
     ordering = ('user__email',)
     inlines = [PropertyInline]
 
@@ -84,7 +147,7 @@ class PropertyTypeAdmin(admin.ModelAdmin):
 
 @admin.register(Property)
 class PropertyAdmin(admin.ModelAdmin):
-    autocomplete_fields = ('property_type',)
+    autocomplete_fields = ('property_type', 'landlord', 'province', 'district', 'sector', 'cell',)
     list_display = ('title','description','renting_price','bedrooms','bathrooms','floors','is_furnished', 'status', 'created_date',)
     list_filter = ('district','property_type','bedrooms','bathrooms','floors','is_furnished',)
     fieldsets = (
@@ -100,12 +163,19 @@ class PropertyAdmin(admin.ModelAdmin):
     search_fields = ('landlord','title',)
     ordering = ('property_type','district',)
     inlines = [PropertyImageInline]
+    actions = [export_csv_action(PROPERTY_COLUMNS, 'properties')]
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_properties(queryset, search_term), False
 
 
 @admin.register(PropertyImages)
 class PropertyImagesAdmin(admin.ModelAdmin):
     list_display = ('property','image',)
-    list_filter = ('property',)
+    list_select_related = ('property',)
+    autocomplete_fields = ('property',)
     fieldsets = (
         ('PROPERTY IMAGES', {'fields': ('property',)}),
         (None, {'fields': ('property_image',)}),
@@ -114,14 +184,17 @@ class PropertyImagesAdmin(admin.ModelAdmin):
         ('Property', {'fields': ('property',)}),
         ('Image', {'fields': ('property_image',)}),
     )
-    search_fields = ('property',)
+    search_fields = ('property__title',)
     ordering = ('property',)
 
 
 @admin.register(PublishingPayment)
 class PublishingPaymentAdmin(admin.ModelAdmin):
     list_display = ('property', 'landlord', 'payment_amount', 'payment_method','created_date',)
-    list_filter = ('property', 'landlord', 'payment_method',)
+    list_select_related = ('property', 'landlord__user',)
+    # filtering by property or landlord would list every one of them, search instead
+    list_filter = ('payment_method', 'created_date',)
+    autocomplete_fields = ('property', 'landlord',)
     fieldsets = (
         ('PUBLISHED PAYMENT', {'fields': ('property', 'landlord', 'payment_amount', 'payment_method',)}),
     )
@@ -131,11 +204,24 @@ class PublishingPaymentAdmin(admin.ModelAdmin):
             'fields': ('property', 'landlord', 'payment_amount', 'payment_method',),
         }),
     )
-    search_fields = ('property', 'landlord', 'payment_method',)
+    search_fields = ('property__title', 'landlord__user__email', 'payment_method',)
     ordering = ('payment_method',)
+    actions = [export_csv_action(PAYMENT_COLUMNS, 'publishing_payments')]
+
+
+@admin.register(GetInTouch)
+class GetInTouchAdmin(admin.ModelAdmin):
+    list_display = ('first_name', 'last_name', 'email', 'subject', 'is_read', 'created_date',)
+    list_filter = ('is_read', 'created_date',)
+    fieldsets = (
+        ('MESSAGE', {'fields': ('first_name', 'last_name', 'email', 'subject', 'message', 'is_read',)}),
+    )
+    search_fields = ('first_name', 'last_name', 'email', 'subject',)
+    ordering = ('-created_date',)
+    actions = [export_csv_action(MESSAGE_COLUMNS, 'messages')]
 
 
-class DistrictInline(admin.TabularInline):
+class DistrictInline(PaginatedInline):
     model = District
     extra = 0
 @admin.register(Province)
@@ -153,12 +239,13 @@ class ProvinceAdmin(admin.ModelAdmin):
         DistrictInline,
     ]
 
-class SectorInline(admin.TabularInline):
+class SectorInline(PaginatedInline):
     model = Sector
     extra = 0
 @admin.register(District)
 class DistrictAdmin(admin.ModelAdmin):
     list_display = ('district_name','province',)
+    list_select_related = ('province',)
     list_filter = ('province',)
     fieldsets = (
         ('DISTRICT', {'fields': ('province','district_name',)}),
@@ -166,19 +253,20 @@ class DistrictAdmin(admin.ModelAdmin):
     add_fieldsets = (
         ('NEW DISTRICT', {'fields': ('province','district_name',)}),
     )
-    search_fields = ('province','district_name',)
+    search_fields = ('province__province_name','district_name',)
     ordering = ('province',)
     inlines = [
         SectorInline,
     ]
 
 
-class CellInline(admin.TabularInline):
+class CellInline(PaginatedInline):
     model = Cell
     extra = 0
 @admin.register(Sector)
 class SectorAdmin(admin.ModelAdmin):
     list_display = ('sector_name','district',)
+    list_select_related = ('district',)
     list_filter = ('district',)
     fieldsets = (
         ('SECTOR', {'fields': ('district','sector_name',)}),
@@ -186,7 +274,7 @@ class SectorAdmin(admin.ModelAdmin):
     add_fieldsets = (
         ('NEW SECTOR', {'fields': ('district','sector_name',)}),
     )
-    search_fields = ('district','sector_name',)
+    search_fields = ('district__district_name','sector_name',)
     ordering = ('district',)
     inlines = [
         CellInline,
@@ -197,14 +285,16 @@ class SectorAdmin(admin.ModelAdmin):
 @admin.register(Cell)
 class CellAdmin(admin.ModelAdmin):
     list_display = ('cell_name','sector',)
-    list_filter = ('sector',)
+    list_select_related = ('sector',)
+    list_filter = ('sector__district',)
+    autocomplete_fields = ('sector',)
     fieldsets = (
         ('CELL', {'fields': ('sector','cell_name',)}),
     )
     add_fieldsets = (
         ('NEW CELL', {'fields': ('sector','cell_name',)}),
     )
-    search_fields = ('sector','cell_name',)
+    search_fields = ('sector__sector_name','cell_name',)
     ordering = ('sector',)
 
 
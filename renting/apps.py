@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class RentingConfig(AppConfig):
@@ -7,3 +8,6 @@ class RentingConfig(AppConfig):
 
     def ready(self):
         import renting.signals.handler
+        if settings.PROFILING:
+            from backend import profiling
+            profiling.install()
@@ -0,0 +1,153 @@
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from backend.replicas import is_pinned, replica_reads
+from . import cache, locations
+from .filters import LISTING_FACET_NAMES, aproperty_facets, filter_properties, search_ordering
+from .models import Cell, SearchListing, Sector, Testimonial
+from .pagination import KeysetPagination
+from .serializers import CellSerializer, RentalSearchSerializer, SearchListingSerializer, SectorSerializer, TestimonialSerializer
+from .views import TestimonialViewSet, rendered_response
+
+
+# Async versions of the read only hot paths, routed in front of their DRF viewsets when
+# settings.ASYNC_VIEWS is on, as it is under the ASGI server, see gunicorn.conf.py.
+# DRF has no async views, so these parse, authenticate and render like DRF by hand
+# and always answer JSON. Authentication and the cache run in a worker thread, the
+# queries go through the async ORM.
+
+def json_response(data, status=200, headers=None):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json', headers=headers)
+
+
+def api_view(methods):
+    """Turn an async function taking a DRF request into a view, which answers errors like DRF"""
+    def decorator(function):
+        @functools.wraps(function)
+        async def view(request, *args, **kwargs):
+            request = Request(
+                request,
+                parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+                authenticators=[authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+            )
+            try:
+                if request.method not in methods:
+                    raise exceptions.MethodNotAllowed(request.method)
+                # authenticating may read the user from the cache or the database
+                await sync_to_async(lambda: request.user)()
+                return await function(request, *args, **kwargs)
+            except exceptions.APIException as error:
+                response = exception_handler(error, {'request': request})
+                headers = {name: value for name, value in response.items() if name.lower() != 'content-type'}
+                if response.status_code == 401:
+                    headers['WWW-Authenticate'] = request.authenticators[0].authenticate_header(request)
+                return json_response(response.data, response.status_code, headers)
+        # like DRF's views, which check the CSRF token when a session authenticates;
+        # csrf_exempt() would hide that the view is async before Django 5
+        view.csrf_exempt = True
+        return view
+    return decorator
+
+
+async def read_from_replica(request):
+    """Whether the request may read from a replica, it can't if the client just wrote something"""
+    return not await sync_to_async(is_pinned)(request)
+
+
+@api_view(['GET', 'HEAD', 'POST'])
+async def search(request):
+    """SearchRentalViewSet.search"""
+    # a posted search only reads, it doesn't pin the client to the default database
+    request._request.read_only = True
+    serializer = RentalSearchSerializer(data=request.query_params if request.method != 'POST' else request.data)
+    serializer.is_valid(raise_exception=True)
+    data = serializer.validated_data
+
+    cache_key = None
+    if not request.user.is_authenticated:
+        cache_key = await sync_to_async(cache.search_cache_key)(request, data)
+        results = await sync_to_async(cache.get_search_results)(cache_key)
+        if results is not None:
+            return search_response(request, results)
+
+    # results going to the shared cache are read from the default database
+    with replica_reads(cache_key is None and await read_from_replica(request)):
+        queryset = filter_properties(SearchListing.objects.all(), data)
+        queryset = queryset.order_by(*search_ordering(data['ordering']))
+        context = {'request': request}
+        paginator = KeysetPagination()
+        page = await paginator.apaginate_queryset(queryset, request)
+        if page is not None:
+            results = paginator.get_paginated_response(SearchListingSerializer(page, many=True, context=context).data).data
+        else:
+            results = SearchListingSerializer([obj async for obj in queryset], many=True, context=context).data
+        if data['facets'] and page is not None:
+            results['facets'] = await aproperty_facets(SearchListing.objects.all(), data, LISTING_FACET_NAMES)
+
+    if cache_key is not None:
+        await sync_to_async(cache.set_search_results)(cache_key, results)
+    return search_response(request, results)
+
+
+def search_response(request, results):
+    response = json_response(results)
+    if request.method != 'POST':
+        patch_cache_control(response, public=True, max_age=settings.SEARCH_CACHE_TIMEOUT)
+    return response
+
+
+@api_view(['GET', 'HEAD'])
+async def location_tree(request):
+    """LocationTreeViewSet.list"""
+    return rendered_response(request, *await sync_to_async(locations.get_rendered)('tree'))
+
+
+@api_view(['GET', 'HEAD'])
+async def district_list(request):
+    """DistrictViewSet.list"""
+    return rendered_response(request, *await sync_to_async(locations.get_rendered)('districts'))
+
+
+@api_view(['GET', 'HEAD'])
+async def sector_list(request, district_pk):
+    """SectorViewSet.list"""
+    with replica_reads(await read_from_replica(request)):
+        sectors = [sector async for sector in Sector.objects.prefetch_related('cells').filter(district__pk=district_pk)]
+    return json_response(SectorSerializer(sectors, many=True, context={'request': request}).data)
+
+
+@api_view(['GET', 'HEAD'])
+async def cell_list(request, district_pk, sector_pk):
+    """CellViewSet.list"""
+    with replica_reads(await read_from_replica(request)):
+        cells = [cell async for cell in Cell.objects.filter(sector__district_id=district_pk, sector_id=sector_pk)]
+    return json_response(CellSerializer(cells, many=True, context={'request': request}).data)
+
+
+@api_view(['GET', 'HEAD'])
+async def testimonial_list(request):
+    """TestimonialViewSet.list"""
+    with replica_reads(await read_from_replica(request)):
+        testimonials = [testimonial async for testimonial in Testimonial.objects.all()]
+    return json_response(TestimonialSerializer(testimonials, many=True, context={'request': request}).data)
+
+
+testimonial_create = TestimonialViewSet.as_view({'post': 'create'})
+
+
+async def testimonials(request):
+    """Testimonials are listed by the async view and created by the DRF one"""
+    if request.method in ('GET', 'HEAD'):
+        return await testimonial_list(request)
+    return await sync_to_async(testimonial_create)(request)
+testimonials.csrf_exempt = True
@@ -0,0 +1,320 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from . import listings, locations, search
+from .cache import invalidate_search_results
+from .models import (
+    Province, District, Sector, Cell, UserLocation, Landlord, PropertyType, Property, PropertyImages,
+)
+
+User = get_user_model()
+
+
+# A reproducible benchmark: seed() fills an empty database with realistic volumes and
+# run() times a few scripted scenarios against it through the whole middleware stack,
+# reporting throughput, latency percentiles and queries per request. The same seed
+# gives the same rows and the same requests, so runs on different commits compare.
+# See the seed_benchmark_data and run_benchmarks commands.
+BATCH_SIZE = 1000
+PASSWORD = 'benchmark-password'
+
+DEFAULT_USERS = 50000
+DEFAULT_PROPERTIES = 100000
+DEFAULT_IMAGES = 500000
+# one user in five is a landlord
+LANDLORD_RATIO = 5
+
+# Rwanda's provinces and districts with the rough centre of each district. Sectors and
+# cells have the country's real counts but generated names and positions.
+DISTRICTS = {
+    'Kigali City': [
+        ('Gasabo', -1.88, 30.13), ('Kicukiro', -1.99, 30.10), ('Nyarugenge', -1.96, 30.05),
+    ],
+    'Northern Province': [
+        ('Burera', -1.47, 29.83), ('Gakenke', -1.69, 29.78), ('Gicumbi', -1.58, 30.06),
+        ('Musanze', -1.50, 29.60), ('Rulindo', -1.73, 29.99),
+    ],
+    'Southern Province': [
+        ('Gisagara', -2.60, 29.83), ('Huye', -2.60, 29.74), ('Kamonyi', -2.00, 29.90),
+        ('Muhanga', -2.08, 29.75), ('Nyamagabe', -2.47, 29.50), ('Nyanza', -2.35, 29.75),
+        ('Nyaruguru', -2.66, 29.50), ('Ruhango', -2.22, 29.78),
+    ],
+    'Eastern Province': [
+        ('Bugesera', -2.22, 30.15), ('Gatsibo', -1.58, 30.43), ('Kayonza', -1.90, 30.50),
+        ('Kirehe', -2.27, 30.65), ('Ngoma', -2.16, 30.47), ('Nyagatare', -1.30, 30.33),
+        ('Rwamagana', -1.95, 30.43),
+    ],
+    'Western Province': [
+        ('Karongi', -2.06, 29.35), ('Ngororero', -1.87, 29.62), ('Nyabihu', -1.65, 29.51),
+        ('Nyamasheke', -2.33, 29.13), ('Rubavu', -1.68, 29.33), ('Rusizi', -2.48, 28.90),
+        ('Rutsiro', -1.93, 29.33),
+    ],
+}
+SECTOR_COUNT = 416
+CELL_COUNT = 2148
+
+PROPERTY_TYPES = ['Apartment', 'House', 'Studio', 'Villa', 'Room', 'Commercial']
+FEATURES = ['garden', 'balcony', 'parking', 'view', 'furnished', 'quiet', 'modern', 'spacious', 'secure', 'pool']
+FIRST_NAMES = ['Jean', 'Marie', 'Eric', 'Alice', 'Patrick', 'Grace', 'Claude', 'Diane', 'Olivier', 'Aline']
+LAST_NAMES = ['Uwimana', 'Mugisha', 'Niyonzima', 'Habimana', 'Mukamana', 'Nshimiyimana', 'Ingabire', 'Hakizimana']
+
+
+def spread(total, buckets):
+    """Split ``total`` into ``buckets`` counts differing by at most one"""
+    return [total // buckets + (number < total % buckets) for number in range(buckets)]
+
+
+def insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        model.objects.bulk_create(rows[start:start + BATCH_SIZE])
+
+
+def insert_batches(model, rows):
+    """bulk_create the rows of a generator without holding them all in memory"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def seed_locations(rng):
+    provinces = [Province(province_name=name) for name in DISTRICTS]
+    insert(Province, provinces)
+    provinces = {province.province_name: province for province in Province.objects.all()}
+    insert(District, [
+        District(province=provinces[province], district_name=name)
+        for province, districts in DISTRICTS.items() for name, _, _ in districts
+    ])
+    centres = {name: (latitude, longitude) for districts in DISTRICTS.values() for name, latitude, longitude in districts}
+    districts = list(District.objects.order_by('pk'))
+
+    sectors = []
+    for district, count in zip(districts, spread(SECTOR_COUNT, len(districts))):
+        latitude, longitude = centres[district.district_name]
+        sectors += [
+            Sector(
+                district=district, sector_name=f'{district.district_name} Sector {number + 1}',
+                latitude=round(latitude + rng.uniform(-0.08, 0.08), 6), longitude=round(longitude + rng.uniform(-0.08, 0.08), 6),
+            )
+            for number in range(count)
+        ]
+    insert(Sector, sectors)
+    sectors = list(Sector.objects.order_by('pk'))
+
+    cells = []
+    for sector, count in zip(sectors, spread(CELL_COUNT, len(sectors))):
+        cells += [
+            Cell(
+                sector=sector, cell_name=f'{sector.sector_name} Cell {number + 1}',
+                latitude=round(sector.latitude + rng.uniform(-0.02, 0.02), 6), longitude=round(sector.longitude + rng.uniform(-0.02, 0.02), 6),
+            )
+            for number in range(count)
+        ]
+    insert(Cell, cells)
+    return list(Cell.objects.select_related('sector__district').order_by('pk'))
+
+
+def seed_users(rng, count):
+    """Create ``count`` users, one in LANDLORD_RATIO a landlord, all with PASSWORD"""
+    # hashing once keeps seeding fast, logging in still checks the hash at full cost
+    password = make_password(PASSWORD)
+    insert_batches(User, (
+        User(
+            first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES), email=f'user{number}@example.com',
+            password=password, is_landlord=number % LANDLORD_RATIO == 0,
+        )
+        for number in range(count)
+    ))
+    # bulk_create skips the post_save signal creating the landlord profiles
+    landlord_users = list(User.objects.filter(is_landlord=True).order_by('pk').values_list('pk', flat=True))
+    insert_batches(Landlord, (
+        Landlord(user_id=pk, gender='', phone_number='', profile_image='') for pk in landlord_users
+    ))
+    insert_batches(UserLocation, (UserLocation(user_id=pk) for pk in landlord_users))
+    return list(Landlord.objects.order_by('pk').values_list('pk', flat=True))
+
+
+def seed_properties(rng, count, landlords, cells, property_types):
+    def rows():
+        for number in range(count):
+            cell = rng.choice(cells)
+            sector = cell.sector
+            features = rng.sample(FEATURES, 3)
+            bedrooms = rng.randint(1, 6)
+            # most properties are placed on the map, the others show at their cell's centroid
+            placed = rng.random() < 0.7
+            yield Property(
+                landlord_id=rng.choice(landlords), property_type=rng.choice(property_types),
+                title=f'{features[0].title()} {bedrooms} bedroom home in {sector.sector_name}',
+                description=f'A {" and ".join(features)} place with {bedrooms} bedrooms near {cell.cell_name}.',
+                bedrooms=bedrooms, bathrooms=rng.randint(1, bedrooms), is_furnished=rng.random() < 0.3,
+                floors=rng.randint(1, 3), plot_size=str(rng.randrange(100, 2000, 50)),
+                renting_price=rng.randrange(50000, 1500000, 5000), status=rng.random() < 0.85,
+                province_id=sector.district.province_id, district_id=sector.district_id, sector=sector, cell=cell,
+                street=f'KG {rng.randint(1, 999)} St',
+                latitude=round(cell.latitude + rng.uniform(-0.005, 0.005), 6) if placed else None,
+                longitude=round(cell.longitude + rng.uniform(-0.005, 0.005), 6) if placed else None,
+            )
+    insert_batches(Property, rows())
+    return list(Property.objects.order_by('pk').values_list('pk', flat=True))
+
+
+def seed(users=DEFAULT_USERS, properties=DEFAULT_PROPERTIES, images=DEFAULT_IMAGES, seed=0, log=None):
+    """Fill an empty database with the full location tree, ``users`` users, ``properties``
+    properties and ``images`` images, returns the number of rows of each"""
+    log = log or (lambda message: None)
+    if Province.objects.exists() or User.objects.exists():
+        raise ValueError("Seed an empty database, e.g. a new one just migrated.")
+    rng = random.Random(seed)
+    with transaction.atomic():
+        cells = seed_locations(rng)
+        log(f"{len(cells)} cells")
+        insert(PropertyType, [PropertyType(type_name=name) for name in PROPERTY_TYPES])
+        property_types = list(PropertyType.objects.order_by('pk'))
+        landlords = seed_users(rng, max(users, 1))
+        log(f"{max(users, 1)} users, {len(landlords)} landlords")
+        property_ids = seed_properties(rng, properties, landlords, cells, property_types)
+        log(f"{len(property_ids)} properties")
+        if property_ids:
+            insert_batches(PropertyImages, (
+                PropertyImages(property_id=property_ids[number % len(property_ids)], property_image=f'properties/benchmark/{number}.jpg')
+                for number in range(images)
+            ))
+        log(f"{images if property_ids else 0} images")
+    # the rows were bulk created, so nothing refreshed the read models
+    listings.rebuild()
+    search.index_properties()
+    locations.invalidate()
+    invalidate_search_results()
+    log("search listings and index rebuilt")
+    return counts()
+
+
+def counts():
+    return {
+        'users': User.objects.count(),
+        'properties': Property.objects.count(),
+        'images': PropertyImages.objects.count(),
+        'cells': Cell.objects.count(),
+    }
+
+
+def sample(rng, size=500):
+    """Random properties, landlords and places for the scenarios to request"""
+    bounds = Property.objects.aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+        raise ValueError("The database has no properties, run seed_benchmark_data first.")
+    ids = {rng.randint(bounds['first'], bounds['last']) for _ in range(size)}
+    properties = list(Property.objects.filter(pk__in=ids).values_list('pk', 'landlord_id', 'landlord__user_id').order_by('pk'))
+    return {
+        'properties': properties,
+        'emails': list(User.objects.filter(pk__in=[user for _, _, user in properties]).values_list('email', flat=True).order_by('pk')),
+        'districts': list(District.objects.order_by('pk').values_list('pk', flat=True)),
+        'cells': list(Cell.objects.exclude(latitude=None).order_by('pk').values_list('latitude', 'longitude')[:size]),
+        'property_types': list(PropertyType.objects.order_by('pk').values_list('pk', flat=True)),
+    }
+
+
+# every scenario returns the (method, path, data) of its next request
+
+def search_request(rng, data):
+    params = {'page_size': 20}
+    kind = rng.randrange(4)
+    if kind == 0:
+        min_price = rng.randrange(50000, 500000, 5000)
+        params.update(district=rng.choice(data['districts']), min_price=min_price, max_price=min_price + 300000)
+    elif kind == 1:
+        params.update(q=' '.join(rng.sample(FEATURES, 2)), ordering='relevance')
+    elif kind == 2:
+        latitude, longitude = rng.choice(data['cells'])
+        params.update(latitude=latitude, longitude=longitude, radius=rng.choice([2, 5, 10]))
+    else:
+        params.update(property_type=rng.choice(data['property_types']), min_bedrooms=rng.randint(1, 4), facets='true', ordering='-renting_price')
+    return 'get', '/api/rental/find_renting/search/', params
+
+
+def property_detail_request(rng, data):
+    pk, landlord, user = rng.choice(data['properties'])
+    return 'get', f'/api/auth/users/{user}/landlord/{landlord}/properties/{pk}/', None
+
+
+def location_tree_request(rng, data):
+    return 'get', '/api/rental/locations/', None
+
+
+def login_request(rng, data):
+    return 'post', '/api/auth/login/', {'email': rng.choice(data['emails']), 'password': PASSWORD}
+
+
+def image_listing_request(rng, data):
+    pk, landlord, user = rng.choice(data['properties'])
+    return 'get', f'/api/auth/users/{user}/landlord/{landlord}/properties/{pk}/images/', None
+
+
+SCENARIOS = {
+    'search': search_request,
+    'property_detail': property_detail_request,
+    'location_tree': location_tree_request,
+    'login': login_request,
+    'image_listing': image_listing_request,
+}
+
+
+def percentile(timings, value):
+    return timings[min(int(len(timings) * value), len(timings) - 1)]
+
+
+def run_scenario(request, data, iterations, warmup=5, seed=0):
+    """Send ``iterations`` requests of a scenario and measure them, after ``warmup`` unmeasured ones"""
+    rng = random.Random(seed)
+    client = Client()
+    # every scenario starts from cold caches
+    cache.clear()
+    locations.invalidate()
+    timings, queries, errors = [], [], 0
+    for number in range(warmup + iterations):
+        method, path, params = request(rng, data)
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = getattr(client, method)(path, params, HTTP_ACCEPT='application/json')
+            elapsed = time.perf_counter() - start
+        # requests are anonymous, drop the session and tokens a login sets
+        client.cookies.clear()
+        if number < warmup:
+            continue
+        timings.append(elapsed * 1000)
+        queries.append(len(captured))
+        errors += response.status_code >= 400
+    total = sum(timings) / 1000
+    timings.sort()
+    return {
+        'requests': iterations,
+        'errors': errors,
+        'requests_per_second': round(iterations / total, 1) if total else None,
+        'p50_ms': round(percentile(timings, 0.5), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'p99_ms': round(percentile(timings, 0.99), 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'max_queries': max(queries),
+    }
+
+
+def run(names=None, iterations=100, warmup=5, seed=0):
+    """Run the named scenarios, or all of them, returns their results by name"""
+    data = sample(random.Random(seed))
+    return {
+        name: run_scenario(SCENARIOS[name], data, iterations, warmup=warmup, seed=seed)
+        for name in (names or SCENARIOS)
+    }
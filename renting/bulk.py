@@ -0,0 +1,272 @@
+import codecs
+import csv
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DatabaseError, transaction
+from django.http import StreamingHttpResponse
+
+from rest_framework.exceptions import ValidationError
+
+from . import listings, search
+from .cache import invalidate_search_results
+from .models import Province, District, Sector, Cell, PropertyType, Property, PublishingPayment, GetInTouch
+from .serializers import PropertyImportSerializer
+
+
+# Bulk import and export of properties as CSV or NDJSON (one JSON object per line).
+# Imports are read as a stream and handled a batch at a time: the rows are validated,
+# their property type and locations resolved from an in-memory lookup and the valid
+# rows of a batch inserted with one bulk_create in their own transaction, so a bad
+# row is reported without holding back the others.
+# Exports stream rows straight from a values() iterator, under ASGI too: it reads a
+# sync iterator whole before sending it, so it gets an async one.
+BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 2000
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+PROPERTY_COLUMNS = [
+    ('id', 'id'),
+    ('landlord', 'landlord_id'),
+    ('property_type', 'property_type__type_name'),
+    ('title', 'title'),
+    ('description', 'description'),
+    ('bedrooms', 'bedrooms'),
+    ('bathrooms', 'bathrooms'),
+    ('is_furnished', 'is_furnished'),
+    ('floors', 'floors'),
+    ('plot_size', 'plot_size'),
+    ('renting_price', 'renting_price'),
+    ('status', 'status'),
+    ('province', 'province__province_name'),
+    ('district', 'district__district_name'),
+    ('sector', 'sector__sector_name'),
+    ('cell', 'cell__cell_name'),
+    ('street', 'street'),
+    ('latitude', 'latitude'),
+    ('longitude', 'longitude'),
+    ('created_date', 'created_date'),
+]
+PAYMENT_COLUMNS = [
+    ('id', 'id'),
+    ('property', 'property_id'),
+    ('property_title', 'property__title'),
+    ('landlord', 'landlord_id'),
+    ('landlord_email', 'landlord__user__email'),
+    ('landlord_first_name', 'landlord__user__first_name'),
+    ('landlord_last_name', 'landlord__user__last_name'),
+    ('payment_amount', 'payment_amount'),
+    ('payment_method', 'payment_method'),
+    ('created_date', 'created_date'),
+]
+MESSAGE_COLUMNS = [
+    ('id', 'id'),
+    ('first_name', 'first_name'),
+    ('last_name', 'last_name'),
+    ('email', 'email'),
+    ('subject', 'subject'),
+    ('message', 'message'),
+    ('is_read', 'is_read'),
+    ('created_date', 'created_date'),
+]
+# what the export_data command can export
+EXPORTS = {
+    'properties': (Property, PROPERTY_COLUMNS),
+    'payments': (PublishingPayment, PAYMENT_COLUMNS),
+    'messages': (GetInTouch, MESSAGE_COLUMNS),
+}
+
+
+def guess_format(name='', content_type=''):
+    """The import format of a file name or content type, csv unless it looks like NDJSON"""
+    if (name or '').lower().endswith(('.ndjson', '.jsonl')) or 'ndjson' in (content_type or '') or 'jsonl' in (content_type or ''):
+        return 'ndjson'
+    return 'csv'
+
+
+def read_rows(stream, file_format):
+    """Yield the rows of a binary stream, any object iterating over lines, as dicts.
+    Empty CSV cells are left out."""
+    text = codecs.iterdecode(stream, 'utf-8-sig')
+    if file_format == 'ndjson':
+        for line in text:
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield row if isinstance(row, dict) else {}
+    else:
+        for row in csv.DictReader(text):
+            yield {name: value for name, value in row.items() if name and value not in ('', None)}
+
+
+class LocationLookup:
+    """Ids of the property types and locations by lower-cased name, loaded in five queries"""
+    def __init__(self):
+        self.property_types = {name.lower(): pk for pk, name in PropertyType.objects.values_list('id', 'type_name')}
+        self.provinces = {name.lower(): (pk, None) for pk, name in Province.objects.values_list('id', 'province_name')}
+        self.districts = {
+            name.lower(): (pk, parent) for pk, name, parent in District.objects.values_list('id', 'district_name', 'province_id')
+        }
+        self.sectors = {
+            name.lower(): (pk, parent) for pk, name, parent in Sector.objects.values_list('id', 'sector_name', 'district_id')
+        }
+        self.cells = {name.lower(): (pk, parent) for pk, name, parent in Cell.objects.values_list('id', 'cell_name', 'sector_id')}
+
+    def resolve(self, data):
+        """Replace the names in validated row data by ids, returns the errors"""
+        errors = {}
+        property_type = self.property_types.get(data['property_type'].strip().lower())
+        if property_type is None:
+            errors['property_type'] = [f"Unknown property type \"{data['property_type']}\"."]
+        data['property_type_id'] = property_type
+
+        parent = None
+        for field, names in (('province', self.provinces), ('district', self.districts),
+                             ('sector', self.sectors), ('cell', self.cells)):
+            pk, expected_parent = names.get(data[field].strip().lower(), (None, None))
+            if pk is None:
+                errors[field] = [f"Unknown {field} \"{data[field]}\"."]
+            elif field != 'province' and parent is not None and expected_parent != parent:
+                errors[field] = [f"{data[field]} is not in the given {previous}."]
+            data[f'{field}_id'] = parent = pk
+            previous = field
+        for field in ('property_type', 'province', 'district', 'sector', 'cell'):
+            del data[field]
+        return errors
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_properties(landlord, rows, batch_size=BATCH_SIZE, dry_run=False):
+    """Create properties of ``landlord`` from row dicts. Returns a report with the number
+    of rows read, valid and created and the errors of the rejected rows, numbered from 1."""
+    lookup = LocationLookup()
+    report = {'rows': 0, 'valid': 0, 'created': 0, 'error_count': 0, 'errors': []}
+    # one serializer validates every row, its fields are only built once
+    serializer = PropertyImportSerializer()
+
+    def reject(number, errors):
+        report['error_count'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'row': number, 'errors': errors})
+
+    for batch in batches(rows, batch_size):
+        first = report['rows'] + 1
+        report['rows'] += len(batch)
+        objs, numbers = [], []
+        for number, row in enumerate(batch, first):
+            try:
+                data = dict(serializer.run_validation(row))
+            except ValidationError as error:
+                reject(number, error.detail if isinstance(error.detail, dict) else {'non_field_errors': error.detail})
+                continue
+            errors = lookup.resolve(data)
+            if errors:
+                reject(number, errors)
+                continue
+            objs.append(Property(landlord=landlord, **data))
+            numbers.append(number)
+        report['valid'] += len(objs)
+        if not objs or dry_run:
+            continue
+        try:
+            with transaction.atomic():
+                created = Property.objects.bulk_create(objs)
+                # bulk_create sends no post_save, index the rows like the signal handler would
+                search.index_properties([obj.pk for obj in created if obj.pk is not None])
+                if any(obj.pk is None for obj in created):
+                    # backends that don't return the ids of bulk inserted rows
+                    listings.schedule_refresh(
+                        Property.objects.filter(landlord=landlord, listing__isnull=True).values_list('pk', flat=True)
+                    )
+                else:
+                    listings.schedule_refresh([obj.pk for obj in created])
+        except DatabaseError as error:
+            report['valid'] -= len(objs)
+            for number in numbers:
+                reject(number, {'non_field_errors': [str(error)]})
+            continue
+        report['created'] += len(created)
+
+    if report['created'] and not dry_run:
+        transaction.on_commit(invalidate_search_results)
+    return report
+
+
+def export_rows(queryset, columns):
+    """Yield the rows of a queryset as dicts of ``columns``, (name, lookup) pairs, without
+    loading the whole result. Related names are joined in the same query."""
+    names = [name for name, lookup in columns]
+    queryset = queryset.prefetch_related(None).values_list(*[lookup for name, lookup in columns])
+    for values in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield dict(zip(names, values))
+
+
+def stream_csv(rows, columns, rows_per_chunk=100):
+    """Yield CSV text a few rows at a time, starting with the header"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, lookup in columns])
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row.values())
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_ndjson(rows, rows_per_chunk=100):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, default=str) + '\n')
+        if len(lines) == rows_per_chunk:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+def stream_export(queryset, columns, file_format='csv'):
+    rows = export_rows(queryset, columns)
+    if file_format == 'ndjson':
+        return stream_ndjson(rows)
+    return stream_csv(rows, columns)
+
+
+def export_response(request, queryset, columns, filename, file_format='csv'):
+    """A download of the export, streamed a chunk at a time by WSGI and ASGI servers alike"""
+    chunks = stream_export(queryset, columns, file_format)
+    if isinstance(request, ASGIRequest):
+        chunks = aiterate(chunks)
+    response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{file_format}"'
+    return response
+
+
+async def aiterate(chunks):
+    """Yield the chunks of a sync iterator, read on the thread of the request like its queries"""
+    read = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await read(chunks, None)) is not None:
+            yield chunk
+    finally:
+        # a client going away stops the export, closing its cursor
+        await sync_to_async(chunks.close, thread_sensitive=True)()
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Cached data is grouped under version counters kept in the shared cache. Bumping a
+# counter makes every process miss the entries written under the previous version,
+# which then simply expire.
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # start from the clock in milliseconds so an evicted counter never reuses an old
+        # version, unless it was bumped more than a thousand times a second
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key, int(time.time() * 1000))
+    return version
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), timeout=None)
+
+
+SEARCH_VERSION_KEY = 'renting:search:version'
+SEARCH_CACHE_KEY = 'renting:search:{version}:{digest}'
+
+
+def search_cache_key(request, data):
+    """Cache key of a search, from the validated RentalSearchSerializer data, the page
+    and the fields requested. GET and POST searches are kept apart, the links to
+    their other pages differ: only those of GET searches carry the filters."""
+    normalized = {name: sorted(value) if isinstance(value, list) else value for name, value in data.items()}
+    params = {name: request.query_params.get(name) for name in ('cursor', 'page_size', 'fields', 'expand')}
+    method = 'POST' if request.method == 'POST' else 'GET'
+    raw = json.dumps([method, request.build_absolute_uri(request.path), normalized, params], sort_keys=True, default=str)
+    return SEARCH_CACHE_KEY.format(
+        version=get_version(SEARCH_VERSION_KEY),
+        digest=hashlib.md5(raw.encode()).hexdigest(),
+    )
+
+
+def get_search_results(key):
+    return cache.get(key)
+
+
+def set_search_results(key, data):
+    cache.set(key, data, timeout=settings.SEARCH_CACHE_TIMEOUT)
+
+
+def invalidate_search_results():
+    bump_version(SEARCH_VERSION_KEY)
@@ -1,6 +1,9 @@
 import django_filters
+from django.db.models import Case, Count, IntegerField, Value, When
 
 from .models import Province, District, Sector, Cell
+from .geo import filter_bounding_box, filter_radius
+from .search import search_properties
 
 
 class DistrictFilter(django_filters.FilterSet):
@@ -28,3 +31,159 @@ class CellFilter(django_filters.FilterSet):
     class Meta:
         model = Cell
         fields = ['province', 'district', 'sector']
+
+
+# orderings accepted by the rental search, the primary key is always added as a tie breaker
+SEARCH_ORDERING_CHOICES = [
+    'created_date', '-created_date',
+    'renting_price', '-renting_price',
+    'bedrooms', '-bedrooms',
+    'bathrooms', '-bathrooms',
+    'relevance', 'distance',
+]
+SEARCH_STATUS_CHOICES = ['available', 'unavailable', 'all']
+# in km
+MAX_SEARCH_RADIUS = 50
+
+SEARCH_EXACT_FILTERS = {
+    'bedrooms': 'bedrooms',
+    'bathrooms': 'bathrooms',
+    'floors': 'floors',
+    'renting_price': 'renting_price',
+}
+SEARCH_RANGE_FILTERS = {
+    'min_price': 'renting_price__gte',
+    'max_price': 'renting_price__lte',
+    'min_bedrooms': 'bedrooms__gte',
+    'max_bedrooms': 'bedrooms__lte',
+    'min_bathrooms': 'bathrooms__gte',
+    'max_bathrooms': 'bathrooms__lte',
+}
+SEARCH_MULTIPLE_FILTERS = {
+    'property_type': 'property_type__in',
+    'district': 'district__in',
+    'sector': 'sector__in',
+    'cell': 'cell__in',
+}
+
+
+def search_ordering(ordering):
+    """Return the order_by() arguments for a search ordering, ending with the primary key"""
+    if ordering == 'relevance':
+        return ['-search_rank', '-pk']
+    direction = '-' if ordering.startswith('-') else ''
+    return [ordering, direction + 'pk']
+
+
+def filter_properties(queryset, data, exclude=()):
+    """Apply the validated data of RentalSearchSerializer to a Property or SearchListing queryset,
+    skipping the filters named in ``exclude``"""
+    status = data.get('status', 'available')
+    if status == 'available':
+        queryset = queryset.filter(status=True)
+    elif status == 'unavailable':
+        queryset = queryset.filter(status=False)
+
+    if data.get('is_furnished'):
+        queryset = queryset.filter(is_furnished=data['is_furnished'])
+
+    for name, lookup in SEARCH_EXACT_FILTERS.items():
+        if data.get(name) and name not in exclude:
+            queryset = queryset.filter(**{lookup: data[name]})
+    for name, lookup in SEARCH_RANGE_FILTERS.items():
+        if data.get(name) is not None and name not in exclude:
+            queryset = queryset.filter(**{lookup: data[name]})
+    for name, lookup in SEARCH_MULTIPLE_FILTERS.items():
+        if data.get(name) and name not in exclude:
+            queryset = queryset.filter(**{lookup: data[name]})
+
+    # the nearby filters only work on SearchListing querysets, which have a geohash.
+    # Searches around a point always have a radius so they read geohash ranges only
+    if data.get('latitude') is not None:
+        queryset = filter_radius(queryset, data['latitude'], data['longitude'], data.get('radius') or MAX_SEARCH_RADIUS)
+    if data.get('north') is not None:
+        queryset = filter_bounding_box(queryset, data['south'], data['west'], data['north'], data['east'])
+
+    if data.get('q'):
+        queryset = search_properties(queryset, data['q'])
+    return queryset
+
+
+# price bands of the search facets, in RWF, the last band has no upper bound
+PRICE_BANDS = [
+    (0, 100000),
+    (100000, 200000),
+    (200000, 500000),
+    (500000, 1000000),
+    (1000000, None),
+]
+# filters ignored when counting each facet, so a facet lists its other options too
+FACET_EXCLUDES = {
+    'district': ('district',),
+    'property_type': ('property_type',),
+    'bedrooms': ('bedrooms', 'min_bedrooms', 'max_bedrooms'),
+    'price_band': ('renting_price', 'min_price', 'max_price'),
+}
+
+
+# the names shown with the district and property type facets, for Property querysets
+# and for SearchListing ones
+FACET_NAMES = {'district': 'district__district_name', 'property_type': 'property_type__type_name'}
+LISTING_FACET_NAMES = {'district': 'district_name', 'property_type': 'property_type_name'}
+
+
+def facet_querysets(queryset, data, names=FACET_NAMES):
+    """The grouped queries counting the properties matching the search per district,
+    property type, bedrooms and price band"""
+    def facet_queryset(name):
+        return filter_properties(queryset, data, exclude=FACET_EXCLUDES[name]).order_by()
+
+    band = Case(
+        *[When(renting_price__gte=low, renting_price__lt=high, then=Value(index))
+          for index, (low, high) in enumerate(PRICE_BANDS) if high is not None],
+        default=Value(len(PRICE_BANDS) - 1),
+        output_field=IntegerField(),
+    )
+    return {
+        'district': facet_queryset('district').values('district', names['district']).annotate(count=Count('pk')),
+        'property_type': facet_queryset('property_type').values('property_type', names['property_type']).annotate(count=Count('pk')),
+        'bedrooms': facet_queryset('bedrooms').values('bedrooms').annotate(count=Count('pk')),
+        'price_band': facet_queryset('price_band').annotate(price_band=band).values('price_band')
+        .annotate(count=Count('pk')).values_list('price_band', 'count'),
+    }
+
+
+def format_facets(rows, names=FACET_NAMES):
+    """The facets from the rows of the facet_querysets()"""
+    band_counts = dict(rows['price_band'])
+    return {
+        'district': sorted(
+            ({'id': row['district'], 'name': row[names['district']], 'count': row['count']} for row in rows['district']),
+            key=lambda row: row['name'],
+        ),
+        'property_type': sorted(
+            ({'id': row['property_type'], 'name': row[names['property_type']], 'count': row['count']} for row in rows['property_type']),
+            key=lambda row: row['name'],
+        ),
+        'bedrooms': sorted(
+            ({'value': row['bedrooms'], 'count': row['count']} for row in rows['bedrooms']),
+            key=lambda row: row['value'],
+        ),
+        'price_band': [
+            {'min': low, 'max': high, 'count': band_counts.get(index, 0)}
+            for index, (low, high) in enumerate(PRICE_BANDS)
+        ],
+    }
+
+
+def property_facets(queryset, data, names=FACET_NAMES):
+    """Count the properties matching the search per district, property type, bedrooms
+    and price band, with one grouped query per facet"""
+    querysets = facet_querysets(queryset, data, names)
+    return format_facets({name: list(rows) for name, rows in querysets.items()}, names)
+
+
+async def aproperty_facets(queryset, data, names=FACET_NAMES):
+    """property_facets() for async views"""
+    querysets = facet_querysets(queryset, data, names)
+    return format_facets({name: [row async for row in rows] for name, rows in querysets.items()}, names)
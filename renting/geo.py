@@ -0,0 +1,137 @@
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+
+# Nearby searches without PostGIS. Every search listing stores the geohash of its
+# coordinates, a base 32 string whose prefixes are nested grid cells, so the cells
+# covering a search area are ranges of the geohash index. A search first narrows the
+# listings down to those ranges and only then computes exact distances or bounds.
+# A property without coordinates of its own is placed at the centroid of its cell,
+# or of its sector.
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+# the most grid cells a search area is covered with, bigger areas use bigger cells
+MAX_CELLS = 64
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Geohash of a point"""
+    south, north, west, east = -90.0, 90.0, -180.0, 180.0
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # bits alternate between longitude and latitude, longitude first
+        if even:
+            middle = (west + east) / 2
+            value = value * 2 + (longitude >= middle)
+            west, east = (middle, east) if longitude >= middle else (west, middle)
+        else:
+            middle = (south + north) / 2
+            value = value * 2 + (latitude >= middle)
+            south, north = (middle, north) if latitude >= middle else (south, middle)
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Height and width in degrees of the grid cells of a geohash precision"""
+    bits = precision * 5
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** (bits - bits // 2)
+
+
+def grid(south, west, north, east, precision):
+    """Row and column ranges of the cells of ``precision`` covering a bounding box"""
+    height, width = cell_size(precision)
+    rows = range(int((south + 90) // height), int((min(north, 90 - 1e-9) + 90) // height) + 1)
+    columns = range(int((west + 180) // width), int((min(east, 180 - 1e-9) + 180) // width) + 1)
+    return rows, columns
+
+
+def covering_cells(south, west, north, east):
+    """Geohashes of the smallest cells that cover a bounding box with at most MAX_CELLS of them"""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        rows, columns = grid(south, west, north, east, precision)
+        if len(rows) * len(columns) <= MAX_CELLS or precision == 1:
+            break
+    height, width = cell_size(precision)
+    return sorted({
+        encode(-90 + (row + 0.5) * height, -180 + (column + 0.5) * width, precision)
+        for row in rows for column in columns
+    })
+
+
+def prefix_end(prefix):
+    """The first geohash after every geohash starting with ``prefix``, None after the last"""
+    while prefix and prefix[-1] == BASE32[-1]:
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + BASE32[BASE32.index(prefix[-1]) + 1]
+
+
+def covering_ranges(south, west, north, east):
+    """[start, end) geohash ranges covering a bounding box, neighbouring cells merged"""
+    ranges = []
+    for cell in covering_cells(south, west, north, east):
+        end = prefix_end(cell)
+        if ranges and ranges[-1][1] == cell:
+            ranges[-1][1] = end
+        else:
+            ranges.append([cell, end])
+    return ranges
+
+
+def geohash_filter(south, west, north, east, field='geohash'):
+    """A Q object matching the geohashes inside the cells that cover a bounding box"""
+    lookups = Q()
+    for start, end in covering_ranges(south, west, north, east):
+        lookup = Q(**{f'{field}__gte': start})
+        if end is not None:
+            lookup &= Q(**{f'{field}__lt': end})
+        lookups |= lookup
+    return lookups
+
+
+def radius_box(latitude, longitude, radius):
+    """Bounding box, (south, west, north, east), of a circle of ``radius`` km"""
+    lat_delta = radius / KM_PER_DEGREE
+    lng_delta = radius / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return (
+        max(latitude - lat_delta, -90.0), max(longitude - lng_delta, -180.0),
+        min(latitude + lat_delta, 90.0), min(longitude + lng_delta, 180.0),
+    )
+
+
+def distance(latitude, longitude, lat_field='latitude', lng_field='longitude'):
+    """Expression of the great circle distance in km between a point and the coordinates of a row"""
+    lat = Radians(F(lat_field))
+    lat_delta = lat - Value(math.radians(latitude), output_field=FloatField())
+    lng_delta = Radians(F(lng_field)) - Value(math.radians(longitude), output_field=FloatField())
+    haversine = (
+        Power(Sin(lat_delta / 2), 2)
+        + Value(math.cos(math.radians(latitude)), output_field=FloatField()) * Cos(lat) * Power(Sin(lng_delta / 2), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM, output_field=FloatField()) * ASin(Sqrt(haversine))
+
+
+def filter_radius(queryset, latitude, longitude, radius):
+    """Keep the SearchListing rows within ``radius`` km of a point, annotated with their
+    ``distance`` in km to it"""
+    return queryset.filter(
+        geohash_filter(*radius_box(latitude, longitude, radius)),
+    ).annotate(distance=distance(latitude, longitude)).filter(distance__lte=radius)
+
+
+def filter_bounding_box(queryset, south, west, north, east):
+    """Keep the SearchListing rows located inside a bounding box"""
+    return queryset.filter(
+        geohash_filter(south, west, north, east),
+        latitude__range=(south, north), longitude__range=(west, east),
+    )
@@ -0,0 +1,191 @@
+import base64
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+
+from PIL import Image, ImageOps, features
+
+from backend import metrics
+from . import listings
+from .cache import invalidate_search_results
+from .models import Landlord, Manager, PropertyImages
+from .storage import discard, update_references
+
+
+logger = logging.getLogger(__name__)
+
+# Uploaded images are resized off the request thread into JPEG and WebP renditions
+# of a few widths plus a tiny blurred placeholder. EXIF data is stripped from the
+# original and the renditions. The storage names end up in the model's
+# ``renditions`` field, ``uploaded`` being the name of the file before stripping:
+#     {'source': 'properties/a.jpg', 'uploaded': 'properties/b.jpg', 'width': 4000, 'height': 3000,
+#      'placeholder': 'data:image/jpeg;base64,...',
+#      'jpg': {'320': 'properties/renditions/a_320.jpg', ...}, 'webp': {...}}
+PLACEHOLDER_WIDTH = 16
+RENDITION_EXTENSIONS = ('jpg', 'webp')
+
+IMAGE_FIELDS = {
+    PropertyImages: 'property_image',
+    Landlord: 'profile_image',
+    Manager: 'profile_image',
+}
+
+PROCESSING_SECONDS = metrics.Histogram('image_processing_duration_seconds', 'Time taken to write the renditions of an image',
+                                       buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+PROCESSING_FAILURES = metrics.Counter('image_processing_failures_total', 'Images whose renditions could not be written')
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS, thread_name_prefix='renditions',
+        )
+    return _executor
+
+
+def rendition_names(renditions):
+    return {path for extension in RENDITION_EXTENSIONS for path in (renditions or {}).get(extension, {}).values()}
+
+
+def media_names(instance, field_name):
+    """Names of the stored files an instance references, its image and the renditions.
+    Deferred fields are left out rather than loaded."""
+    value = instance.__dict__.get(field_name)
+    name = getattr(value, 'name', value)
+    names = rendition_names(instance.__dict__.get('renditions'))
+    if name:
+        names.add(name)
+    return names
+
+
+def needs_processing(instance, field_name):
+    name = getattr(instance, field_name).name
+    return bool(name) and (instance.renditions or {}).get('source') != name
+
+
+def schedule(model, pk, field_name):
+    """Generate the renditions of an image once the current transaction commits"""
+    def submit():
+        if settings.IMAGE_PROCESSING_WORKERS:
+            get_executor().submit(run, model, pk, field_name)
+        else:
+            process(model, pk, field_name)
+    transaction.on_commit(submit)
+
+
+def run(model, pk, field_name):
+    try:
+        process(model, pk, field_name)
+    except Exception:
+        PROCESSING_FAILURES.inc()
+        logger.exception("Could not generate renditions of %s %s", model._meta.label, pk)
+    finally:
+        # the worker thread has its own connection, don't leave it open
+        connection.close()
+
+
+def formats():
+    yield 'JPEG', 'jpg'
+    if features.check('webp'):
+        yield 'WEBP', 'webp'
+
+
+def encode(image, image_format, **options):
+    if image_format in ('JPEG', 'WEBP') and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def placeholder(image):
+    small = image.copy()
+    small.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH * 4))
+    return 'data:image/jpeg;base64,' + base64.b64encode(encode(small, 'JPEG', quality=40)).decode()
+
+
+def process(model, pk, field_name, force=False):
+    """Strip the EXIF data of an image field and write its renditions, returns whether there was anything to do"""
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not (needs_processing(instance, field_name) or force and getattr(instance, field_name)):
+        return False
+    start = time.perf_counter()
+    old_names = media_names(instance, field_name)
+    field = getattr(instance, field_name)
+    storage, name = field.storage, field.name
+    original_name = name
+    uploaded = instance.renditions.get('uploaded', name) if force else name
+
+    with field.open('rb') as file:
+        image = Image.open(file)
+        image.load()
+    original_format = image.format
+    has_exif = bool(image.info.get('exif')) or len(image.getexif()) > 0
+    image = ImageOps.exif_transpose(image)
+
+    # the upload directory, the stored name may be a content hash in a subdirectory of it
+    directory, filename = os.path.split(field.field.generate_filename(instance, os.path.basename(uploaded)))
+    stem = os.path.splitext(filename)[0]
+    source = None
+    if has_exif and original_format in ('JPEG', 'PNG'):
+        source = encode(image, original_format, quality=95) if original_format == 'JPEG' else encode(image, 'PNG')
+    widths = sorted({min(width, image.width) for width in settings.IMAGE_RENDITION_WIDTHS})
+    encoded = {}
+    for image_format, extension in formats():
+        encoded[extension] = {}
+        for width in widths:
+            resized = image.copy()
+            resized.thumbnail((width, image.height), Image.LANCZOS)
+            encoded[extension][width] = encode(resized, image_format, quality=80, optimize=True)
+
+    # the files are stored and counted in one transaction, see renting/storage.py, and
+    # update() is used instead of save() so the post_save signal doesn't schedule this again
+    with transaction.atomic():
+        if source is not None:
+            name = storage.save(os.path.join(directory, filename), ContentFile(source))
+        renditions = {
+            'source': name,
+            'uploaded': uploaded,
+            'width': image.width,
+            'height': image.height,
+            'placeholder': placeholder(image),
+        }
+        for extension, contents in encoded.items():
+            renditions[extension] = {
+                str(width): storage.save(os.path.join(directory, 'renditions', f'{stem}_{width}.{extension}'), ContentFile(content))
+                for width, content in contents.items()
+            }
+        new_names = rendition_names(renditions) | {name}
+        if not model.objects.filter(pk=pk, **{field_name: original_name}).update(**{field_name: name, 'renditions': renditions}):
+            # the image was replaced or deleted meanwhile, its own renditions are on their way
+            discard(new_names - old_names, storage)
+            return False
+        update_references(old_names, new_names, storage)
+        if model is PropertyImages:
+            listings.schedule_refresh(model.objects.filter(pk=pk).values_list('property_id', flat=True))
+    invalidate_search_results()
+    PROCESSING_SECONDS.observe(time.perf_counter() - start)
+    return True
+
+
+def rendition_urls(storage, renditions, build_absolute_uri=None):
+    """Map the renditions of an image to URLs"""
+    if not renditions:
+        return None
+    url = storage.url
+    if build_absolute_uri is not None:
+        url = lambda path: build_absolute_uri(storage.url(path))
+    result = {'width': renditions.get('width'), 'height': renditions.get('height'), 'placeholder': renditions.get('placeholder')}
+    for extension in RENDITION_EXTENSIONS:
+        if extension in renditions:
+            result[extension] = {width: url(path) for width, path in renditions[extension].items()}
+    return result
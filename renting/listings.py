@@ -0,0 +1,131 @@
+import threading
+
+from django.db import connections, router, transaction
+from django.db.models import Count, Min
+
+from . import geo
+from .cache import invalidate_search_results
+from .models import Property, PropertyImages, SearchListing
+
+
+# SearchListing keeps one row per property with everything the rental search shows,
+# so a search reads a single table. Changes to a property or its images rewrite the
+# property's row; renamed locations, types and landlords are copied over with one
+# UPDATE per change. Rows are rewritten once the transaction commits, so deleting a
+# property with many images rewrites nothing and saving it twice rewrites it once.
+# Code that bypasses the signals (bulk_create, update()) calls schedule_refresh()
+# itself, and the rebuild_search_listings command rewrites every row.
+BATCH_SIZE = 500
+
+_pending = threading.local()
+
+UPDATE_FIELDS = [
+    field.name for field in SearchListing._meta.concrete_fields if not field.primary_key
+]
+
+
+def landlord_name(user):
+    return '{} {}'.format(user.first_name, user.last_name)
+
+
+def coordinates(obj):
+    """Where a property is shown on a map: its own coordinates, else the centroid of its cell or sector"""
+    for place in (obj, obj.cell, obj.sector):
+        if place.latitude is not None and place.longitude is not None:
+            return place.latitude, place.longitude
+    return None, None
+
+
+def build_listings(ids):
+    """Build the SearchListing rows of the given property ids, in two queries"""
+    properties = list(
+        Property.objects.filter(pk__in=ids)
+        .select_related('landlord__user', 'property_type', 'province', 'district', 'sector', 'cell')
+        .annotate(image_count=Count('images'), primary_image_id=Min('images__id'))
+    )
+    primary_images = {
+        image['id']: image for image in PropertyImages.objects.filter(
+            pk__in=[obj.primary_image_id for obj in properties if obj.primary_image_id],
+        ).values('id', 'property_image', 'renditions')
+    }
+    listings = []
+    for obj in properties:
+        image = primary_images.get(obj.primary_image_id, {})
+        latitude, longitude = coordinates(obj)
+        listings.append(SearchListing(
+            property_id=obj.pk,
+            landlord_id=obj.landlord_id,
+            property_type_id=obj.property_type_id,
+            province_id=obj.province_id,
+            district_id=obj.district_id,
+            sector_id=obj.sector_id,
+            cell_id=obj.cell_id,
+            landlord_name=landlord_name(obj.landlord.user),
+            property_type_name=obj.property_type.type_name,
+            province_name=obj.province.province_name,
+            district_name=obj.district.district_name,
+            sector_name=obj.sector.sector_name,
+            cell_name=obj.cell.cell_name,
+            title=obj.title,
+            description=obj.description,
+            bedrooms=obj.bedrooms,
+            bathrooms=obj.bathrooms,
+            is_furnished=obj.is_furnished,
+            floors=obj.floors,
+            plot_size=obj.plot_size,
+            renting_price=obj.renting_price,
+            status=obj.status,
+            street=obj.street,
+            primary_image=image.get('property_image') or '',
+            primary_image_renditions=image.get('renditions') or {},
+            image_count=obj.image_count,
+            created_date=obj.created_date,
+            latitude=latitude,
+            longitude=longitude,
+            geohash=geo.encode(latitude, longitude) if latitude is not None else '',
+        ))
+    return listings
+
+
+def refresh_properties(ids):
+    """Rewrite the listings of the given property ids, dropping those of deleted properties"""
+    ids = list(ids)
+    connection = connections[router.db_for_write(SearchListing)]
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start:start + BATCH_SIZE]
+        listings = build_listings(batch)
+        SearchListing.objects.filter(pk__in=set(batch) - {listing.pk for listing in listings}).delete()
+        if not listings:
+            continue
+        # an upsert, MySQL takes the conflicting key from the table's unique indexes
+        unique_fields = ['property'] if connection.features.supports_update_conflicts_with_target else None
+        SearchListing.objects.bulk_create(
+            listings, update_conflicts=True, unique_fields=unique_fields, update_fields=UPDATE_FIELDS,
+        )
+
+
+def schedule_refresh(ids):
+    """Refresh the listings of the given property ids once the current transaction commits"""
+    _pending.ids = getattr(_pending, 'ids', set()) | set(ids)
+    transaction.on_commit(flush)
+
+
+def flush():
+    # ids left by a rolled back transaction are refreshed too, which is harmless
+    ids, _pending.ids = getattr(_pending, 'ids', set()), set()
+    if ids:
+        refresh_properties(ids)
+        invalidate_search_results()
+
+
+def rebuild():
+    """Rewrite every listing, returns how many there are"""
+    SearchListing.objects.exclude(pk__in=Property.objects.values('pk')).delete()
+    ids = list(Property.objects.order_by('pk').values_list('pk', flat=True))
+    refresh_properties(ids)
+    return len(ids)
+
+
+def rename(field, pk, name):
+    """Copy the new name of a landlord, property type or location to its listings"""
+    SearchListing.objects.filter(**{field: pk}).exclude(**{f'{field}_name': name}).update(**{f'{field}_name': name})
@@ -0,0 +1,88 @@
+import hashlib
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from rest_framework.renderers import JSONRenderer
+
+from .cache import get_version, bump_version
+from .models import Province, District, Sector, Cell
+
+
+# The location hierarchy almost never changes, so it is built in four queries,
+# rendered once and kept both in this process and in the shared cache. A version
+# counter in the shared cache is bumped by the location signals once their
+# transaction commits, which makes every process drop its local copy on its next
+# request. Only a cache shared by the processes, see CACHES, reaches them all.
+LOCATION_TREE_VERSION_KEY = 'renting:location-tree:version'
+LOCATION_TREE_CACHE_KEY = 'renting:location-tree:{name}:{version}'
+LOCATION_TREE_TIMEOUT = 60 * 60 * 24
+
+_local_cache = {}
+
+
+def build_location_tree():
+    """Return the Province -> District -> Sector -> Cell hierarchy in the shape of ProvinceSerializer"""
+    # read from the default database, a lagging replica must not end up in the shared cache
+    cells = defaultdict(list)
+    for cell in Cell.objects.using(DEFAULT_DB_ALIAS).order_by('id').values('id', 'cell_name', 'sector_id'):
+        cells[cell['sector_id']].append({'id': cell['id'], 'cell_name': cell['cell_name']})
+
+    sectors = defaultdict(list)
+    for sector in Sector.objects.using(DEFAULT_DB_ALIAS).order_by('id').values('id', 'sector_name', 'district_id'):
+        sectors[sector['district_id']].append({
+            'id': sector['id'],
+            'sector_name': sector['sector_name'],
+            'cells': cells[sector['id']],
+        })
+
+    provinces = list(Province.objects.using(DEFAULT_DB_ALIAS).order_by('id').values('id', 'province_name'))
+    province_names = {province['id']: province['province_name'] for province in provinces}
+    districts = defaultdict(list)
+    for district in District.objects.using(DEFAULT_DB_ALIAS).order_by('id').values('id', 'district_name', 'province_id'):
+        districts[district['province_id']].append({
+            'id': district['id'],
+            'province': province_names[district['province_id']],
+            'district_name': district['district_name'],
+            'sectors': sectors[district['id']],
+        })
+
+    return [
+        {'id': province['id'], 'province_name': province['province_name'], 'districts': districts[province['id']]}
+        for province in provinces
+    ]
+
+
+def build_district_list():
+    """Return every district in the shape of DistrictSerializer"""
+    return [district for province in build_location_tree() for district in province['districts']]
+
+
+BUILDERS = {
+    'tree': build_location_tree,
+    'districts': build_district_list,
+}
+
+
+def get_rendered(name):
+    """Return the rendered JSON and ETag of the location data called ``name``"""
+    version = get_version(LOCATION_TREE_VERSION_KEY)
+    cached = _local_cache.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+
+    key = LOCATION_TREE_CACHE_KEY.format(name=name, version=version)
+    rendered = cache.get(key)
+    if rendered is None:
+        content = JSONRenderer().render(BUILDERS[name]())
+        rendered = (content, '"%s"' % hashlib.md5(content).hexdigest())
+        cache.set(key, rendered, timeout=LOCATION_TREE_TIMEOUT)
+    _local_cache[name] = (version, *rendered)
+    return rendered
+
+
+def invalidate():
+    """Drop the cached location data in every process"""
+    _local_cache.clear()
+    bump_version(LOCATION_TREE_VERSION_KEY)
@@ -0,0 +1,69 @@
+import statistics
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+
+
+class Command(BaseCommand):
+    help = ("Time requests through the WSGI handler against the configured database, once per "
+            "CONN_MAX_AGE, to compare opening a connection per request with keeping it. "
+            "Run it again with DB_POOL_SIZE set to time the connection pool.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--path', default='/api/rental/testimonials/', help="A GET endpoint that queries the database")
+        parser.add_argument('--max-age', type=int, nargs='+', default=[0, 60], dest='max_ages',
+                            help="CONN_MAX_AGE values to compare")
+
+    def handle(self, *args, **options):
+        handler = WSGIHandler()
+        factory = RequestFactory()
+        connection = connections[DEFAULT_DB_ALIAS]
+        original_max_age = connection.settings_dict['CONN_MAX_AGE']
+        opened = []
+
+        def count(sender, connection, **kwargs):
+            # a connection taken from the pool wasn't opened
+            if connection.alias == DEFAULT_DB_ALIAS and not getattr(connection, 'from_pool', False):
+                opened.append(1)
+
+        def request():
+            status = []
+            response = handler(factory.get(options['path']).environ, lambda code, headers: status.append(code))
+            try:
+                for chunk in response:
+                    pass
+            finally:
+                # sends request_finished, which closes the connection unless it's kept
+                response.close()
+            if not status[0].startswith('200'):
+                raise CommandError(f"GET {options['path']} answered {status[0]}")
+
+        connection_created.connect(count)
+        try:
+            for max_age in options['max_ages']:
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = max_age
+                for _ in range(options['warmup']):
+                    request()
+                opened.clear()
+                timings = []
+                for _ in range(options['requests']):
+                    start = time.perf_counter()
+                    request()
+                    timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                self.stdout.write(
+                    f"CONN_MAX_AGE={max_age}: mean {statistics.mean(timings):.2f} ms, "
+                    f"p50 {timings[len(timings) // 2]:.2f} ms, p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms, "
+                    f"{len(opened)} connections opened for {len(timings)} requests"
+                )
+        finally:
+            connection_created.disconnect(count)
+            connection.settings_dict['CONN_MAX_AGE'] = original_max_age
+            connection.close()
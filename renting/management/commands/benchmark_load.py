@@ -0,0 +1,83 @@
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+DEFAULT_PATHS = [
+    '/api/rental/find_renting/search/',
+    '/api/rental/find_renting/search/?facets=true&ordering=renting_price',
+    '/api/rental/locations/',
+    '/api/rental/testimonials/',
+]
+
+
+class Command(BaseCommand):
+    help = ("Load a running server with concurrent clients and report requests/sec and latency "
+            "percentiles, e.g. once against gunicorn -c gunicorn.conf.py with ASGI=false and once "
+            "with ASGI=true")
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help="Base URL of the server, e.g. http://127.0.0.1:8000")
+        parser.add_argument('--path', action='append', dest='paths', help="Path to request, repeat for several")
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--duration', type=float, default=10, help="Seconds to run")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise CommandError("The url must look like http://host:port")
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        paths = options['paths'] or DEFAULT_PATHS
+        deadline = time.monotonic() + options['duration']
+        lock = threading.Lock()
+        timings, errors = [], []
+
+        def client(number):
+            connection = connection_class(url.hostname, url.port, timeout=30)
+            count = number
+            while time.monotonic() < deadline:
+                path = paths[count % len(paths)]
+                count += 1
+                start = time.perf_counter()
+                try:
+                    connection.request('GET', path, headers={'Accept': 'application/json'})
+                    response = connection.getresponse()
+                    response.read()
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        if response.status == 200:
+                            timings.append(elapsed)
+                        else:
+                            errors.append(f"{path}: {response.status}")
+                except (OSError, http.client.HTTPException) as error:
+                    with lock:
+                        errors.append(f"{path}: {error}")
+                    connection.close()
+                    connection = connection_class(url.hostname, url.port, timeout=30)
+            connection.close()
+
+        threads = [threading.Thread(target=client, args=(number,)) for number in range(options['concurrency'])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        if not timings:
+            raise CommandError(f"No request succeeded, first errors: {errors[:5]}")
+        timings.sort()
+
+        def percentile(value):
+            return timings[min(int(len(timings) * value), len(timings) - 1)] * 1000
+
+        self.stdout.write(
+            f"{len(timings)} requests in {elapsed:.1f}s with {options['concurrency']} clients: "
+            f"{len(timings) / elapsed:.1f} requests/sec, p50 {percentile(0.5):.1f} ms, "
+            f"p99 {percentile(0.99):.1f} ms, {len(errors)} errors"
+        )
+        for error in errors[:5]:
+            self.stderr.write(error)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from renting import bulk
+
+
+class Command(BaseCommand):
+    help = "Export properties, publishing payments or messages as CSV or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('data', choices=sorted(bulk.EXPORTS))
+        parser.add_argument('--output', '-o', help="File to write, standard output by default")
+        parser.add_argument('--format', choices=bulk.FORMATS, default='csv')
+
+    def handle(self, *args, **options):
+        model, columns = bulk.EXPORTS[options['data']]
+        chunks = bulk.stream_export(model.objects.order_by('id'), columns, options['format'])
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for chunk in chunks:
+                output.write(chunk)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from renting import images
+from renting.models import Landlord, Manager, PropertyImages
+
+
+class Command(BaseCommand):
+    help = "Generate the missing renditions of property and profile images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate renditions that already exist")
+
+    def handle(self, *args, **options):
+        for model, field_name in ((PropertyImages, 'property_image'), (Landlord, 'profile_image'), (Manager, 'profile_image')):
+            queryset = model.objects.exclude(**{field_name: ''})
+            processed = 0
+            for pk in queryset.values_list('pk', flat=True).iterator():
+                try:
+                    processed += images.process(model, pk, field_name, force=options['force'])
+                except Exception as error:
+                    self.stderr.write(f"{model._meta.label} {pk}: {error}")
+            self.stdout.write(f"{model._meta.label}: {processed} processed")
@@ -0,0 +1,37 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from renting import bulk
+from renting.models import Landlord
+
+
+class Command(BaseCommand):
+    help = "Import the properties of a landlord from a CSV or NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or NDJSON file, - for standard input")
+        parser.add_argument('--landlord', type=int, required=True, help="Id of the landlord owning the properties")
+        parser.add_argument('--format', choices=bulk.FORMATS, help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=bulk.BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="Only validate the rows")
+
+    def handle(self, *args, **options):
+        landlord = Landlord.objects.filter(pk=options['landlord']).first()
+        if landlord is None:
+            raise CommandError(f"Landlord {options['landlord']} does not exist.")
+        path = options['path']
+        file_format = options['format'] or bulk.guess_format(path)
+        stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            report = bulk.import_properties(
+                landlord, bulk.read_rows(stream, file_format), options['batch_size'], options['dry_run'],
+            )
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+        for error in report['errors']:
+            self.stderr.write(f"row {error['row']}: {json.dumps(error['errors'], default=str)}")
+        self.stdout.write(f"{report['rows']} rows, {report['valid']} valid, {report['created']} created, {report['error_count']} rejected")
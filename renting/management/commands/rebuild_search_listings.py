@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from renting import listings
+from renting.cache import invalidate_search_results
+
+
+class Command(BaseCommand):
+    help = "Rewrite the search listing of every property"
+
+    def handle(self, *args, **options):
+        count = listings.rebuild()
+        invalidate_search_results()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} search listings"))
@@ -0,0 +1,91 @@
+import json
+import platform
+import subprocess
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from renting import benchmarks
+
+
+METRICS = ['requests_per_second', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request']
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Run the benchmark scenarios against data from seed_benchmark_data and report "
+            "throughput, latency percentiles and queries per request. Save a run with --output "
+            "and compare a later commit's run against it with --compare.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', dest='scenarios', choices=list(benchmarks.SCENARIOS),
+                            help="Scenario to run, repeat for several, all of them by default")
+        parser.add_argument('--iterations', type=int, default=100, help="Measured requests per scenario")
+        parser.add_argument('--warmup', type=int, default=5, help="Unmeasured requests sent first")
+        parser.add_argument('--seed', type=int, default=0, help="The same seed sends the same requests")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--compare', help="A JSON file of an earlier run to compare with")
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError("--iterations must be at least 1")
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as file:
+                    baseline = json.load(file)
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Can't read {options['compare']}: {error}")
+
+        try:
+            results = benchmarks.run(
+                options['scenarios'], iterations=options['iterations'], warmup=options['warmup'], seed=options['seed'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        report = {
+            'commit': git_commit(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'rows': benchmarks.counts(),
+            'iterations': options['iterations'],
+            'seed': options['seed'],
+            'scenarios': results,
+        }
+
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name}: {result['requests_per_second']} requests/sec, p50 {result['p50_ms']} ms, "
+                f"p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+                f"{result['queries_per_request']} queries/request, {result['errors']} errors"
+            )
+            previous = (baseline or {}).get('scenarios', {}).get(name)
+            if previous:
+                self.stdout.write("  vs {}: {}".format(baseline.get('commit') or options['compare'], ", ".join(
+                    f"{metric} {previous[metric]} -> {result[metric]}{change(previous[metric], result[metric])}"
+                    for metric in METRICS
+                )))
+            if result['errors']:
+                self.stderr.write(f"  {name} answered {result['errors']} requests with an error")
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+
+def change(before, after):
+    if not before or after is None:
+        return ''
+    return f" ({(after - before) / before * 100:+.1f}%)"
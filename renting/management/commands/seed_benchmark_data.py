@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from renting import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Fill an empty database with benchmark data: Rwanda's location tree, 100k properties, "
+            "500k images and 50k users by default. Use --scale for a smaller or bigger run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=benchmarks.DEFAULT_USERS)
+        parser.add_argument('--properties', type=int, default=benchmarks.DEFAULT_PROPERTIES)
+        parser.add_argument('--images', type=int, default=benchmarks.DEFAULT_IMAGES)
+        parser.add_argument('--scale', type=float, default=1, help="Multiply the user, property and image counts")
+        parser.add_argument('--seed', type=int, default=0, help="The same seed creates the same rows")
+
+    def handle(self, *args, **options):
+        scale = options['scale']
+        try:
+            counts = benchmarks.seed(
+                users=int(options['users'] * scale), properties=int(options['properties'] * scale),
+                images=int(options['images'] * scale), seed=options['seed'], log=self.stdout.write,
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            "Seeded " + ", ".join(f"{count} {name}" for name, count in counts.items())
+        ))
@@ -0,0 +1,61 @@
+from django.db import migrations
+
+
+# The full-text index of renting/search.py as it was created, spelled out so later
+# changes to that module don't change what this migration does.
+SOURCE_SQL = """
+    SELECT p.id AS id, p.title AS title, p.description AS description, p.street AS street,
+           pr.province_name || ' ' || d.district_name || ' ' || s.sector_name || ' ' || c.cell_name AS location
+    FROM renting_property p
+    JOIN renting_province pr ON pr.id = p.province_id
+    JOIN renting_district d ON d.id = p.district_id
+    JOIN renting_sector s ON s.id = p.sector_id
+    JOIN renting_cell c ON c.id = p.cell_id
+"""
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "CREATE TABLE renting_property_search ("
+                "property_id bigint PRIMARY KEY REFERENCES renting_property (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute("CREATE INDEX renting_property_search_document_idx ON renting_property_search USING GIN (document)")
+            cursor.execute(
+                "INSERT INTO renting_property_search (property_id, document) "
+                "SELECT id, "
+                "setweight(to_tsvector('english', title), 'A') || "
+                "setweight(to_tsvector('english', location), 'B') || "
+                "setweight(to_tsvector('english', street), 'B') || "
+                "setweight(to_tsvector('english', description), 'C') "
+                f"FROM ({SOURCE_SQL}) AS source"
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                "CREATE VIRTUAL TABLE renting_property_fts USING fts5("
+                "title, description, street, location, tokenize='porter unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(f"INSERT INTO renting_property_fts (rowid, title, description, street, location) {SOURCE_SQL}")
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("DROP TABLE IF EXISTS renting_property_search")
+        elif connection.vendor == 'sqlite':
+            cursor.execute("DROP TABLE IF EXISTS renting_property_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('renting', '0007_property_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-18 09:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('renting', '0008_property_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='landlord',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Image Renditions'),
+        ),
+        migrations.AddField(
+            model_name='manager',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Image Renditions'),
+        ),
+        migrations.AddField(
+            model_name='propertyimages',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Image Renditions'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-18 09:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('renting', '0009_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PropertyImageUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=100, verbose_name='File Name')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Size')),
+                ('checksum', models.CharField(max_length=64, verbose_name='SHA-256 Checksum')),
+                ('created_date', models.DateTimeField(auto_now_add=True, verbose_name='Created Date')),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_uploads', to='renting.property', verbose_name='Property')),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 09:51
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def count_references(apps, schema_editor):
+    """Count the references to the media files that already exist"""
+    MediaFile = apps.get_model('renting', 'MediaFile')
+    counts = Counter()
+    for model_name, field_name in (('PropertyImages', 'property_image'), ('Landlord', 'profile_image'), ('Manager', 'profile_image')):
+        model = apps.get_model('renting', model_name)
+        for name, renditions in model.objects.values_list(field_name, 'renditions').iterator():
+            names = {path for extension in ('jpg', 'webp') for path in (renditions or {}).get(extension, {}).values()}
+            if name:
+                names.add(name)
+            counts.update(names)
+    MediaFile.objects.bulk_create(
+        [MediaFile(name=name, references=references) for name, references in counts.items()], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('renting', '0010_property_image_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='File Name')),
+                ('references', models.IntegerField(default=0, verbose_name='References')),
+            ],
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
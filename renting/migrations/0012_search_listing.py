@@ -0,0 +1,92 @@
+# Generated by Django 4.2 on 2026-10-18 10:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_listings(apps, schema_editor):
+    """Build the listings of the properties that already exist"""
+    Property = apps.get_model('renting', 'Property')
+    PropertyImages = apps.get_model('renting', 'PropertyImages')
+    SearchListing = apps.get_model('renting', 'SearchListing')
+    primary_images = {}
+    for property_id, name, renditions in PropertyImages.objects.order_by('-id').values_list('property_id', 'property_image', 'renditions'):
+        primary_images[property_id] = (name, renditions)
+    image_counts = dict(
+        PropertyImages.objects.values_list('property_id').annotate(count=models.Count('id')).order_by()
+    )
+    properties = Property.objects.select_related('landlord__user', 'property_type', 'province', 'district', 'sector', 'cell')
+    listings = []
+    for obj in properties.iterator():
+        name, renditions = primary_images.get(obj.pk, ('', {}))
+        listings.append(SearchListing(
+            property_id=obj.pk, landlord_id=obj.landlord_id, property_type_id=obj.property_type_id,
+            province_id=obj.province_id, district_id=obj.district_id, sector_id=obj.sector_id, cell_id=obj.cell_id,
+            landlord_name='{} {}'.format(obj.landlord.user.first_name, obj.landlord.user.last_name),
+            property_type_name=obj.property_type.type_name, province_name=obj.province.province_name,
+            district_name=obj.district.district_name, sector_name=obj.sector.sector_name, cell_name=obj.cell.cell_name,
+            title=obj.title, description=obj.description, bedrooms=obj.bedrooms, bathrooms=obj.bathrooms,
+            is_furnished=obj.is_furnished, floors=obj.floors, plot_size=obj.plot_size, renting_price=obj.renting_price,
+            status=obj.status, street=obj.street, primary_image=name or '', primary_image_renditions=renditions or {},
+            image_count=image_counts.get(obj.pk, 0), created_date=obj.created_date,
+        ))
+    SearchListing.objects.bulk_create(listings, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('renting', '0011_media_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchListing',
+            fields=[
+                ('property', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='renting.property', verbose_name='Property')),
+                ('landlord_name', models.CharField(max_length=201, verbose_name='Landlord Name')),
+                ('property_type_name', models.CharField(max_length=100, verbose_name='Property Type')),
+                ('province_name', models.CharField(max_length=100, verbose_name='Province Name')),
+                ('district_name', models.CharField(max_length=100, verbose_name='District Name')),
+                ('sector_name', models.CharField(max_length=100, verbose_name='Sector Name')),
+                ('cell_name', models.CharField(max_length=100, verbose_name='Cell Name')),
+                ('title', models.CharField(max_length=100, verbose_name='Property Title')),
+                ('description', models.TextField(verbose_name='Property Description')),
+                ('bedrooms', models.PositiveIntegerField(verbose_name='Bedrooms')),
+                ('bathrooms', models.PositiveIntegerField(verbose_name='Bathrooms')),
+                ('is_furnished', models.BooleanField(default=False, verbose_name='Is furnished')),
+                ('floors', models.PositiveIntegerField(null=True, verbose_name='Floors')),
+                ('plot_size', models.TextField(verbose_name='Plot Size')),
+                ('renting_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Renting Price')),
+                ('status', models.BooleanField(default=True, verbose_name='Available')),
+                ('street', models.CharField(max_length=50, verbose_name='Street Address')),
+                ('primary_image', models.CharField(blank=True, max_length=255, verbose_name='Primary Image')),
+                ('primary_image_renditions', models.JSONField(blank=True, default=dict, verbose_name='Primary Image Renditions')),
+                ('image_count', models.PositiveIntegerField(default=0, verbose_name='Images')),
+                ('created_date', models.DateTimeField(verbose_name='Created Date')),
+                ('cell', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='renting.cell')),
+                ('district', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='renting.district')),
+                ('landlord', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='renting.landlord')),
+                ('property_type', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='renting.propertytype')),
+                ('province', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='renting.province')),
+                ('sector', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='renting.sector')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchlisting',
+            index=models.Index(fields=['status', 'district', 'renting_price'], name='listing_status_district_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchlisting',
+            index=models.Index(fields=['status', 'property_type', 'bedrooms'], name='listing_status_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchlisting',
+            index=models.Index(fields=['status', 'renting_price'], name='listing_status_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchlisting',
+            index=models.Index(fields=['status', 'created_date'], name='listing_status_created_idx'),
+        ),
+        migrations.RunPython(fill_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2 on 2026-10-18 10:10
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('renting', '0012_search_listing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cell',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)], verbose_name='Latitude'),
+        ),
+        migrations.AddField(
+            model_name='cell',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)], verbose_name='Longitude'),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)], verbose_name='Latitude'),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)], verbose_name='Longitude'),
+        ),
+        migrations.AddField(
+            model_name='searchlisting',
+            name='geohash',
+            field=models.CharField(blank=True, max_length=12, verbose_name='Geohash'),
+        ),
+        migrations.AddField(
+            model_name='searchlisting',
+            name='latitude',
+            field=models.FloatField(null=True, verbose_name='Latitude'),
+        ),
+        migrations.AddField(
+            model_name='searchlisting',
+            name='longitude',
+            field=models.FloatField(null=True, verbose_name='Longitude'),
+        ),
+        migrations.AddField(
+            model_name='sector',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)], verbose_name='Latitude'),
+        ),
+        migrations.AddField(
+            model_name='sector',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)], verbose_name='Longitude'),
+        ),
+        migrations.AddIndex(
+            model_name='searchlisting',
+            index=models.Index(fields=['status', 'geohash'], name='listing_status_geohash_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchlisting',
+            index=models.Index(fields=['geohash'], name='listing_geohash_idx'),
+        ),
+    ]
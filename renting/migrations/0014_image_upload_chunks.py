@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('renting', '0013_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='propertyimageupload',
+            name='chunks',
+            field=models.JSONField(default=list, editable=False, verbose_name='Stored Chunks'),
+        ),
+        migrations.AddField(
+            model_name='propertyimageupload',
+            name='offset',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Bytes Received'),
+        ),
+    ]
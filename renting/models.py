@@ -1,13 +1,31 @@
-from django.db import models
+import uuid
+
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from phonenumber_field.modelfields import PhoneNumberField
 from django.utils.safestring import mark_safe
-from django.core.validators import FileExtensionValidator
+from django.core.validators import FileExtensionValidator, MaxValueValidator, MinValueValidator
+
+from .querysets import PropertyQuerySet, LandlordQuerySet
 
 
 # get user model
 User = get_user_model()
 
+LATITUDE_VALIDATORS = [MinValueValidator(-90), MaxValueValidator(90)]
+LONGITUDE_VALIDATORS = [MinValueValidator(-180), MaxValueValidator(180)]
+
+class MediaModel(models.Model):
+    """A model with an image field, its files are stored and their references counted
+    in the same transaction, see renting/storage.py"""
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
 # Create your models here.
 class Province(models.Model):
     province_name = models.CharField(verbose_name="Province Name", max_length=100, blank=False, unique=True)
@@ -23,12 +41,17 @@ class District(models.Model):
 class Sector(models.Model):
     district = models.ForeignKey(District,verbose_name="District", related_name='sectors', on_delete=models.CASCADE)
     sector_name = models.CharField(verbose_name="Sector Name", max_length=100, blank=False, unique=True)
+    # centroid, where properties without coordinates of their own are placed
+    latitude = models.FloatField(verbose_name="Latitude", null=True, blank=True, validators=LATITUDE_VALIDATORS)
+    longitude = models.FloatField(verbose_name="Longitude", null=True, blank=True, validators=LONGITUDE_VALIDATORS)
     def __str__(self):
         return self.sector_name
 
 class Cell(models.Model):
     sector = models.ForeignKey(Sector,verbose_name="Sector", related_name='cells', on_delete=models.CASCADE)
     cell_name = models.CharField(verbose_name="Cell Name", max_length=100, blank=False, unique=True)
+    latitude = models.FloatField(verbose_name="Latitude", null=True, blank=True, validators=LATITUDE_VALIDATORS)
+    longitude = models.FloatField(verbose_name="Longitude", null=True, blank=True, validators=LONGITUDE_VALIDATORS)
     def __str__(self):
         return self.cell_name
 
@@ -41,7 +64,7 @@ class UserLocation(models.Model):
     def __str__(self):
         return '{} {}'.format(self.user.first_name,self.user.last_name)
 
-class Manager(models.Model):
+class Manager(MediaModel):
     class Gender(models.TextChoices):
         SELECT = "", "Select Gender"
         MALE = "Male", "Male"
@@ -56,6 +79,7 @@ class Manager(models.Model):
         validators=[FileExtensionValidator(['png','jpg','jpeg'])], 
         blank=True,
     )
+    renditions = models.JSONField(verbose_name="Image Renditions", default=dict, blank=True, editable=False)
     def image(self):
         return mark_safe('<img src="/../../media/%s" width="70" />' % (self.profile_image))
     image.allow_tags = True
@@ -63,7 +87,7 @@ class Manager(models.Model):
         return '{} {}'.format(self.user.first_name,self.user.last_name)
 
 
-class Landlord(models.Model):
+class Landlord(MediaModel):
     class Gender(models.TextChoices):
         SELECT = "", "Select Gender"
         MALE = "Male", "Male"
@@ -77,6 +101,10 @@ class Landlord(models.Model):
         upload_to='profile/landlords', 
         validators=[FileExtensionValidator(['png','jpg','jpeg'])]
     )
+    renditions = models.JSONField(verbose_name="Image Renditions", default=dict, blank=True, editable=False)
+
+    objects = LandlordQuerySet.as_manager()
+
     def image(self):
         return mark_safe('<img src="/../../media/%s" width="70" />' % (self.profile_image))
     image.allow_tags = True
@@ -106,24 +134,109 @@ class Property(models.Model):
     sector = models.ForeignKey(Sector, verbose_name="Sector", on_delete=models.PROTECT)
     cell = models.ForeignKey(Cell, verbose_name="Cell", on_delete=models.PROTECT)
     street = models.CharField(verbose_name="Street Address", max_length=50, blank=False)
+    latitude = models.FloatField(verbose_name="Latitude", null=True, blank=True, validators=LATITUDE_VALIDATORS)
+    longitude = models.FloatField(verbose_name="Longitude", null=True, blank=True, validators=LONGITUDE_VALIDATORS)
     pub_date = models.DateTimeField(verbose_name="Published Date", auto_now=True)
     created_date = models.DateTimeField(verbose_name="Created Date", auto_now_add=True)
+
+    objects = PropertyQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # composite indexes backing the rental search filters and orderings
+            models.Index(fields=['status', 'district', 'renting_price'], name='property_status_district_idx'),
+            models.Index(fields=['status', 'property_type', 'bedrooms'], name='property_status_type_idx'),
+            models.Index(fields=['status', 'renting_price'], name='property_status_price_idx'),
+            models.Index(fields=['status', 'created_date'], name='property_status_created_idx'),
+        ]
     def __str__(self):
         return self.title
 
-class PropertyImages(models.Model):
+class PropertyImages(MediaModel):
     property = models.ForeignKey(Property, verbose_name="Property", related_name='images', on_delete=models.CASCADE)
     property_image = models.ImageField(
         verbose_name="Property Image",
         upload_to='properties',
         validators=[FileExtensionValidator(['png','jpg','jpeg'])]
     )
+    renditions = models.JSONField(verbose_name="Image Renditions", default=dict, blank=True, editable=False)
     def image(self):
         return mark_safe('<img src="/../../media/%s" width="120" />' % (self.property_image))
     image.allow_tags = True
     def __str__(self):
         return '{} {}'.format(self.property, self.property_image)
 
+class PropertyImageUpload(models.Model):
+    """A resumable, chunked upload of a property image, see renting/uploads.py"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    property = models.ForeignKey(Property, verbose_name="Property", related_name='image_uploads', on_delete=models.CASCADE)
+    filename = models.CharField(verbose_name="File Name", max_length=100)
+    size = models.PositiveBigIntegerField(verbose_name="Size")
+    checksum = models.CharField(verbose_name="SHA-256 Checksum", max_length=64)
+    offset = models.PositiveBigIntegerField(verbose_name="Bytes Received", default=0)
+    chunks = models.JSONField(verbose_name="Stored Chunks", default=list, editable=False)
+    created_date = models.DateTimeField(verbose_name="Created Date", auto_now_add=True)
+    def __str__(self):
+        return '{} {}'.format(self.property, self.filename)
+
+class MediaFile(models.Model):
+    """How many rows reference a stored media file, see renting/storage.py"""
+    name = models.CharField(verbose_name="File Name", max_length=255, unique=True)
+    references = models.IntegerField(verbose_name="References", default=0)
+    def __str__(self):
+        return self.name
+
+class SearchListing(models.Model):
+    """One denormalized row per property, read by the rental search instead of joining
+    the property to its type, landlord, locations and images. Kept up to date by the
+    signal handlers, see renting/listings.py."""
+    SEARCH_FALLBACK_FIELDS = ('title', 'description', 'street', 'province_name', 'district_name', 'sector_name', 'cell_name')
+
+    property = models.OneToOneField(Property, verbose_name="Property", primary_key=True, related_name='listing', on_delete=models.CASCADE)
+    # the ids are kept for filtering, without constraints so the listing never joins or cascades
+    landlord = models.ForeignKey(Landlord, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    property_type = models.ForeignKey(PropertyType, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    province = models.ForeignKey(Province, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    district = models.ForeignKey(District, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    sector = models.ForeignKey(Sector, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    cell = models.ForeignKey(Cell, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    landlord_name = models.CharField(verbose_name="Landlord Name", max_length=201)
+    property_type_name = models.CharField(verbose_name="Property Type", max_length=100)
+    province_name = models.CharField(verbose_name="Province Name", max_length=100)
+    district_name = models.CharField(verbose_name="District Name", max_length=100)
+    sector_name = models.CharField(verbose_name="Sector Name", max_length=100)
+    cell_name = models.CharField(verbose_name="Cell Name", max_length=100)
+    title = models.CharField(verbose_name="Property Title", max_length=100)
+    description = models.TextField(verbose_name="Property Description")
+    bedrooms = models.PositiveIntegerField(verbose_name="Bedrooms")
+    bathrooms = models.PositiveIntegerField(verbose_name="Bathrooms")
+    is_furnished = models.BooleanField(verbose_name="Is furnished", default=False)
+    floors = models.PositiveIntegerField(verbose_name="Floors", null=True)
+    plot_size = models.TextField(verbose_name="Plot Size")
+    renting_price = models.DecimalField(verbose_name="Renting Price", max_digits=10, decimal_places=2)
+    status = models.BooleanField(verbose_name="Available", default=True)
+    street = models.CharField(verbose_name="Street Address", max_length=50)
+    primary_image = models.CharField(verbose_name="Primary Image", max_length=255, blank=True)
+    primary_image_renditions = models.JSONField(verbose_name="Primary Image Renditions", default=dict, blank=True)
+    image_count = models.PositiveIntegerField(verbose_name="Images", default=0)
+    created_date = models.DateTimeField(verbose_name="Created Date")
+    # coordinates of the property or else the centroid of its cell or sector, see renting/geo.py
+    latitude = models.FloatField(verbose_name="Latitude", null=True)
+    longitude = models.FloatField(verbose_name="Longitude", null=True)
+    geohash = models.CharField(verbose_name="Geohash", max_length=12, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'district', 'renting_price'], name='listing_status_district_idx'),
+            models.Index(fields=['status', 'property_type', 'bedrooms'], name='listing_status_type_idx'),
+            models.Index(fields=['status', 'renting_price'], name='listing_status_price_idx'),
+            models.Index(fields=['status', 'created_date'], name='listing_status_created_idx'),
+            models.Index(fields=['status', 'geohash'], name='listing_status_geohash_idx'),
+            models.Index(fields=['geohash'], name='listing_geohash_idx'),
+        ]
+    def __str__(self):
+        return self.title
+
 class PublishingPayment(models.Model):
     PAYMENT_METHOD_CHOICES = [
         ('credit_card', 'Credit Card'),
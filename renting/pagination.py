@@ -0,0 +1,149 @@
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination keyed on (ordering field, primary key).
+
+    The ordering is taken from the queryset when the view already ordered it,
+    e.g. ('renting_price', 'pk'), otherwise ``ordering`` is used. The cursor
+    stores the last (value, pk) pair seen, so every page is a plain indexed
+    range query no matter how deep it is, and ties on the ordering field are
+    broken by the primary key instead of an offset. When the ordering field
+    can be null, like the distance of an unlocated listing, the null rows come
+    last in both directions.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_date', '-pk')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = queryset.query.order_by or self.ordering
+        field = ordering[0]
+        direction = '-' if field.startswith('-') else ''
+        return (field, direction + 'pk')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() for async views"""
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([obj async for obj in queryset])
+
+    def page_queryset(self, queryset, request, view=None):
+        """The queryset of the requested page, with one extra row telling whether another page follows"""
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, position = False, None
+        else:
+            reverse, position = self.cursor.reverse, self.decode_position(self.cursor.position)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self.flip(field) for field in ordering)
+        field, pk_field = ordering
+        nulls = None
+        if self.nullable(queryset, field.lstrip('-')):
+            # going back the null rows come first
+            nulls = 'first' if reverse else 'last'
+            expression = F(field.lstrip('-'))
+            expression = expression.desc if field.startswith('-') else expression.asc
+            field = expression(nulls_first=reverse, nulls_last=not reverse)
+        queryset = queryset.order_by(field, pk_field)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position, nulls))
+        self.reverse, self.position = reverse, position
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        """Keep the page of the rows fetched by page_queryset() and work out its links"""
+        reverse, position = self.reverse, self.position
+        self.page = results[:self.page_size]
+        has_following = len(results) > self.page_size
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next, self.has_previous = position is not None, has_following
+        else:
+            self.has_next, self.has_previous = has_following, position is not None
+
+        if self.page:
+            self.previous_position = self.encode_position(self.page[0])
+            self.next_position = self.encode_position(self.page[-1])
+        else:
+            self.previous_position = self.next_position = self.cursor.position if self.cursor else None
+
+        if (self.has_next or self.has_previous) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.next_position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.previous_position))
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def nullable(queryset, name):
+        """Whether the ordering field can be null, annotations are assumed to"""
+        try:
+            return queryset.model._meta.get_field(name).null
+        except FieldDoesNotExist:
+            return True
+
+    @staticmethod
+    def after(ordering, position, nulls=None):
+        """Rows that come after ``position`` in ``ordering``, with the null values of the
+        ordering field coming 'first' or 'last' when it has any"""
+        value, pk = position
+        field, pk_field = ordering
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        pk_lookup = 'lt' if pk_field.startswith('-') else 'gt'
+        field, pk_field = field.lstrip('-'), pk_field.lstrip('-')
+        if value is None:
+            if nulls is None:
+                raise NotFound(CursorPagination.invalid_cursor_message)
+            following = Q(**{f'{field}__isnull': True, f'{pk_field}__{pk_lookup}': pk})
+            if nulls == 'first':
+                following |= Q(**{f'{field}__isnull': False})
+            return following
+        following = Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'{pk_field}__{pk_lookup}': pk})
+        if nulls == 'last':
+            following |= Q(**{f'{field}__isnull': True})
+        return following
+
+    def encode_position(self, instance):
+        field, pk_field = (name.lstrip('-') for name in self.ordering)
+        return json.dumps([getattr(instance, field), getattr(instance, pk_field)], default=str)
+
+    def decode_position(self, position):
+        try:
+            value, pk = json.loads(position)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
@@ -1,4 +1,17 @@
 from rest_framework import permissions
 
+from .models import Landlord
 
-# create custom permissions here
\ No newline at end of file
+
+# create custom permissions here
+class IsLandlordOrStaff(permissions.BasePermission):
+    """The request is made by the landlord of the ``landlord_pk`` in the URL, or by staff"""
+    message = "Only the landlord can manage their properties in bulk."
+
+    def has_permission(self, request, view):
+        user = request.user
+        if not (user and user.is_authenticated):
+            return False
+        if user.is_staff:
+            return True
+        return Landlord.objects.filter(pk=view.kwargs.get('landlord_pk'), user=user).exists()
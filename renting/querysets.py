@@ -0,0 +1,23 @@
+from django.db import models
+from django.db.models import Prefetch
+
+
+class PropertyQuerySet(models.QuerySet):
+    def with_details(self):
+        """Join and prefetch everything PropertySerializer renders, so a page of
+        properties costs the same number of queries whatever its size"""
+        from .models import PropertyImages
+        return self.select_related(
+            'landlord__user', 'property_type', 'province', 'district', 'sector', 'cell',
+        ).prefetch_related(
+            Prefetch('images', queryset=PropertyImages.objects.order_by('id')),
+        )
+
+
+class LandlordQuerySet(models.QuerySet):
+    def with_properties(self):
+        """Join the user and prefetch the landlord's properties rendered by LandlordSerializer"""
+        from .models import Property
+        return self.select_related('user').prefetch_related(
+            Prefetch('properties', queryset=Property.objects.with_details()),
+        )
@@ -0,0 +1,137 @@
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+
+# Full-text index over the property title, description, street and location names.
+# PostgreSQL keeps a weighted tsvector per property behind a GIN index, SQLite an
+# FTS5 table keyed by the property id, both created by migration 0008; other
+# databases fall back to icontains.
+POSTGRES_TABLE = 'renting_property_search'
+SQLITE_TABLE = 'renting_property_fts'
+BATCH_SIZE = 500
+
+SOURCE_SQL = """
+    SELECT p.id AS id, p.title AS title, p.description AS description, p.street AS street,
+           pr.province_name || ' ' || d.district_name || ' ' || s.sector_name || ' ' || c.cell_name AS location
+    FROM renting_property p
+    JOIN renting_province pr ON pr.id = p.province_id
+    JOIN renting_district d ON d.id = p.district_id
+    JOIN renting_sector s ON s.id = p.sector_id
+    JOIN renting_cell c ON c.id = p.cell_id
+"""
+POSTGRES_DOCUMENT_SQL = (
+    "setweight(to_tsvector('english', title), 'A') || "
+    "setweight(to_tsvector('english', location), 'B') || "
+    "setweight(to_tsvector('english', street), 'B') || "
+    "setweight(to_tsvector('english', description), 'C')"
+)
+# bm25 column weights for (title, description, street, location)
+SQLITE_WEIGHTS = '10.0, 1.0, 5.0, 5.0'
+SQLITE_STOPWORDS = {'a', 'an', 'and', 'are', 'at', 'for', 'in', 'is', 'of', 'on', 'or', 'the', 'to', 'with'}
+
+FALLBACK_FIELDS = (
+    'title', 'description', 'street',
+    'province__province_name', 'district__district_name', 'sector__sector_name', 'cell__cell_name',
+)
+
+
+def _batches(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        yield ids[start:start + BATCH_SIZE]
+
+
+def index_properties(ids=None, using=DEFAULT_DB_ALIAS):
+    """Write the index entries of the given property ids, or rebuild the whole index when ids is None"""
+    connection = connections[using]
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    if ids is None:
+        remove_properties(None, using=using)
+        batches = [None]
+    else:
+        batches = _batches(ids)
+
+    with connection.cursor() as cursor:
+        for batch in batches:
+            where, params = '', []
+            if batch is not None:
+                where, params = ' WHERE p.id IN (%s)' % ', '.join(['%s'] * len(batch)), batch
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f"INSERT INTO {POSTGRES_TABLE} (property_id, document) "
+                    f"SELECT id, {POSTGRES_DOCUMENT_SQL} FROM ({SOURCE_SQL}{where}) AS source "
+                    "ON CONFLICT (property_id) DO UPDATE SET document = EXCLUDED.document",
+                    params,
+                )
+            else:
+                if batch is not None:
+                    cursor.execute(
+                        f"DELETE FROM {SQLITE_TABLE} WHERE rowid IN (%s)" % ', '.join(['%s'] * len(batch)), batch,
+                    )
+                cursor.execute(
+                    f"INSERT INTO {SQLITE_TABLE} (rowid, title, description, street, location) {SOURCE_SQL}{where}",
+                    params,
+                )
+
+
+def remove_properties(ids=None, using=DEFAULT_DB_ALIAS):
+    """Delete the index entries of the given property ids, or every entry when ids is None"""
+    connection = connections[using]
+    table = {'postgresql': POSTGRES_TABLE, 'sqlite': SQLITE_TABLE}.get(connection.vendor)
+    if table is None:
+        return
+    column = 'property_id' if connection.vendor == 'postgresql' else 'rowid'
+    with connection.cursor() as cursor:
+        if ids is None:
+            cursor.execute(f"DELETE FROM {table}")
+            return
+        for batch in _batches(ids):
+            cursor.execute(f"DELETE FROM {table} WHERE {column} IN (%s)" % ', '.join(['%s'] * len(batch)), batch)
+
+
+def sqlite_query(q):
+    """Turn free text into an FTS5 query matching every significant word"""
+    terms = [term for term in re.findall(r'\w+', q.lower()) if term not in SQLITE_STOPWORDS]
+    return ' '.join('"%s"' % term for term in terms)
+
+
+def search_properties(queryset, q):
+    """Filter a Property queryset, or a queryset of a model whose primary key is the
+    property id, down to the matches of ``q``, annotated with ``search_rank`` where a
+    higher rank is a better match. Databases without a full-text index search the
+    model's SEARCH_FALLBACK_FIELDS, or FALLBACK_FIELDS, with icontains. A ``q`` of
+    stopwords or punctuation only leaves the queryset unfiltered."""
+    connection = connections[queryset.db]
+    vendor = connection.vendor
+    opts = queryset.model._meta
+    pk_column = '%s.%s' % (connection.ops.quote_name(opts.db_table), connection.ops.quote_name(opts.pk.column))
+    if vendor == 'postgresql':
+        # a query of stopwords only is empty and matches every property, like no query
+        matches = RawSQL(
+            f"SELECT property_id FROM {POSTGRES_TABLE} WHERE numnode(websearch_to_tsquery('english', %s)) = 0 "
+            f"OR document @@ websearch_to_tsquery('english', %s)", [q, q],
+        )
+        rank = RawSQL(
+            f"SELECT ts_rank(document, websearch_to_tsquery('english', %s)) FROM {POSTGRES_TABLE} "
+            f"WHERE property_id = {pk_column}", [q], output_field=FloatField(),
+        )
+    elif vendor == 'sqlite':
+        query = sqlite_query(q)
+        if not query:
+            # only stopwords or punctuation, search without a text filter
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+        matches = RawSQL(f"SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s", [query])
+        rank = RawSQL(
+            f"SELECT -bm25({SQLITE_TABLE}, {SQLITE_WEIGHTS}) FROM {SQLITE_TABLE} "
+            f"WHERE {SQLITE_TABLE} MATCH %s AND rowid = {pk_column}", [query], output_field=FloatField(),
+        )
+    else:
+        lookups = Q()
+        for field in getattr(queryset.model, 'SEARCH_FALLBACK_FIELDS', FALLBACK_FIELDS):
+            lookups |= Q(**{f'{field}__icontains': q})
+        return queryset.filter(lookups).annotate(search_rank=Value(0.0, output_field=FloatField()))
+    return queryset.filter(pk__in=matches).annotate(search_rank=rank)
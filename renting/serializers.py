@@ -3,7 +3,108 @@ from rest_framework_nested.serializers import NestedHyperlinkedModelSerializer
 # hyperlinks for nested relations on API
 from rest_framework_nested.relations import NestedHyperlinkedRelatedField
 
-from .models import Province, District, Sector, Cell, UserLocation, Manager, Landlord, PropertyType, Property, PropertyImages, PublishingPayment, GetInTouch, Testimonial
+import os
+
+from django.conf import settings
+
+from .models import Province, District, Sector, Cell, UserLocation, Manager, Landlord, PropertyType, Property, PropertyImages, PropertyImageUpload, SearchListing, PublishingPayment, GetInTouch, Testimonial
+from .filters import MAX_SEARCH_RADIUS, SEARCH_ORDERING_CHOICES, SEARCH_STATUS_CHOICES
+from .images import rendition_urls
+from .uploads import attach_images, sync_images
+
+
+class RenditionsField(serializers.ReadOnlyField):
+    """URLs of the resized renditions of an image field, see renting.images"""
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        request = self.context.get('request')
+        storage = getattr(instance, self.image_field).storage
+        return rendition_urls(storage, instance.renditions, request.build_absolute_uri if request else None)
+
+
+class MultipleValueField(serializers.ListField):
+    """A list of ids that also accepts a single value or a comma separated string,
+    like ``?district=1,2`` or ``?district=1&district=2``"""
+    def __init__(self, **kwargs):
+        kwargs.setdefault('child', serializers.IntegerField(min_value=1))
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, (list, tuple)):
+            data = [data]
+        values = []
+        for value in data:
+            if isinstance(value, str):
+                values.extend(item for item in value.split(',') if item.strip())
+            else:
+                values.append(value)
+        return super().to_internal_value(values)
+
+
+def parse_fieldset(value):
+    """Turn ``a,b.c,b.d`` into ``{'a': {}, 'b': {'c': {}, 'd': {}}}``"""
+    tree = {}
+    for path in (value or '').split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+# a selection that wasn't given yet, unlike None, every field
+UNSET = object()
+
+
+class SparseFieldsetsMixin:
+    """Lets clients pick the fields of a response with ``?fields=id,title,landlord.id``
+    and include the fields listed in ``Meta.expandable_fields``, which are left out by
+    default, with ``?expand=landlord_profile``. Nested serializers using the mixin get
+    the part of the selection under their field name.
+
+    The selection can also be given with the ``fields`` and ``expand`` arguments, as
+    dotted strings. It only narrows representations, serializers that validate input
+    keep all their fields."""
+    def __init__(self, *args, **kwargs):
+        fields, expand = kwargs.pop('fields', None), kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+        self._fieldset = UNSET if fields is None else parse_fieldset(fields)
+        self._expand = UNSET if expand is None else parse_fieldset(expand)
+
+    def get_sparse_fieldsets(self):
+        root = self.root
+        request = self.context.get('request')
+        # the query parameters select the fields of the top level serializer, or of each
+        # item of a list, nested serializers get their part of it from their parent
+        top_level = root is self or (isinstance(root, serializers.ListSerializer) and root.child is self)
+        params = getattr(request, 'query_params', getattr(request, 'GET', {})) if top_level else {}
+        if self._fieldset is UNSET:
+            self._fieldset = parse_fieldset(params['fields']) if 'fields' in params else None
+        if self._expand is UNSET:
+            self._expand = parse_fieldset(params.get('expand'))
+        fieldset = None if hasattr(root, 'initial_data') else self._fieldset
+        return fieldset or None, self._expand or {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset, expand = self.get_sparse_fieldsets()
+        for name in getattr(self.Meta, 'expandable_fields', ()):
+            if name not in expand:
+                fields.pop(name, None)
+        if fieldset is not None:
+            for name in list(fields):
+                if name not in fieldset:
+                    fields.pop(name)
+        for name, field in fields.items():
+            child = getattr(field, 'child', field)
+            if isinstance(child, SparseFieldsetsMixin):
+                child._fieldset = (fieldset or {}).get(name) or None
+                child._expand = expand.get(name, {})
+        return fields
 
 
 class CellSerializer(NestedHyperlinkedModelSerializer):
@@ -42,7 +143,7 @@ class ProvinceSerializer(serializers.HyperlinkedModelSerializer):
         model = Province
         fields = [ 'id', 'province_name', 'districts',]
 
-class UserLocationSerializer(serializers.ModelSerializer):
+class UserLocationSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     parent_lookup_kwargs = {
         'location_pk': 'location__pk',
         'user_pk': 'user__pk',
@@ -56,15 +157,16 @@ class UserLocationSerializer(serializers.ModelSerializer):
         fields = ['id','user','province','district','sector']
         read_only_fields = ['user']
 
-class ManagerSerializer(serializers.HyperlinkedModelSerializer):
+class ManagerSerializer(SparseFieldsetsMixin, serializers.HyperlinkedModelSerializer):
     parent_lookup_kwargs = {
         'manager_pk': 'manager__pk',
         'user_pk': 'user__pk',
     }
     user = serializers.StringRelatedField(read_only=True)
+    renditions = RenditionsField('profile_image')
     class Meta:
         model = Manager
-        fields = ['id','user','gender','phone_number','profile_image',]
+        fields = ['id','user','gender','phone_number','profile_image','renditions',]
         read_only_fields = ['user']
     
     def update_or_create(self, *args, **kwargs):
@@ -72,23 +174,49 @@ class ManagerSerializer(serializers.HyperlinkedModelSerializer):
         return manager
 
 
-class PropertyImagesSerializer(NestedHyperlinkedModelSerializer):
+class PropertyImagesSerializer(SparseFieldsetsMixin, NestedHyperlinkedModelSerializer):
     parent_lookup_kwargs = {
         'property_pk': 'property__pk',
         'landlord_pk': 'landlord__pk',
         'user_pk': 'landlord__user__pk',
     }
     property = serializers.StringRelatedField(read_only=True)
+    renditions = RenditionsField('property_image')
     class Meta:
         model = PropertyImages
-        fields = ['id','property','property_image']
+        fields = ['id','property','property_image','renditions']
+
+class PropertyImageUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PropertyImageUpload
+        fields = ['id','filename','size','checksum','offset','created_date']
+        read_only_fields = ['offset']
+
+    def validate_filename(self, value):
+        if os.path.splitext(value)[1].lower() not in ('.png', '.jpg', '.jpeg'):
+            raise serializers.ValidationError("Only png, jpg and jpeg images can be uploaded.")
+        return value
 
-class PropertyTypeSerializer(serializers.HyperlinkedModelSerializer):
+    def validate_size(self, value):
+        if not 0 < value <= settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"Images must be between 1 and {settings.CHUNKED_UPLOAD_MAX_SIZE} bytes.")
+        return value
+
+    def validate_checksum(self, value):
+        value = value.lower()
+        if len(value) != 64 or any(char not in '0123456789abcdef' for char in value):
+            raise serializers.ValidationError("Expected the hex SHA-256 digest of the file.")
+        return value
+
+class PropertyImageUploadCompleteSerializer(serializers.Serializer):
+    uploads = serializers.ListField(child=serializers.UUIDField(), allow_empty=False)
+
+class PropertyTypeSerializer(SparseFieldsetsMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = PropertyType
         fields = [ 'id', 'type_name',]
 
-class PropertySerializer(NestedHyperlinkedModelSerializer):
+class PropertySerializer(SparseFieldsetsMixin, NestedHyperlinkedModelSerializer):
     parent_lookup_kwargs = {
         'landlord_pk': 'landlord__pk',
         'user_pk': 'landlord__user__pk',
@@ -102,13 +230,12 @@ class PropertySerializer(NestedHyperlinkedModelSerializer):
     images = PropertyImagesSerializer(many=True, read_only=True)
     class Meta:
         model = Property
-        fields = ['id','landlord','property_type','title','description','bedrooms','bathrooms','is_furnished','floors','plot_size','renting_price','status','status','province','district','sector','cell','street','pub_date','created_date','images']
+        fields = ['id','landlord','property_type','title','description','bedrooms','bathrooms','is_furnished','floors','plot_size','renting_price','status','status','province','district','sector','cell','street','latitude','longitude','pub_date','created_date','images']
 
     def create(self, validated_data):
         images_data = self.context.get('view').request.FILES
         property_obj = Property.objects.create(**validated_data)
-        for image_data in images_data.values():
-            PropertyImages.objects.create(property=property_obj, image=image_data)
+        attach_images(property_obj, [(image_data.name, image_data) for image_data in images_data.values()])
         return property_obj
 
     def update(self, instance, validated_data):
@@ -118,12 +245,31 @@ class PropertySerializer(NestedHyperlinkedModelSerializer):
         instance.save()
 
         if images_data:
-            instance.images.all().delete()
-            for image_data in images_data.values():
-                PropertyImages.objects.create(property=instance, image=image_data)
+            sync_images(instance, [(image_data.name, image_data) for image_data in images_data.values()])
 
         return instance
 
+class PropertyImportSerializer(serializers.Serializer):
+    """A row of a bulk property import, see renting.bulk. The property type and the
+    locations are given by name."""
+    property_type = serializers.CharField(max_length=100)
+    title = serializers.CharField(max_length=100)
+    description = serializers.CharField()
+    bedrooms = serializers.IntegerField(min_value=0)
+    bathrooms = serializers.IntegerField(min_value=0)
+    is_furnished = serializers.BooleanField(required=False, default=False)
+    floors = serializers.IntegerField(min_value=0, required=False, allow_null=True)
+    plot_size = serializers.CharField()
+    renting_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    status = serializers.BooleanField(required=False, default=True)
+    province = serializers.CharField(max_length=100)
+    district = serializers.CharField(max_length=100)
+    sector = serializers.CharField(max_length=100)
+    cell = serializers.CharField(max_length=100)
+    street = serializers.CharField(max_length=50)
+    latitude = serializers.FloatField(min_value=-90, max_value=90, required=False, allow_null=True)
+    longitude = serializers.FloatField(min_value=-180, max_value=180, required=False, allow_null=True)
+
 class PublishingPaymentSerializer(NestedHyperlinkedModelSerializer):
     parent_lookup_kwargs = {
         'property_pk': 'property__pk',
@@ -136,16 +282,17 @@ class PublishingPaymentSerializer(NestedHyperlinkedModelSerializer):
         fields = ['id','property','landlord','payment_amount','payment_method','created_date']
         # read_only_fields = ['property','landlord','created_date']
 
-class LandlordSerializer(serializers.HyperlinkedModelSerializer):
+class LandlordSerializer(SparseFieldsetsMixin, serializers.HyperlinkedModelSerializer):
     parent_lookup_kwargs = {
         'landlord_pk': 'landlord__pk',
         'user_pk': 'user__pk',
     }
     user = serializers.StringRelatedField(read_only=True)
+    renditions = RenditionsField('profile_image')
     properties=PropertySerializer(many=True, read_only=True)
     class Meta:
         model = Landlord
-        fields = ['id',"user","gender","phone_number","profile_image","properties",]
+        fields = ['id',"user","gender","phone_number","profile_image","renditions","properties",]
         read_only_fields = ['user']
 
 class GetInTouchSerializer(serializers.HyperlinkedModelSerializer):
@@ -161,18 +308,95 @@ class TestimonialSerializer(serializers.HyperlinkedModelSerializer):
 
 
 class RentalSearchSerializer(serializers.Serializer):
-    id = serializers.IntegerField(required=False,read_only=True)
-    landlord = LandlordSerializer(required=False,read_only=True)
-    property_type = serializers.CharField(required=False, allow_blank=True)
+    """The parameters of a rental search, the results are rendered by SearchListingSerializer"""
+    property_type = MultipleValueField(required=False, allow_empty=True)
     bedrooms = serializers.IntegerField(required=False)
     bathrooms = serializers.IntegerField(required=False)
     is_furnished = serializers.BooleanField(required=False)
     floors = serializers.IntegerField(required=False)
     renting_price = serializers.DecimalField(required=False, max_digits=10, decimal_places=2)
-    district = serializers.CharField(required=False, allow_blank=True)
-    sector = serializers.CharField(required=False, allow_blank=True)
-    cell = serializers.CharField(required=False, allow_blank=True)
-    images = PropertyImagesSerializer(many=True, read_only=True)
+    district = MultipleValueField(required=False, allow_empty=True)
+    sector = MultipleValueField(required=False, allow_empty=True)
+    cell = MultipleValueField(required=False, allow_empty=True)
+    q = serializers.CharField(required=False, allow_blank=True, write_only=True, max_length=200)
+    min_price = serializers.DecimalField(required=False, write_only=True, max_digits=10, decimal_places=2, min_value=0)
+    max_price = serializers.DecimalField(required=False, write_only=True, max_digits=10, decimal_places=2, min_value=0)
+    min_bedrooms = serializers.IntegerField(required=False, write_only=True, min_value=0)
+    max_bedrooms = serializers.IntegerField(required=False, write_only=True, min_value=0)
+    min_bathrooms = serializers.IntegerField(required=False, write_only=True, min_value=0)
+    max_bathrooms = serializers.IntegerField(required=False, write_only=True, min_value=0)
+    status = serializers.ChoiceField(choices=SEARCH_STATUS_CHOICES, default='available', write_only=True)
+    ordering = serializers.ChoiceField(choices=SEARCH_ORDERING_CHOICES, required=False, write_only=True)
+    facets = serializers.BooleanField(required=False, default=False, write_only=True)
+    # nearby searches, a distance in km from a point, MAX_SEARCH_RADIUS unless given,
+    # or a bounding box in degrees
+    latitude = serializers.FloatField(required=False, write_only=True, min_value=-90, max_value=90)
+    longitude = serializers.FloatField(required=False, write_only=True, min_value=-180, max_value=180)
+    radius = serializers.FloatField(required=False, write_only=True, min_value=0.01, max_value=MAX_SEARCH_RADIUS)
+    north = serializers.FloatField(required=False, write_only=True, min_value=-90, max_value=90)
+    south = serializers.FloatField(required=False, write_only=True, min_value=-90, max_value=90)
+    east = serializers.FloatField(required=False, write_only=True, min_value=-180, max_value=180)
+    west = serializers.FloatField(required=False, write_only=True, min_value=-180, max_value=180)
+
+    def validate(self, data):
+        for low, high in (('min_price', 'max_price'), ('min_bedrooms', 'max_bedrooms'), ('min_bathrooms', 'max_bathrooms')):
+            if data.get(low) is not None and data.get(high) is not None and data[low] > data[high]:
+                raise serializers.ValidationError({low: f"{low} must not be greater than {high}."})
+        if (data.get('latitude') is None) != (data.get('longitude') is None):
+            raise serializers.ValidationError({'latitude': "latitude and longitude must be given together."})
+        if data.get('radius') is not None and data.get('latitude') is None:
+            raise serializers.ValidationError({'radius': "radius needs a latitude and a longitude."})
+        bounds = [data.get(name) for name in ('north', 'south', 'east', 'west')]
+        if any(bound is not None for bound in bounds):
+            if any(bound is None for bound in bounds):
+                raise serializers.ValidationError({'north': "north, south, east and west must be given together."})
+            if data['south'] > data['north'] or data['west'] > data['east']:
+                raise serializers.ValidationError({'north': "south must not be greater than north nor west than east."})
+        if data.get('ordering') == 'distance' and data.get('latitude') is None:
+            raise serializers.ValidationError({'ordering': "Ordering by distance needs a latitude and a longitude."})
+        # results of a text search are ranked by relevance unless asked otherwise
+        # and those around a point by distance
+        if data.get('ordering') is None or (data['ordering'] == 'relevance' and not data.get('q')):
+            if data.get('q'):
+                data['ordering'] = 'relevance'
+            elif data.get('latitude') is not None:
+                data['ordering'] = 'distance'
+            else:
+                data['ordering'] = '-created_date'
+        return data
+
+
+class SearchListingSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
+    """A search result, read from the search listing of the property alone"""
+    id = serializers.IntegerField(source='property_id', read_only=True)
+    landlord = serializers.SerializerMethodField()
+    property_type = serializers.CharField(source='property_type_name', read_only=True)
+    province = serializers.CharField(source='province_name', read_only=True)
+    district = serializers.CharField(source='district_name', read_only=True)
+    sector = serializers.CharField(source='sector_name', read_only=True)
+    cell = serializers.CharField(source='cell_name', read_only=True)
+    primary_image = serializers.SerializerMethodField()
+    distance = serializers.SerializerMethodField()
     class Meta:
-        model = Property
-        fields = ['id','landlord','property_type','title','description','bedrooms','bathrooms','is_furnished','floors','plot_size','renting_price','status','province','district','sector','cell','street','images']
+        model = SearchListing
+        fields = ['id','landlord','property_type','title','description','bedrooms','bathrooms','is_furnished','floors','plot_size','renting_price','status','province','district','sector','cell','street','latitude','longitude','distance','created_date','primary_image','image_count']
+
+    def get_landlord(self, obj):
+        return {'id': obj.landlord_id, 'user': obj.landlord_name}
+
+    def get_distance(self, obj):
+        """Distance in km from the point searched around, if any"""
+        distance = getattr(obj, 'distance', None)
+        return round(distance, 3) if distance is not None else None
+
+    def get_primary_image(self, obj):
+        if not obj.primary_image:
+            return None
+        request = self.context.get('request')
+        build_absolute_uri = request.build_absolute_uri if request else None
+        storage = PropertyImages._meta.get_field('property_image').storage
+        url = storage.url(obj.primary_image)
+        return {
+            'url': build_absolute_uri(url) if build_absolute_uri else url,
+            'renditions': rendition_urls(storage, obj.primary_image_renditions, build_absolute_uri),
+        }
@@ -1,10 +1,14 @@
-from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import  receiver
 
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
-from renting.models import Landlord, Manager, UserLocation
+from renting.models import (
+    Landlord, Manager, UserLocation, Province, District, Sector, Cell, PropertyType, Property, PropertyImages
+)
+from renting import cache, images, listings, locations, search, storage
 
 # @receiver(post_save,sender=User)
 # def create_manager_or_landlord(sender,**kwargs):
@@ -16,3 +20,107 @@ from renting.models import Landlord, Manager, UserLocation
 #         elif user.is_landlord==True:
 #             Landlord.objects.create(user=user,gender="",phone_number="",profile_image="")
 #             UserLocation.objects.create(user=user,province=None,district=None,sector=None,cell=None)
+
+
+@receiver([post_save, post_delete], sender=Province)
+@receiver([post_save, post_delete], sender=District)
+@receiver([post_save, post_delete], sender=Sector)
+@receiver([post_save, post_delete], sender=Cell)
+def invalidate_location_tree(sender, **kwargs):
+    # once committed, a request rebuilding the tree before that would cache the old rows
+    transaction.on_commit(locations.invalidate)
+
+
+@receiver(post_save, sender=Property)
+def index_property(sender, instance, **kwargs):
+    search.index_properties([instance.pk])
+
+@receiver(post_delete, sender=Property)
+def unindex_property(sender, instance, **kwargs):
+    search.remove_properties([instance.pk])
+
+@receiver(post_save, sender=Province)
+@receiver(post_save, sender=District)
+@receiver(post_save, sender=Sector)
+@receiver(post_save, sender=Cell)
+def reindex_location_properties(sender, instance, created, **kwargs):
+    # a renamed location changes the indexed text of every property inside it
+    if not created:
+        field = sender._meta.model_name
+        search.index_properties(Property.objects.filter(**{field: instance}).values_list('id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Property)
+def refresh_listing(sender, instance, **kwargs):
+    listings.schedule_refresh([instance.pk])
+
+@receiver([post_save, post_delete], sender=PropertyImages)
+def refresh_image_listing(sender, instance, **kwargs):
+    listings.schedule_refresh([instance.property_id])
+
+@receiver(post_save, sender=PropertyType)
+@receiver(post_save, sender=Province)
+@receiver(post_save, sender=District)
+@receiver(post_save, sender=Sector)
+@receiver(post_save, sender=Cell)
+def rename_listings(sender, instance, created, **kwargs):
+    if not created:
+        field = 'property_type' if sender is PropertyType else sender._meta.model_name
+        listings.rename(field, instance.pk, str(instance))
+
+@receiver(post_save, sender=Sector)
+@receiver(post_save, sender=Cell)
+def move_listings(sender, instance, created, **kwargs):
+    # properties without coordinates are placed at the centroid of their cell or sector
+    if not created:
+        field = sender._meta.model_name
+        listings.schedule_refresh(
+            Property.objects.filter(**{field: instance}, latitude__isnull=True).values_list('id', flat=True)
+        )
+
+@receiver(post_save, sender=User)
+def rename_landlord_listings(sender, instance, created, update_fields=None, **kwargs):
+    # logging in saves last_login only
+    if created or not instance.is_landlord or update_fields and set(update_fields) <= {'last_login'}:
+        return
+    landlord = Landlord.objects.filter(user=instance).values_list('pk', flat=True).first()
+    if landlord is not None:
+        listings.rename('landlord', landlord, listings.landlord_name(instance))
+        transaction.on_commit(cache.invalidate_search_results)
+
+
+@receiver([post_save, post_delete], sender=Property)
+@receiver([post_save, post_delete], sender=PropertyImages)
+@receiver([post_save, post_delete], sender=Landlord)
+@receiver([post_save, post_delete], sender=PropertyType)
+@receiver([post_save, post_delete], sender=Province)
+@receiver([post_save, post_delete], sender=District)
+@receiver([post_save, post_delete], sender=Sector)
+@receiver([post_save, post_delete], sender=Cell)
+def invalidate_search_results(sender, **kwargs):
+    # once committed, a search running before that would cache the old rows
+    transaction.on_commit(cache.invalidate_search_results)
+
+
+@receiver(post_init, sender=PropertyImages)
+@receiver(post_init, sender=Landlord)
+@receiver(post_init, sender=Manager)
+def remember_media_names(sender, instance, **kwargs):
+    instance._media_names = images.media_names(instance, images.IMAGE_FIELDS[sender])
+
+@receiver(post_save, sender=PropertyImages)
+@receiver(post_save, sender=Landlord)
+@receiver(post_save, sender=Manager)
+def update_image_files(sender, instance, **kwargs):
+    field_name = images.IMAGE_FIELDS[sender]
+    names = images.media_names(instance, field_name)
+    storage.update_references(instance._media_names, names)
+    instance._media_names = names
+    if images.needs_processing(instance, field_name):
+        images.schedule(sender, instance.pk, field_name)
+
+@receiver(post_delete, sender=PropertyImages)
+@receiver(post_delete, sender=Landlord)
+@receiver(post_delete, sender=Manager)
+def release_image_files(sender, instance, **kwargs):
+    storage.release(instance._media_names)
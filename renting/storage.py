@@ -0,0 +1,93 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import MediaFile
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Stores files under the SHA-256 of their content, next to the directory they were
+    uploaded to, so identical uploads share a single file.
+
+    Files are shared between rows, so they are deleted through release() once nothing
+    references them anymore rather than by calling delete() directly. save() locks the
+    reference count row of the file, creating it if needed, like delete_unreferenced()
+    does: a file found in the storage can't be deleted before the transaction of the
+    caller counts its reference, so callers store and retain() in one transaction.
+    """
+    def content_name(self, name, content):
+        checksum = hashlib.sha256()
+        for chunk in content.chunks():
+            checksum.update(chunk)
+        content.seek(0)
+        digest = checksum.hexdigest()
+        directory, filename = os.path.split(name)
+        return os.path.join(directory, digest[:2], digest + os.path.splitext(filename)[1].lower())
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        with transaction.atomic():
+            MediaFile.objects.select_for_update().get_or_create(name=name, defaults={'references': 0})
+            if self.exists(name):
+                return name
+            return super().save(name, content, max_length=max_length)
+
+
+def retain(names):
+    """Count one more reference to each stored file name"""
+    for name in names:
+        with transaction.atomic():
+            # locked so a release of the same file waits for this one
+            if MediaFile.objects.select_for_update().filter(name=name).exists():
+                MediaFile.objects.filter(name=name).update(references=F('references') + 1)
+                continue
+            try:
+                with transaction.atomic():
+                    MediaFile.objects.create(name=name, references=1)
+            except IntegrityError:
+                MediaFile.objects.filter(name=name).update(references=F('references') + 1)
+
+
+def release(names, storage=default_storage):
+    """Count one reference less to each stored file name, deleting the files nobody uses"""
+    for name in names:
+        with transaction.atomic():
+            media_file = MediaFile.objects.select_for_update().filter(name=name).first()
+            if media_file is None:
+                continue
+            if media_file.references > 1:
+                MediaFile.objects.filter(pk=media_file.pk).update(references=F('references') - 1)
+            else:
+                media_file.delete()
+                transaction.on_commit(lambda name=name: delete_unreferenced(name, storage))
+
+
+def delete_unreferenced(name, storage=default_storage):
+    with transaction.atomic():
+        # the same content may have been stored and retained again since it was released,
+        # or be stored by a transaction that hasn't committed yet: the row it created
+        # makes this one wait for it, and a save() waits for this deletion to commit
+        media_file, created = MediaFile.objects.select_for_update().get_or_create(name=name, defaults={'references': 0})
+        if media_file.references > 0:
+            return
+        storage.delete(name)
+        media_file.delete()
+
+
+def discard(names, storage=default_storage):
+    """Delete files that were stored for nothing, unless something else references them"""
+    retain(names)
+    release(names, storage)
+
+
+def update_references(old_names, new_names, storage=default_storage):
+    retain(new_names - old_names)
+    release(old_names - new_names, storage)
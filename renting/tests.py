@@ -1,3 +1,1028 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import OperationalError, connection
+from django.http import QueryDict
+from asgiref.sync import async_to_sync
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from PIL import Image
+
+from backend import metrics, profiling, replicas
+from backend.db import pooled, stats as db_stats
+from users.authentication import REFRESH, encode_token
+from . import async_views, benchmarks, bulk, images, listings, locations, uploads
+from . import cache as cache_versions
+from .models import (
+    Province, District, Sector, Cell, UserLocation, Landlord, PropertyType, Property,
+    PropertyImages, PropertyImageUpload, MediaFile, PublishingPayment, GetInTouch, Testimonial, SearchListing,
+)
+from .pagination import KeysetPagination
+from .serializers import RentalSearchSerializer
+
+User = get_user_model()
+
+
+def create_rentals(count, prefix='', province=None, property_type=None):
+    """Create ``count`` landlords, each with a location, property, image and payment
+    in a district, sector and cell of their own"""
+    province = province or Province.objects.create(province_name=f'{prefix}Province')
+    property_type = property_type or PropertyType.objects.create(type_name=f'{prefix}Apartment')
+    for number in range(count):
+        name = f'{prefix}{number}'
+        district = District.objects.create(province=province, district_name=f'District {name}')
+        sector = Sector.objects.create(district=district, sector_name=f'Sector {name}')
+        cell = Cell.objects.create(sector=sector, cell_name=f'Cell {name}')
+        user = User.objects.create_user('Land', f'Lord {name}', f'landlord{name}@example.com', 'password', is_landlord=True)
+        UserLocation.objects.filter(user=user).update(province=province, district=district, sector=sector, cell=cell)
+        property_obj = create_property(user.landlord_profile, property_type, cell, f'House {name}')
+        PropertyImages.objects.create(property=property_obj, property_image=f'properties/{name}.jpg')
+        PublishingPayment.objects.create(property=property_obj, landlord=user.landlord_profile, payment_amount=10, payment_method='cash')
+        GetInTouch.objects.create(first_name='Tenant', last_name=name, email='tenant@example.com', subject='Visit', message='Hello')
+
+
+def authenticate(client, user):
+    """Send an access token of ``user`` with the requests of a test client"""
+    client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {encode_token(user)}'
+
+
+def create_property(landlord, property_type, cell, title):
+    sector = cell.sector
+    return Property.objects.create(
+        landlord=landlord, property_type=property_type, title=title, description='A house', bedrooms=2,
+        bathrooms=1, plot_size='100', renting_price=100, province=sector.district.province,
+        district=sector.district, sector=sector, cell=cell, street='KG 1 Ave',
+    )
+
+
+# the admin pages link to static files that aren't collected in tests
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AdminQueryCountTests(TestCase):
+    """Admin pages run the same number of queries however many rows they show"""
+    # query budgets of the changelists and of the change pages
+    CHANGELISTS = {
+        'userlocation': 7,
+        'manager': 5,
+        'landlord': 5,
+        'propertytype': 5,
+        'property': 10,
+        'propertyimages': 5,
+        'publishingpayment': 5,
+        'getintouch': 5,
+        'province': 5,
+        'district': 6,
+        'sector': 6,
+        'cell': 6,
+    }
+    CHANGE_PAGES = {
+        'landlord': 10,
+        'propertytype': 8,
+        'property': 16,
+        'province': 8,
+        'district': 9,
+        'sector': 9,
+        'publishingpayment': 12,
+        'userlocation': 12,
+    }
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('Admin', 'User', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def measure(self, property_obj):
+        counts = {}
+        for name in self.CHANGELISTS:
+            counts[name, 'changelist'] = self.count_queries(reverse(f'admin:renting_{name}_changelist'))
+        objects = {
+            'landlord': property_obj.landlord,
+            'propertytype': property_obj.property_type,
+            'property': property_obj,
+            'province': property_obj.province,
+            'district': property_obj.district,
+            'sector': property_obj.sector,
+            'publishingpayment': property_obj.payments.first(),
+            'userlocation': UserLocation.objects.get(user=property_obj.landlord.user),
+        }
+        for name, obj in objects.items():
+            counts[name, 'change'] = self.count_queries(reverse(f'admin:renting_{name}_change', args=[obj.pk]))
+        return counts
+
+    def test_query_counts(self):
+        create_rentals(2)
+        property_obj = Property.objects.first()
+        small = self.measure(property_obj)
+
+        # more rows in every list and more children under the objects of the change pages
+        create_rentals(30, 'More ', property_obj.province, property_obj.property_type)
+        for number in range(30):
+            Sector.objects.create(district=property_obj.district, sector_name=f'Extra sector {number}')
+            cell = Cell.objects.create(sector=property_obj.sector, cell_name=f'Extra cell {number}')
+            create_property(property_obj.landlord, property_obj.property_type, cell, f'Extra house {number}')
+            PropertyImages.objects.create(property=property_obj, property_image=f'properties/extra{number}.jpg')
+        large = self.measure(property_obj)
+
+        for (name, page), count in large.items():
+            budget = (self.CHANGELISTS if page == 'changelist' else self.CHANGE_PAGES)[name]
+            with self.subTest(f'{name} {page}'):
+                self.assertLessEqual(small[name, page], budget)
+                self.assertLessEqual(count, budget)
+
+
+# the query budget of every API route, by URL prefix and then by method and route name.
+# Rewrite it from the counts of a run with UPDATE_QUERY_BUDGETS=1 python manage.py test
+QUERY_BUDGETS = Path(settings.BASE_DIR) / 'query_budgets.json'
+
+
+def api_routes(prefix):
+    """The name, URL arguments and requested method of every named route included under
+    ``prefix``, leaving out the format suffix variants. Routes are requested with GET
+    when they answer it, else with POST."""
+    routes = []
+
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns)
+            elif pattern.name and 'format' not in pattern.pattern.regex.groupindex:
+                view = pattern.callback
+                methods = getattr(view, 'actions', None) or [name for name in ('get', 'post') if hasattr(view.view_class, name)]
+                routes.append((pattern.name, list(pattern.pattern.regex.groupindex), 'get' if 'get' in methods else 'post'))
+
+    walk(next(pattern for pattern in get_resolver().url_patterns if str(pattern.pattern) == prefix).url_patterns)
+    return routes
+
+
+class EndpointQueryCountMixin:
+    """Request every API route under ``prefix`` with few and with many rows around the
+    requested objects, the number of queries mustn't grow and must stay within the
+    route's budget in QUERY_BUDGETS"""
+    prefix = None
+    # routes that can't be requested, with the reason
+    skipped_routes = {}
+
+    def setUp(self):
+        cache.clear()
+        create_rentals(1, 'Target')
+        self.property = Property.objects.get()
+        self.landlord = self.property.landlord
+        self.user = self.landlord.user
+        self.image = self.property.images.get()
+        self.manager = User.objects.create_user('Man', 'Ager', 'manager@example.com', 'password', is_manager=True)
+        # activated and has their password reset by the requests
+        self.other = User.objects.create_user('Other', 'User', 'other@example.com', 'password', is_active=False)
+        self.upload = PropertyImageUpload.objects.create(property=self.property, filename='a.jpg', size=10, checksum='0' * 64)
+        self.testimonial = Testimonial.objects.create(full_name='Tenant', rating=5, message='Great')
+
+    def grow(self, count, prefix):
+        """Add ``count`` rows to every list the routes show"""
+        create_rentals(count, prefix, self.property.province, self.property.property_type)
+        for number in range(count):
+            Sector.objects.create(district=self.property.district, sector_name=f'{prefix} extra sector {number}')
+            cell = Cell.objects.create(sector=self.property.sector, cell_name=f'{prefix} extra cell {number}')
+            property_obj = create_property(self.landlord, self.property.property_type, cell, f'{prefix} extra house {number}')
+            PropertyImages.objects.create(property=property_obj, property_image=f'properties/{prefix}-{number}.jpg')
+            PropertyImages.objects.create(property=self.property, property_image=f'properties/{prefix}-extra{number}.jpg')
+            Testimonial.objects.create(full_name=f'{prefix} {number}', rating=4, message='Nice')
+
+    def url_kwargs(self, name, kwarg_names):
+        basename = name.split('-')[0]
+        # the tokens change once the password is reset
+        self.other.refresh_from_db()
+        user = {'manager': self.manager, 'user': self.user}.get(basename, self.user)
+        pks = {
+            'publishing_payment': PublishingPayment.objects.filter(property=self.property).first(),
+            'messages': GetInTouch.objects.order_by('pk').first(),
+            'testimonial': self.testimonial,
+            'district': self.property.district,
+            'sector': self.property.sector,
+            'cell': self.property.cell,
+            'user': self.user,
+            'location': UserLocation.objects.filter(user=self.user).first(),
+            'manager': getattr(self.manager, 'manager_profile', None),
+            'landlord': self.landlord,
+            'property': self.property,
+            'image': self.image,
+        }
+        values = {
+            'pk': getattr(pks.get(basename), 'pk', None),
+            'user_pk': user.pk,
+            'landlord_pk': self.landlord.pk,
+            'property_pk': self.property.pk,
+            'district_pk': self.property.district_id,
+            'sector_pk': self.property.sector_id,
+            'upload_pk': self.upload.pk,
+            'uidb64': urlsafe_base64_encode(force_bytes(self.other.pk)),
+            'token': default_token_generator.make_token(self.other),
+        }
+        return {name: values[name] for name in kwarg_names}
+
+    def post_data(self, name, size):
+        """The request body and content type of the routes requested with POST"""
+        data = {
+            'publishing_payment-list': {'payment_amount': 10, 'payment_method': 'cash'},
+            'messages-list': {'first_name': 'Tenant', 'last_name': 'User', 'email': 'tenant@example.com', 'subject': 'Visit', 'message': 'Hello'},
+            'image-start-upload': {'filename': 'b.jpg', 'size': 10, 'checksum': '0' * 64},
+            'user-register': {
+                'first_name': 'New', 'last_name': 'User', 'email': f'new{size}@example.com',
+                'password': 'password', 'password_confirmation': 'password',
+            },
+            'user-login': {'email': self.user.email, 'password': 'password'},
+            'token-refresh': {'refresh': encode_token(self.user, REFRESH)},
+            'password-reset': {'email': self.other.email},
+            'password-reset-confirm': {'new_password1': f'A new password {size}', 'new_password2': f'A new password {size}'},
+        }
+        if name == 'property-import-properties':
+            row = {
+                'property_type': self.property.property_type.type_name, 'title': 'Imported', 'description': 'A house',
+                'bedrooms': 1, 'bathrooms': 1, 'plot_size': '100', 'renting_price': 100, 'street': 'KG 2 Ave',
+                'province': self.property.province.province_name, 'district': self.property.district.district_name,
+                'sector': self.property.sector.sector_name, 'cell': self.property.cell.cell_name,
+            }
+            return json.dumps(row) + '\n', 'application/x-ndjson'
+        return json.dumps(data.get(name, {})), 'application/json'
+
+    def count_queries(self, route, size):
+        name, kwarg_names, method = route
+        url = '/' + self.prefix if name == 'api-root' else reverse(name, kwargs=self.url_kwargs(name, kwarg_names))
+        if name == 'property-import-properties':
+            url += '?dry_run=true'
+        authenticate(self.client, self.user)
+        with CaptureQueriesContext(connection) as queries:
+            if method == 'get':
+                response = self.client.get(url, HTTP_ACCEPT='application/json')
+            else:
+                body, content_type = self.post_data(name, size)
+                response = self.client.post(url, body, content_type=content_type, HTTP_ACCEPT='application/json')
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+        if response.status_code >= 400:
+            self.fail(f'{method.upper()} {url} answered {response.status_code}: {content[:200]}')
+        return len(queries)
+
+    def test_query_budgets(self):
+        routes = [route for route in api_routes(self.prefix) if route[0] not in self.skipped_routes]
+        counts = []
+        for count, prefix in ((1, 'Small'), (20, 'Large')):
+            self.grow(count, prefix)
+            counts.append({f'{route[2].upper()} {route[0]}': self.count_queries(route, count) for route in routes})
+        small, large = counts
+
+        budgets = json.loads(QUERY_BUDGETS.read_text()) if QUERY_BUDGETS.exists() else {}
+        if os.environ.get('UPDATE_QUERY_BUDGETS'):
+            budgets[self.prefix] = {key: max(small[key], large[key]) for key in sorted(small)}
+            QUERY_BUDGETS.write_text(json.dumps(budgets, indent=2, sort_keys=True) + '\n')
+        budgets = budgets.get(self.prefix, {})
+
+        self.assertEqual(sorted(budgets), sorted(small), f'The routes under {self.prefix} and their budgets in {QUERY_BUDGETS.name} differ')
+        for key, budget in budgets.items():
+            with self.subTest(key):
+                self.assertLessEqual(large[key], small[key], f'{key} runs more queries with more rows')
+                self.assertLessEqual(large[key], budget, f'{key} runs more queries than its budget')
+                self.assertLessEqual(small[key], budget, f'{key} runs more queries than its budget')
+
+
+class RentalEndpointQueryCountTests(EndpointQueryCountMixin, TestCase):
+    prefix = 'api/rental/'
+    skipped_routes = {
+        'publishing_payment-list': "its serializer can't set the property and landlord a payment needs",
+    }
+
+
+class RentalSearchTests(TestCase):
+    """The rental search pages through its results and counts them per facet"""
+    def setUp(self):
+        cache.clear()
+        # every property has the same price
+        create_rentals(5)
+        listings.rebuild()
+        self.url = reverse('search_rental-search')
+
+    def pages(self, url):
+        """The property ids of every page, following the next links"""
+        pages = []
+        while url:
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 200, response.content)
+            pages.append([result['id'] for result in response.json()['results']])
+            url = response.json()['next']
+        return pages
+
+    def test_ties(self):
+        ids = list(Property.objects.order_by('pk').values_list('pk', flat=True))
+        pages = self.pages(f'{self.url}?ordering=renting_price&page_size=2')
+        self.assertEqual(pages, [ids[:2], ids[2:4], ids[4:]])
+        pages = self.pages(f'{self.url}?ordering=-renting_price&page_size=2')
+        self.assertEqual(sum(pages, []), ids[::-1])
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_cached_from_default(self):
+        # the replica is the default database under another name
+        with mock.patch('backend.replicas.random.choice', return_value='default') as choice:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+            choice.assert_not_called()
+            authenticate(self.client, User.objects.first())
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+            choice.assert_called()
+
+    def locate(self, count):
+        """Give the first ``count`` properties coordinates around Kigali, the others have none"""
+        for number, property_obj in enumerate(Property.objects.order_by('pk')[:count]):
+            Property.objects.filter(pk=property_obj.pk).update(latitude=-1.95 + number / 100, longitude=30.06)
+        listings.rebuild()
+        return list(Property.objects.filter(latitude__isnull=False).order_by('pk').values_list('pk', flat=True))
+
+    def test_nearby(self):
+        located = self.locate(3)
+        # without a radius too the unlocated listings are left out
+        for params in ('', '&radius=50'):
+            pages = self.pages(f'{self.url}?latitude=-1.95&longitude=30.06&page_size=2{params}')
+            self.assertEqual(pages, [located[:2], located[2:]])
+        self.assertEqual(self.pages(f'{self.url}?latitude=-1.95&longitude=30.06&radius=1'), [located[:1]])
+
+    def test_null_ordering(self):
+        located = self.locate(3)
+        unlocated = list(Property.objects.filter(latitude__isnull=True).order_by('pk').values_list('pk', flat=True))
+        queryset = SearchListing.objects.order_by('-latitude', '-pk')
+        request = Request(APIRequestFactory().get('/?page_size=2'))
+        pages, previous = [], None
+        while request is not None:
+            paginator = KeysetPagination()
+            pages.append([listing.pk for listing in paginator.paginate_queryset(queryset, request)])
+            link, previous = paginator.get_next_link(), paginator.get_previous_link()
+            request = link and Request(APIRequestFactory().get(link))
+        # the null values come last, by the primary key
+        self.assertEqual(sum(pages, []), located[::-1] + unlocated[::-1])
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(queryset, Request(APIRequestFactory().get(previous)))
+        self.assertEqual([listing.pk for listing in page], pages[-2])
+
+    def test_facets(self):
+        Property.objects.filter(pk=Property.objects.first().pk).update(bedrooms=3)
+        listings.rebuild()
+        response = self.client.get(f'{self.url}?facets=true&min_bedrooms=3', HTTP_ACCEPT='application/json')
+        data = response.json()
+        self.assertEqual(len(data['results']), 1)
+        # each facet ignores its own filters
+        self.assertEqual(data['facets']['bedrooms'], [{'value': 2, 'count': 4}, {'value': 3, 'count': 1}])
+        self.assertEqual(len(data['facets']['district']), 1)
+        self.assertEqual(data['facets']['price_band'][0]['count'], 1)
+
+    def test_multiple_values(self):
+        serializer = RentalSearchSerializer(data=QueryDict('district=1,2&district=3&cell=4'))
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual((serializer.validated_data['district'], serializer.validated_data['cell']), ([1, 2, 3], [4]))
+        self.assertEqual(serializer.data['district'], [1, 2, 3])
+        self.assertFalse(RentalSearchSerializer(data={'sector': '1,x'}).is_valid())
+
+    def test_text_search(self):
+        ids = list(Property.objects.order_by('pk').values_list('pk', flat=True))
+        for pk, field in ((ids[1], 'description'), (ids[3], 'title')):
+            property_obj = Property.objects.get(pk=pk)
+            setattr(property_obj, field, 'Garden view')
+            property_obj.save()
+        listings.rebuild()
+        # every word has to match
+        self.assertEqual(self.pages(f'{self.url}?q=house+2'), [[ids[2]]])
+        # a title match ranks above a description match
+        self.assertEqual(self.pages(f'{self.url}?q=gardens&ordering=relevance'), [[ids[3], ids[1]]])
+        self.assertEqual(self.pages(f'{self.url}?q=the+garden!&ordering=relevance'), [[ids[3], ids[1]]])
+        # stopwords and punctuation alone don't filter
+        self.assertEqual(sum(self.pages(f'{self.url}?q=the+of+%3F&ordering=relevance'), []), ids[::-1])
+
+    def test_cached_get_and_post(self):
+        # the last result of the default ordering
+        Property.objects.filter(pk=Property.objects.first().pk).update(renting_price=200)
+        listings.rebuild()
+        ids = list(Property.objects.filter(renting_price=100).order_by('-created_date', '-pk').values_list('pk', flat=True))
+        # an anonymous POST search is cached with a next link that doesn't repeat its filters
+        response = self.client.post(
+            f'{self.url}?page_size=2', {'max_price': 100, 'is_furnished': False}, content_type='application/json', HTTP_ACCEPT='application/json',
+        )
+        self.assertEqual([result['id'] for result in response.json()['results']], ids[:2])
+        self.assertNotIn('max_price', response.json()['next'])
+        # the same GET search isn't answered from it and its links keep the filters
+        self.assertEqual(sum(self.pages(f'{self.url}?page_size=2&max_price=100'), []), ids)
+
+    def test_invalidated_on_commit(self):
+        district = District.objects.first()
+        version = cache_versions.get_version(cache_versions.SEARCH_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            district.district_name = 'Renamed'
+            district.save()
+            # searches of other connections still see the old name until the commit
+            self.assertEqual(cache_versions.get_version(cache_versions.SEARCH_VERSION_KEY), version)
+        self.assertGreater(cache_versions.get_version(cache_versions.SEARCH_VERSION_KEY), version)
+
+
+class SearchListingTests(TestCase):
+    """The search listings follow their property, its images and the names they copy"""
+    def setUp(self):
+        # there are no image files to make renditions of
+        patcher = mock.patch.object(images, 'schedule')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_rentals(2)
+        self.property = Property.objects.order_by('pk').first()
+
+    def listing(self):
+        return SearchListing.objects.get(pk=self.property.pk)
+
+    def test_property(self):
+        self.assertEqual(SearchListing.objects.count(), 2)
+        self.assertEqual((self.listing().title, self.listing().cell_name), ('House 0', 'Cell 0'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.property.title = 'Renovated'
+            self.property.renting_price = 250
+            self.property.save()
+            # rewritten once the transaction commits
+            self.assertEqual(self.listing().title, 'House 0')
+        self.assertEqual((self.listing().title, self.listing().renting_price), ('Renovated', 250))
+        with self.captureOnCommitCallbacks(execute=True):
+            PublishingPayment.objects.filter(property=self.property).delete()
+            self.property.delete()
+        self.assertFalse(SearchListing.objects.filter(pk=self.property.pk).exists())
+        self.assertEqual(SearchListing.objects.count(), 1)
+
+    def test_images(self):
+        first = self.property.images.get()
+        self.assertEqual((self.listing().primary_image, self.listing().image_count), ('properties/0.jpg', 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            PropertyImages.objects.create(property=self.property, property_image='properties/0b.jpg')
+        self.assertEqual((self.listing().primary_image, self.listing().image_count), ('properties/0.jpg', 2))
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual((self.listing().primary_image, self.listing().image_count), ('properties/0b.jpg', 1))
+
+    def test_renamed(self):
+        cell, property_type, user = self.property.cell, self.property.property_type, self.property.landlord.user
+        cell.cell_name = 'Renamed cell'
+        cell.save()
+        property_type.type_name = 'Bungalow'
+        property_type.save()
+        user.first_name = 'Renamed'
+        user.save()
+        # copied right away, to every listing of the type
+        listing = self.listing()
+        self.assertEqual(
+            (listing.cell_name, listing.property_type_name, listing.landlord_name), ('Renamed cell', 'Bungalow', 'Renamed Lord 0'),
+        )
+        self.assertEqual(SearchListing.objects.filter(property_type_name='Bungalow').count(), 2)
+        self.assertEqual(SearchListing.objects.exclude(pk=self.property.pk).get().cell_name, 'Cell 1')
+
+
+# the replica is the default database under another name
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaTests(TestCase):
+    """Replica views read from a replica until the client writes, then from the default database"""
+    def setUp(self):
+        cache.clear()
+        create_rentals(1)
+        self.url = reverse('testimonial-list')
+        patcher = mock.patch('backend.replicas.random.choice', return_value='default')
+        self.choice = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read_replica(self):
+        """Whether a GET of the replica view read from a replica"""
+        self.choice.reset_mock()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        return self.choice.called
+
+    def write(self, **data):
+        data = {'first_name': 'Tenant', 'last_name': 'One', 'email': 'tenant@example.com', 'subject': 'Visit', 'message': 'Hello', **data}
+        return self.client.post(reverse('messages-list'), data)
+
+    def test_router(self):
+        router = replicas.ReplicaRouter()
+        self.assertEqual(router.db_for_read(Property), 'default')
+        with replicas.replica_reads():
+            router.db_for_read(Property)
+            self.choice.assert_called_once_with(['replica'])
+            self.assertEqual(router.db_for_write(Property), 'default')
+        with override_settings(DATABASE_REPLICAS=[]), replicas.replica_reads():
+            self.assertEqual(router.db_for_read(Property), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'renting'))
+
+    def test_pinned_by_cookie(self):
+        self.assertTrue(self.read_replica())
+        # a failed write changed nothing
+        self.assertEqual(self.write(email='not an email').status_code, 400)
+        self.assertTrue(self.read_replica())
+        # nor does a search, though it is posted
+        self.client.post(reverse('search_rental-search'), {}, content_type='application/json')
+        self.assertNotIn(replicas.PIN_COOKIE, self.client.cookies)
+        self.assertEqual(self.write().status_code, 201)
+        self.assertEqual(self.client.cookies[replicas.PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+        self.assertFalse(self.read_replica())
+
+    def test_pinned_by_user(self):
+        user = User.objects.get()
+        authenticate(self.client, user)
+        self.assertEqual(self.write().status_code, 201)
+        # on another device, without the cookie
+        self.client.cookies.clear()
+        self.assertFalse(self.read_replica())
+        cache.delete(replicas.PIN_CACHE_KEY.format(pk=user.pk))
+        self.assertTrue(self.read_replica())
+
+    def test_no_replicas(self):
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.write().status_code, 201)
+        self.assertNotIn(replicas.PIN_COOKIE, self.client.cookies)
+
+
+class LocationTreeTests(TestCase):
+    """The location hierarchy is served from the cache with an ETag until a location changes"""
+    def setUp(self):
+        cache.clear()
+        locations._local_cache.clear()
+        create_rentals(2)
+        self.url = reverse('location_tree-list')
+
+    def get(self, url, etag=None):
+        if etag is None:
+            return self.client.get(url)
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_etag(self):
+        response = self.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        districts = response.json()[0]['districts']
+        self.assertEqual([district['district_name'] for district in districts], ['District 0', 'District 1'])
+        self.assertEqual(districts[0]['sectors'][0]['cells'][0]['cell_name'], 'Cell 0')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.get(self.url, etag)
+        self.assertEqual(response.status_code, 304)
+        # another process finds the rendered tree in the shared cache
+        locations._local_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(self.url, etag).status_code, 304)
+        # the district list has an ETag of its own
+        response = self.get(reverse('district-list'))
+        self.assertEqual(response.json(), districts)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.get(reverse('district-list'), response['ETag']).status_code, 304)
+
+    def test_invalidated_on_commit(self):
+        etag = self.get(self.url)['ETag']
+        cell = Cell.objects.get(cell_name='Cell 1')
+        with self.captureOnCommitCallbacks(execute=True):
+            cell.cell_name = 'Renamed'
+            cell.save()
+            # the tree isn't rebuilt from the rows of an uncommitted transaction
+            self.assertEqual(self.get(self.url, etag).status_code, 304)
+        response = self.get(self.url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['districts'][1]['sectors'][0]['cells'][0]['cell_name'], 'Renamed')
+        # added and deleted locations too
+        with self.captureOnCommitCallbacks(execute=True):
+            district = District.objects.create(province=Province.objects.get(), district_name='District 2')
+        districts = self.get(self.url, response['ETag']).json()[0]['districts']
+        self.assertEqual([district['district_name'] for district in districts], ['District 0', 'District 1', 'District 2'])
+        with self.captureOnCommitCallbacks(execute=True):
+            district.delete()
+        # rebuilt as it was before the district was added
+        self.assertEqual(self.get(self.url, response['ETag']).status_code, 304)
+
+
+class AsyncViewTests(TestCase):
+    """The async views answer like the viewsets they stand in for"""
+    def setUp(self):
+        create_rentals(3)
+        listings.rebuild()
+        Testimonial.objects.create(full_name='Tenant', rating=5, message='Great')
+        self.district = District.objects.order_by('pk').first()
+        self.sector = self.district.sectors.get()
+
+    def compare(self, view, url, method='get', data=None, **kwargs):
+        """Request ``url`` from its viewset and from ``view``, returns the two responses"""
+        cache.clear()
+        sync = getattr(self.client, method)(url, data, content_type='application/json', HTTP_ACCEPT='application/json')
+        cache.clear()
+        request = getattr(AsyncRequestFactory(), method)(url, data, content_type='application/json')
+        response = async_to_sync(view)(request, **kwargs)
+        self.assertEqual(response.status_code, sync.status_code, url)
+        self.assertEqual(json.loads(response.content), sync.json(), url)
+        return sync, response
+
+    def test_search(self):
+        url = reverse('search_rental-search')
+        sync, response = self.compare(async_views.search, f'{url}?page_size=2&ordering=renting_price&facets=true')
+        self.assertEqual(len(sync.json()['results']), 2)
+        self.assertEqual(response['Cache-Control'], sync['Cache-Control'])
+        self.compare(async_views.search, f'{url}?page_size=2', method='post', data={'min_bedrooms': 2, 'q': 'house'})
+        # the next page, and errors
+        self.compare(async_views.search, sync.json()['next'])
+        self.compare(async_views.search, f'{url}?min_price=cheap')
+        self.compare(async_views.search, url, method='delete')
+
+    def test_locations(self):
+        for view, name in ((async_views.location_tree, 'location_tree-list'), (async_views.district_list, 'district-list')):
+            sync, response = self.compare(view, reverse(name))
+            self.assertEqual(response['ETag'], sync['ETag'])
+        kwargs = {'district_pk': str(self.district.pk)}
+        self.compare(async_views.sector_list, reverse('sector-list', kwargs=kwargs), **kwargs)
+        kwargs['sector_pk'] = str(self.sector.pk)
+        self.compare(async_views.cell_list, reverse('cell-list', kwargs=kwargs), **kwargs)
+
+    def test_testimonials(self):
+        sync, response = self.compare(async_views.testimonials, reverse('testimonial-list'))
+        self.assertEqual([testimonial['full_name'] for testimonial in sync.json()], ['Tenant'])
+
+
+class ExportTests(TestCase):
+    """Exports stream under WSGI and ASGI alike"""
+    def setUp(self):
+        create_rentals(3)
+        self.queryset = Property.objects.order_by('id')
+
+    def test_streamed(self):
+        response = bulk.export_response(RequestFactory().get('/'), self.queryset, bulk.PROPERTY_COLUMNS, 'properties')
+        self.assertFalse(response.is_async)
+        wsgi_content = b''.join(response.streaming_content)
+
+        # ASGI reads a sync iterator whole before sending it
+        response = bulk.export_response(AsyncRequestFactory().get('/'), self.queryset, bulk.PROPERTY_COLUMNS, 'properties')
+        self.assertTrue(response.is_async)
+
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(async_to_sync(read)(), wsgi_content)
+        self.assertEqual(len(wsgi_content.decode().splitlines()), 4)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="properties.csv"')
+
+
+class BulkImportTests(TestCase):
+    """Landlords import properties from CSV, locations given by name, bad rows reported"""
+    HEADER = 'property_type,title,description,bedrooms,bathrooms,plot_size,renting_price,province,district,sector,cell,street\n'
+
+    def setUp(self):
+        create_rentals(2)
+        self.landlord = Landlord.objects.order_by('pk').first()
+        self.url = reverse('property-import-properties', kwargs={'user_pk': self.landlord.user_id, 'landlord_pk': self.landlord.pk})
+        authenticate(self.client, self.landlord.user)
+
+    def post(self, rows, **params):
+        url = f'{self.url}?dry_run=true' if params.get('dry_run') else self.url
+        return self.client.post(url, self.HEADER + ''.join(rows), content_type='text/csv')
+
+    def test_import(self):
+        count = Property.objects.count()
+        response = self.post([
+            'apartment,New house,Nice,3,2,200,150,province,District 0,Sector 0,Cell 0,KG 2 Ave\n',
+            # a cell of another sector
+            'Apartment,Misplaced,Nice,3,2,200,150,Province,District 0,Sector 0,Cell 1,KG 2 Ave\n',
+            'Villa,Unknown type,Nice,three,2,200,150,Province,District 0,Sector 0,Cell 0,KG 2 Ave\n',
+        ])
+        self.assertEqual(response.status_code, 200, response.content)
+        report = response.json()
+        self.assertEqual({name: report[name] for name in ('rows', 'valid', 'created', 'error_count')},
+                         {'rows': 3, 'valid': 1, 'created': 1, 'error_count': 2})
+        self.assertEqual(report['errors'][0], {'row': 2, 'errors': {'cell': ['Cell 1 is not in the given sector.']}})
+        self.assertEqual(set(report['errors'][1]['errors']), {'bedrooms'})
+        self.assertEqual(Property.objects.count(), count + 1)
+        # the names were resolved case insensitively
+        created = Property.objects.get(title='New house')
+        self.assertEqual(created.landlord, self.landlord)
+        self.assertEqual((created.property_type.type_name, created.cell.cell_name), ('Apartment', 'Cell 0'))
+
+    def test_dry_run(self):
+        count = Property.objects.count()
+        response = self.post(['Apartment,New house,Nice,3,2,200,150,Province,District 0,Sector 0,Cell 0,KG 2 Ave\n'], dry_run=True)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual((response.json()['valid'], response.json()['created']), (1, 0))
+        self.assertEqual(Property.objects.count(), count)
+        # every row rejected
+        response = self.post(['Villa,New house,Nice,3,2,200,150,Province,District 0,Sector 0,Cell 0,KG 2 Ave\n'])
+        self.assertEqual(response.status_code, 400)
+
+    def test_permissions(self):
+        row = 'Apartment,New house,Nice,3,2,200,150,Province,District 0,Sector 0,Cell 0,KG 2 Ave\n'
+        export = reverse('property-export', kwargs={'user_pk': self.landlord.user_id, 'landlord_pk': self.landlord.pk})
+        other = Landlord.objects.exclude(pk=self.landlord.pk).get()
+        authenticate(self.client, other.user)
+        self.assertEqual(self.post([row]).status_code, 403)
+        self.assertEqual(self.client.get(export).status_code, 403)
+        del self.client.defaults['HTTP_AUTHORIZATION']
+        self.assertEqual(self.post([row]).status_code, 401)
+        self.assertEqual(self.client.get(export).status_code, 401)
+        other.user.is_staff = True
+        other.user.save()
+        authenticate(self.client, other.user)
+        self.assertEqual(self.client.get(export).status_code, 200)
+        self.assertEqual(Property.objects.filter(title='New house').count(), 0)
+
+def jpeg(color, size=(40, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@override_settings(IMAGE_PROCESSING_WORKERS=0, IMAGE_RENDITION_WIDTHS=[20])
+class MediaTests(TestCase):
+    """Images are uploaded in chunks, stored by content and deleted with their last reference"""
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media_root = override_settings(MEDIA_ROOT=directory.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.media_root = Path(directory.name)
+        chunks = override_settings(CHUNKED_UPLOAD_STORAGE={
+            'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': str(self.media_root / 'chunks')},
+        })
+        chunks.enable()
+        self.addCleanup(chunks.disable)
+        create_rentals(1)
+        self.property = Property.objects.get()
+
+    def stored_files(self, directory=''):
+        return sorted(str(path.relative_to(self.media_root)) for path in (self.media_root / directory).rglob('*') if path.is_file())
+
+    def test_replaced_while_processing(self):
+        # uploaded, its renditions not written yet
+        image = PropertyImages.objects.create(property=self.property, property_image=ContentFile(jpeg('red'), 'a.jpg'))
+        placeholder = images.placeholder
+
+        def replace(picture):
+            # a new image is uploaded while the previous one is processed
+            PropertyImages.objects.filter(pk=image.pk).update(property_image='properties/new.jpg')
+            return placeholder(picture)
+
+        with mock.patch.object(images, 'placeholder', replace), self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(images.process(PropertyImages, image.pk, 'property_image'))
+        image.refresh_from_db()
+        self.assertEqual(image.property_image.name, 'properties/new.jpg')
+        self.assertEqual(image.renditions, {})
+        # the renditions of the previous image are gone
+        self.assertEqual(self.stored_files('properties/renditions'), [])
+
+    def test_released_while_stored_again(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = PropertyImages.objects.create(property=self.property, property_image=ContentFile(jpeg('red'), 'a.jpg'))
+        name = image.property_image.name
+        with self.captureOnCommitCallbacks() as callbacks:
+            PropertyImages.objects.get(pk=image.pk).delete()
+        # the same photo is uploaded again before the deleting transaction's callbacks run
+        again = PropertyImages.objects.create(property=self.property, property_image=ContentFile(jpeg('red'), 'b.jpg'))
+        self.assertEqual(again.property_image.name, name)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(MediaFile.objects.get(name=name).references, 1)
+        # its renditions had no other reference
+        self.assertEqual(self.stored_files('properties/renditions'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            again.delete()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(MediaFile.objects.exists())
+
+    def test_chunk_retried(self):
+        content = jpeg('blue')
+        half = len(content) // 2
+        kwargs = {'user_pk': self.property.landlord.user_id, 'landlord_pk': self.property.landlord_id, 'property_pk': self.property.pk}
+        authenticate(self.client, self.property.landlord.user)
+        response = self.client.post(
+            reverse('image-start-upload', kwargs=kwargs),
+            {'filename': 'b.jpg', 'size': len(content), 'checksum': hashlib.sha256(content).hexdigest()},
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        upload = PropertyImageUpload.objects.get(pk=response.json()['id'])
+        url = reverse('image-upload', kwargs={**kwargs, 'upload_pk': upload.pk})
+
+        def send(start, end):
+            return self.client.patch(
+                url, content[start:end], content_type='application/octet-stream',
+                HTTP_CONTENT_RANGE=f'bytes {start}-{end - 1}/{len(content)}',
+            )
+
+        self.assertEqual(send(0, half).json()['offset'], half)
+        # the retry of a chunk that did arrive is refused and nothing is added twice
+        response = send(0, half)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], half)
+        # a retry that read the offset before the first attempt stored the chunk
+        with mock.patch.object(uploads, 'get_offset', return_value=0), self.assertRaises(uploads.UploadError):
+            uploads.append_chunk(upload, io.BytesIO(content[:half]), 0)
+        upload.refresh_from_db()
+        self.assertEqual((upload.offset, len(upload.chunks)), (half, 1))
+        self.assertEqual(send(half, len(content)).json()['offset'], len(content))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('image-complete-uploads', kwargs=kwargs), {'uploads': [str(upload.pk)]}, content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 201, response.content)
+        image = PropertyImages.objects.get(pk=response.json()[0]['id'])
+        self.assertEqual(image.property_image.read(), content)
+        self.assertEqual(self.stored_files('chunks'), [])
+
+    def test_completed_twice(self):
+        content = jpeg('green')
+        upload = PropertyImageUpload.objects.create(
+            property=self.property, filename='c.jpg', size=len(content), checksum=hashlib.sha256(content).hexdigest(),
+        )
+        uploads.append_chunk(upload, io.BytesIO(content), 0)
+        # a retry read the upload before the first completion committed
+        retried = PropertyImageUpload.objects.get(pk=upload.pk)
+        with self.captureOnCommitCallbacks(execute=False):
+            self.assertEqual(len(uploads.complete(self.property, [upload])), 1)
+            with self.assertRaises(uploads.UploadGone):
+                uploads.complete(self.property, [retried])
+        # or after it committed and deleted the chunks
+        uploads.delete_chunks(upload.chunks)
+        with self.assertRaises(uploads.UploadGone):
+            uploads.complete(self.property, [retried])
+        # the image of create_rentals() and the uploaded one
+        self.assertEqual(self.property.images.count(), 2)
+
+
+@override_settings(PROFILING=True)
+class ProfilingTests(TestCase):
+    """Requests are timed in a Server-Timing header, a sampled log and optionally cProfile"""
+    def setUp(self):
+        # what RentingConfig.ready() does with PROFILING on
+        profiling.install()
+        create_rentals(2)
+        self.url = reverse('sector-list', kwargs={'district_pk': District.objects.first().pk})
+
+    @override_settings(SERVER_TIMING=True, PROFILING_LOG_SAMPLE_RATE=1)
+    def test_timings(self):
+        with self.assertLogs('backend.profiling', 'INFO') as logs:
+            response = self.client.get(self.url)
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", serializer;dur=[\d.]+$')
+        profile = logs.records[0].profile
+        self.assertEqual(profile['path'], self.url)
+        self.assertEqual(profile['status'], 200)
+        self.assertGreater(profile['queries'], 0)
+        self.assertEqual(profile['response_bytes'], len(response.content))
+
+    @override_settings(PROFILING_LOG_SAMPLE_RATE=1)
+    def test_log_output(self):
+        handler, = logging.getLogger('backend.profiling').handlers
+        stream = io.StringIO()
+        self.addCleanup(handler.setStream, handler.setStream(stream))
+        self.client.get(self.url)
+        record = json.loads(stream.getvalue().splitlines()[-1])
+        self.assertEqual(record['message'], 'request profile')
+        self.assertEqual(record['profile']['path'], self.url)
+        self.assertGreater(record['profile']['queries'], 0)
+
+    @override_settings(SERVER_TIMING=False, PROFILING_LOG_SAMPLE_RATE=0, PROFILING_TOKEN='secret')
+    def test_cprofile(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(PROFILING_DIR=directory):
+            response = self.client.get(self.url, HTTP_X_PROFILE='wrong')
+            self.assertNotIn('Server-Timing', response)
+            self.assertEqual(os.listdir(directory), [])
+            with self.assertLogs('backend.profiling', 'INFO') as logs:
+                self.client.get(self.url, HTTP_X_PROFILE='secret')
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertTrue(logs.records[0].profile['functions'])
+
+
+class ConnectionPoolTests(TestCase):
+    """The pool hands out idle connections before it connects, and they aren't counted as opened"""
+    def connect(self):
+        return mock.Mock(name='connection')
+
+    def test_checkout_and_return(self):
+        pool = pooled.ConnectionPool(2, timeout=0.1, check_after=None)
+        connect = mock.Mock(side_effect=self.connect)
+        first = pool.get(connect, is_usable=None)
+        second = pool.get(connect, is_usable=None)
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(pool.stats(), {'size': 2, 'idle': 0, 'in_use': 2, 'created': 2, 'reused': 0, 'discarded': 0})
+        # no slot left until a connection comes back
+        with self.assertRaises(OperationalError):
+            pool.get(connect, is_usable=None)
+        pool.put(first)
+        self.assertIs(pool.get(connect, is_usable=None), first)
+        self.assertEqual(connect.call_count, 2)
+        # broken connections are closed rather than handed out again
+        pool.put(second, discard=True)
+        second.close.assert_called_once()
+        self.assertIsNot(pool.get(connect, is_usable=None), second)
+        self.assertEqual(pool.stats(), {'size': 2, 'idle': 0, 'in_use': 2, 'created': 3, 'reused': 1, 'discarded': 1})
+
+    def test_checked_after(self):
+        pool = pooled.ConnectionPool(1, timeout=0.1, check_after=0)
+        connection = pool.get(self.connect, is_usable=None)
+        pool.put(connection)
+        self.assertIs(pool.get(self.connect, is_usable=lambda connection: True), connection)
+        pool.put(connection)
+        # an idle connection that went away is replaced
+        replaced = pool.get(self.connect, is_usable=lambda connection: False)
+        self.assertIsNot(replaced, connection)
+        connection.close.assert_called_once()
+
+    def test_failed_connect(self):
+        pool = pooled.ConnectionPool(1, timeout=0.1, check_after=None)
+        with self.assertRaises(OperationalError):
+            pool.get(mock.Mock(side_effect=OperationalError('refused')), is_usable=None)
+        # the slot was given back
+        pool.get(self.connect, is_usable=None)
+        self.assertIs(pooled.get_pool('pool_test', 1, 0.1, None), pooled.get_pool('pool_test', 5, 1, None))
+        self.assertIn('pool_test', pooled.pool_stats())
+
+    def test_stats(self):
+        # the pooled backend marks its checkouts, other backends always connect
+        for connection in ({'from_pool': False}, {'from_pool': True}, {'from_pool': True}, {}):
+            db_stats.count_connection(None, SimpleNamespace(alias='stats_test', **connection))
+        self.assertEqual(db_stats.stats()['connections']['stats_test'], {'opened': 2, 'pooled': 2, 'reused': 0})
+
+
+class MetricsTests(TestCase):
+    """/metrics reports the requests of every view and adds up the metrics of the processes sharing METRICS_DIR"""
+    @override_settings(METRICS_TOKEN='secret')
+    def test_requests(self):
+        create_rentals(1)
+        self.client.get(reverse('sector-list', kwargs={'district_pk': District.objects.get().pk}))
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        content = response.content.decode()
+        self.assertIn('http_requests_total{view="SectorViewSet",action="list",method="GET",status="200"}', content)
+        self.assertIn('http_request_duration_seconds_bucket{view="SectorViewSet",action="list",le="+Inf"}', content)
+        self.assertIn('db_queries_total{alias="default"}', content)
+        self.assertIn('outbox_emails{status="pending"} 0', content)
+
+    def test_token(self):
+        # closed without a token
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_processes(self):
+        counter = metrics.Counter('test_forked_events_total', 'Events counted by the test')
+
+        def child():
+            counter.inc(5)
+            # what exiting does, multiprocessing children skip atexit
+            metrics.retire()
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            counter.inc(1)
+            metrics.flush()
+            process = multiprocessing.get_context('fork').Process(target=child)
+            process.start()
+            process.join()
+            # the child's file was folded into the archive
+            self.assertEqual(len([name for name in os.listdir(directory) if name.endswith('.json')]), 2)
+            self.assertIn(metrics.ARCHIVE, os.listdir(directory))
+            self.assertIn('test_forked_events_total 6\n', metrics.render(metrics.collect()))
+
+    def test_idle_flush(self):
+        counter = metrics.Counter('test_idle_events_total', 'Events counted by the test')
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            counter.inc(2)
+            # the loop of the flushing thread, stopped on its second wait
+            with mock.patch('backend.metrics.time.sleep', side_effect=[None, SystemExit]), self.assertRaises(SystemExit):
+                metrics.flush_periodically()
+            files = [name for name in os.listdir(directory) if name.endswith('.json')]
+            self.assertEqual(len(files), 1)
+            self.assertEqual(metrics.read_json(os.path.join(directory, files[0]))['test_idle_events_total']['values'], [[[], 2]])
+
+class BenchmarkTests(TestCase):
+    """The benchmark data generator and scenarios work on a small scale"""
+    def test_seed_and_run(self):
+        counts = benchmarks.seed(users=10, properties=20, images=40)
+        self.assertEqual(counts, {'users': 10, 'properties': 20, 'images': 40, 'cells': benchmarks.CELL_COUNT})
+        self.assertEqual(Sector.objects.count(), benchmarks.SECTOR_COUNT)
+        self.assertEqual(District.objects.count(), 30)
+        with self.assertRaises(ValueError):
+            benchmarks.seed(users=1, properties=1, images=1)
+
+        results = benchmarks.run(iterations=2, warmup=0)
+        self.assertEqual(set(results), set(benchmarks.SCENARIOS))
+        for name, result in results.items():
+            with self.subTest(name):
+                self.assertEqual(result['errors'], 0)
+                self.assertEqual(result['requests'], 2)
@@ -0,0 +1,214 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from PIL import Image
+
+from backend import metrics
+from . import images, listings
+from .cache import invalidate_search_results
+from .models import PropertyImages, PropertyImageUpload
+from .storage import retain
+
+
+# Resumable uploads of property images. Every chunk is written to the
+# CHUNKED_UPLOAD_STORAGE as a file of its own and the upload row keeps their names
+# and the offset reached, so an interrupted upload resumes on any instance sharing
+# that storage. Completing an upload joins its chunks, checks them and moves the
+# file into the media storage, attaching the images with a single bulk insert.
+CHUNK_SIZE = 64 * 1024
+# bytes of a chunk kept in memory while it is received, the rest goes to a temporary file
+SPOOL_SIZE = 1024 * 1024
+
+IMAGES_STORED = metrics.Counter('property_images_stored_total', 'Property images uploaded and stored')
+UPLOADED_BYTES = metrics.Counter('image_upload_bytes_total', 'Bytes received by chunked image uploads')
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadGone(UploadError):
+    """The upload was completed or discarded by another request"""
+
+
+class StagedFile(File):
+    """A joined upload that FileSystemStorage moves into place instead of copying"""
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def chunk_storage():
+    return import_string(settings.CHUNKED_UPLOAD_STORAGE['BACKEND'])(**settings.CHUNKED_UPLOAD_STORAGE.get('OPTIONS', {}))
+
+
+def get_offset(upload):
+    return PropertyImageUpload.objects.filter(pk=upload.pk).values_list('offset', flat=True).first() or 0
+
+
+def append_chunk(upload, stream, start):
+    """Store the request body as the chunk of ``upload`` starting at ``start``, which must
+    be the current offset, returns the new offset"""
+    offset = get_offset(upload)
+    if start != offset:
+        raise UploadError(f"Expected a chunk starting at byte {offset}.")
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, dir=settings.FILE_UPLOAD_TEMP_DIR) as body:
+        size = 0
+        while True:
+            chunk = stream.read(CHUNK_SIZE) if stream is not None else b''
+            if not chunk:
+                break
+            size += len(chunk)
+            if start + size > upload.size:
+                raise UploadError("The chunk goes past the declared upload size.")
+            body.write(chunk)
+        if not size:
+            return offset
+
+        storage = chunk_storage()
+        with transaction.atomic():
+            # a retry racing the first attempt at the same chunk must not be added twice,
+            # the row lock orders them and the conditional update catches databases without one
+            locked = PropertyImageUpload.objects.select_for_update().get(pk=upload.pk)
+            if start != locked.offset:
+                raise UploadError(f"Expected a chunk starting at byte {locked.offset}.")
+            body.seek(0)
+            name = storage.save(f'{upload.pk}/{start:012d}.part', File(body))
+            chunks = locked.chunks + [name]
+            if not PropertyImageUpload.objects.filter(pk=upload.pk, offset=start).update(offset=start + size, chunks=chunks):
+                storage.delete(name)
+                raise UploadError(f"Expected a chunk starting at byte {get_offset(upload)}.")
+    UPLOADED_BYTES.inc(size)
+    upload.offset, upload.chunks = start + size, chunks
+    return upload.offset
+
+
+def join_chunks(upload):
+    """Join the chunks of a finished upload into a temporary file, checked against the
+    declared size and checksum and for being an image, returns its path"""
+    if upload.offset != upload.size:
+        raise UploadError("The upload is not finished.")
+    storage = chunk_storage()
+    checksum = hashlib.sha256()
+    file = tempfile.NamedTemporaryFile(suffix='.upload', dir=settings.FILE_UPLOAD_TEMP_DIR, delete=False)
+    try:
+        with file:
+            for name in upload.chunks:
+                try:
+                    chunk = storage.open(name, 'rb')
+                except FileNotFoundError:
+                    # deleted with its upload by a completion that committed meanwhile
+                    raise UploadGone("The upload was already completed or discarded.")
+                with chunk:
+                    for data in iter(lambda: chunk.read(CHUNK_SIZE), b''):
+                        checksum.update(data)
+                        file.write(data)
+        if checksum.hexdigest() != upload.checksum.lower():
+            raise UploadError("The checksum of the uploaded file does not match.")
+        try:
+            with Image.open(file.name) as image:
+                image.verify()
+        except Exception:
+            raise UploadError("The uploaded file is not a valid image.")
+    except BaseException:
+        os.remove(file.name)
+        raise
+    return file.name
+
+
+def delete_chunks(names):
+    storage = chunk_storage()
+    for name in names:
+        storage.delete(name)
+
+
+def attach_images(property_obj, files):
+    """Store ``(filename, file)`` pairs as images of a property with one bulk insert"""
+    field = PropertyImages._meta.get_field('property_image')
+    objs = []
+    for filename, file in files:
+        obj = PropertyImages(property=property_obj)
+        name = field.generate_filename(obj, filename)
+        obj.property_image = field.storage.save(name, file, max_length=field.max_length)
+        objs.append(obj)
+
+    objs = PropertyImages.objects.bulk_create(objs)
+    IMAGES_STORED.inc(len(objs))
+    if any(obj.pk is None for obj in objs):
+        # backends that don't return the ids of bulk inserted rows
+        objs = list(PropertyImages.objects.filter(
+            property=property_obj, property_image__in=[obj.property_image.name for obj in objs],
+        ))
+    # bulk_create sends no post_save, do what the signal handlers would have done
+    retain([obj.property_image.name for obj in objs])
+    for obj in objs:
+        images.schedule(PropertyImages, obj.pk, 'property_image')
+    listings.schedule_refresh([property_obj.pk])
+    transaction.on_commit(invalidate_search_results)
+    return objs
+
+
+def sync_images(property_obj, files):
+    """Make ``(filename, file)`` pairs the images of a property. With content addressed
+    storage images it already has are kept, only the others are deleted or added."""
+    field = PropertyImages._meta.get_field('property_image')
+    content_name = getattr(field.storage, 'content_name', None)
+    if content_name is None:
+        property_obj.images.all().delete()
+        return attach_images(property_obj, files)
+
+    incoming = {}
+    for filename, file in files:
+        name = content_name(field.generate_filename(PropertyImages(property=property_obj), filename), file)
+        incoming.setdefault(name, (filename, file))
+    kept = set()
+    stale = []
+    for image in property_obj.images.all():
+        names = {image.property_image.name, image.renditions.get('uploaded')} & incoming.keys()
+        if names:
+            kept |= names
+        else:
+            stale.append(image.pk)
+    property_obj.images.filter(pk__in=stale).delete()
+    return attach_images(property_obj, [pair for name, pair in incoming.items() if name not in kept])
+
+
+def complete(property_obj, uploads):
+    """Join and check finished uploads and attach them to the property"""
+    paths = []
+    try:
+        for upload in uploads:
+            paths.append(join_chunks(upload))
+        staged = [(upload.filename, StagedFile(open(path, 'rb'))) for upload, path in zip(uploads, paths)]
+        try:
+            with transaction.atomic():
+                # a retried or concurrent completion of the same uploads waits for the
+                # first one here and finds them gone, the deleted count catches databases
+                # without row locks
+                pks = [upload.pk for upload in uploads]
+                locked = PropertyImageUpload.objects.select_for_update().filter(pk__in=pks)
+                if len(locked) != len(pks) or locked.delete()[1].get(PropertyImageUpload._meta.label) != len(pks):
+                    raise UploadGone("The upload was already completed or discarded.")
+                objs = attach_images(property_obj, staged)
+                for upload in uploads:
+                    transaction.on_commit(lambda names=upload.chunks: delete_chunks(names))
+        finally:
+            for filename, file in staged:
+                file.close()
+    finally:
+        # files the storage already had were not moved
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    return objs
+
+
+def discard(upload):
+    names = upload.chunks
+    upload.delete()
+    transaction.on_commit(lambda: delete_chunks(names))
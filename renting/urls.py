@@ -1,10 +1,13 @@
 # urls.py
 
+from django.conf import settings
 from django.urls import path, include
 from rest_framework_nested import routers
 
+from . import async_views
 from .views import (
     DistrictViewSet,
+    LocationTreeViewSet,
     SectorViewSet,
     CellViewSet,
     SearchRentalViewSet,
@@ -22,6 +25,7 @@ router.register(r'get_in_touch', GetInTouchViewSet, basename='messages')
 router.register(r'testimonials', TestimonialViewSet, basename='testimonial')
 
 # start location
+router.register(r'locations', LocationTreeViewSet, basename='location_tree')
 router.register(r'districts', DistrictViewSet, basename='district')
 
 district_router = routers.NestedSimpleRouter(router, r'districts', lookup='district')
@@ -36,3 +40,14 @@ urlpatterns = [
     path('', include(district_router.urls)),
     path('', include(sector_router.urls)),
 ]
+
+if settings.ASYNC_VIEWS:
+    # the read only hot paths are served by async views ahead of their viewsets
+    urlpatterns = [
+        path('find_renting/search/', async_views.search),
+        path('testimonials/', async_views.testimonials),
+        path('locations/', async_views.location_tree),
+        path('districts/', async_views.district_list),
+        path('districts/<str:district_pk>/sectors/', async_views.sector_list),
+        path('districts/<str:district_pk>/sectors/<str:sector_pk>/cells/', async_views.cell_list),
+    ] + urlpatterns
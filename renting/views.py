@@ -1,19 +1,40 @@
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
 
 from rest_framework.decorators import action
-from rest_framework import viewsets, mixins
+from rest_framework import viewsets, mixins, status
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from .models import (
     Manager, Landlord, Province, District, Sector, Cell,
-    PropertyType, Property, PropertyImages, PublishingPayment, GetInTouch, Testimonial
+    PropertyType, Property, PropertyImages, PropertyImageUpload, SearchListing, PublishingPayment, GetInTouch, Testimonial
 )
 from .serializers import (
     ManagerSerializer, LandlordSerializer, ProvinceSerializer, DistrictSerializer,
     SectorSerializer, CellSerializer, PropertyTypeSerializer, PropertySerializer,
     PropertyImagesSerializer, PublishingPaymentSerializer, GetInTouchSerializer,
-    TestimonialSerializer,RentalSearchSerializer
+    TestimonialSerializer,RentalSearchSerializer,SearchListingSerializer,PropertyImageUploadSerializer,PropertyImageUploadCompleteSerializer
 )
+from .filters import LISTING_FACET_NAMES, SEARCH_ORDERING_CHOICES, filter_properties, property_facets, search_ordering
+from .pagination import KeysetPagination
+from .permissions import IsLandlordOrStaff
+from backend.replicas import ReplicaReadMixin, replica_reads
+from . import bulk, cache, locations, uploads
+
+
+def location_response(request, name):
+    """Serve cached location data as JSON, answering 304 when the client's ETag still matches"""
+    return rendered_response(request, *locations.get_rendered(name))
+
+
+def rendered_response(request, content, etag):
+    response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    return get_conditional_response(request, etag=etag, response=response)
 
 
 class ManagerViewSet(mixins.ListModelMixin, 
@@ -50,7 +71,7 @@ class LandlordViewSet(mixins.ListModelMixin,
     serializer_class = LandlordSerializer
 
     def get_queryset(self):
-        queryset = Landlord.objects.all()
+        queryset = Landlord.objects.with_properties()
         user_pk = self.kwargs.get('user_pk')
         landlord_pk = self.kwargs.get('landlord_pk')
 
@@ -71,11 +92,11 @@ class LandlordViewSet(mixins.ListModelMixin,
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
-class DistrictViewSet(mixins.ListModelMixin,viewsets.GenericViewSet):
+class DistrictViewSet(ReplicaReadMixin, mixins.ListModelMixin,viewsets.GenericViewSet):
     serializer_class = DistrictSerializer
 
     def get_queryset(self):
-        queryset = District.objects.all()
+        queryset = District.objects.select_related('province').prefetch_related('sectors__cells')
         district_pk = self.kwargs.get('district_pk')
 
         if district_pk:
@@ -83,20 +104,23 @@ class DistrictViewSet(mixins.ListModelMixin,viewsets.GenericViewSet):
         return queryset
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return location_response(request, 'districts')
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
-class SectorViewSet(mixins.ListModelMixin,viewsets.GenericViewSet):
+class LocationTreeViewSet(viewsets.ViewSet):
+    """The whole Province -> District -> Sector -> Cell hierarchy"""
+    def list(self, request, *args, **kwargs):
+        return location_response(request, 'tree')
+
+class SectorViewSet(ReplicaReadMixin, mixins.ListModelMixin,viewsets.GenericViewSet):
     serializer_class = SectorSerializer
 
     def get_queryset(self):
-        queryset = Sector.objects.all()
+        queryset = Sector.objects.prefetch_related('cells')
         district_pk = self.kwargs.get('district_pk')
         
         if district_pk:
@@ -114,7 +138,7 @@ class SectorViewSet(mixins.ListModelMixin,viewsets.GenericViewSet):
         return Response(serializer.data)
 
 
-class CellViewSet(mixins.ListModelMixin,viewsets.GenericViewSet):
+class CellViewSet(ReplicaReadMixin, mixins.ListModelMixin,viewsets.GenericViewSet):
     serializer_class = CellSerializer
     
     def get_queryset(self):
@@ -149,8 +173,13 @@ class PropertyTypeViewSet(viewsets.ModelViewSet):
 
 class PropertyViewSet(viewsets.ModelViewSet):
     serializer_class = PropertySerializer
+    pagination_class = KeysetPagination
+
     def get_queryset(self):
-        queryset = Property.objects.all()
+        queryset = Property.objects.with_details()
+        ordering = self.request.query_params.get('ordering')
+        if ordering in SEARCH_ORDERING_CHOICES:
+            queryset = queryset.order_by(*search_ordering(ordering))
         property_pk = self.kwargs.get('property_pk')
         landlord_pk = self.kwargs.get('landlord_pk')
         user_pk = self.kwargs.get('user_pk')
@@ -163,6 +192,37 @@ class PropertyViewSet(viewsets.ModelViewSet):
                                        property__landlord__user__pk=user_pk)
         return queryset
 
+    # bulk import and export of the landlord's properties as CSV or NDJSON, see renting.bulk
+    @action(detail=False, methods=['POST'], url_path='import', permission_classes=[IsAuthenticated, IsLandlordOrStaff])
+    def import_properties(self, request, **kwargs):
+        landlord = get_object_or_404(Landlord, pk=self.kwargs.get('landlord_pk'))
+        if request.content_type.startswith('multipart/'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+            stream, file_format = upload, bulk.guess_format(upload.name, upload.content_type)
+        else:
+            # a raw CSV or NDJSON body is read as it arrives
+            stream, file_format = request.stream, bulk.guess_format(content_type=request.content_type)
+        if stream is None:
+            return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = bulk.import_properties(
+            landlord, bulk.read_rows(stream, file_format), dry_run=request.query_params.get('dry_run') == 'true',
+        )
+        code = status.HTTP_400_BAD_REQUEST if report['error_count'] and not report['valid'] else status.HTTP_200_OK
+        return Response(report, status=code)
+
+    @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated, IsLandlordOrStaff])
+    def export(self, request, **kwargs):
+        file_format = request.query_params.get('export_format', 'csv')
+        if file_format not in bulk.FORMATS:
+            return Response({'export_format': [f'Choose one of {", ".join(bulk.FORMATS)}.']}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = Property.objects.order_by('id')
+        if self.kwargs.get('landlord_pk'):
+            queryset = queryset.filter(landlord__pk=self.kwargs['landlord_pk'])
+        return bulk.export_response(request._request, queryset, bulk.PROPERTY_COLUMNS, 'properties', file_format)
+
 
 class PropertyImagesViewSet(mixins.ListModelMixin, mixins.CreateModelMixin,
                             mixins.RetrieveModelMixin, mixins.DestroyModelMixin,
@@ -171,7 +231,7 @@ class PropertyImagesViewSet(mixins.ListModelMixin, mixins.CreateModelMixin,
     serializer_class = PropertyImagesSerializer
 
     def get_queryset(self):
-        queryset = PropertyImages.objects.all()
+        queryset = PropertyImages.objects.select_related('property')
         landlord_pk = self.kwargs.get('landlord_pk')
         property_pk = self.kwargs.get('property_pk')
         user_pk = self.kwargs.get('user_pk')
@@ -188,6 +248,54 @@ class PropertyImagesViewSet(mixins.ListModelMixin, mixins.CreateModelMixin,
         if property_pk:
             property_obj = get_object_or_404(Property, pk=property_pk)
             serializer.save(property=property_obj)
+            uploads.IMAGES_STORED.inc()
+
+    # resumable chunked uploads: start an upload, PATCH its chunks with a
+    # Content-Range header, then complete one or more finished uploads at once
+    @action(detail=False, methods=['POST'], url_path='uploads', serializer_class=PropertyImageUploadSerializer)
+    def start_upload(self, request, **kwargs):
+        property_obj = get_object_or_404(Property, pk=self.kwargs.get('property_pk'))
+        serializer = PropertyImageUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(property=property_obj)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['GET', 'PATCH', 'DELETE'], url_path=r'uploads/(?P<upload_pk>[0-9a-f-]{36})',
+            serializer_class=PropertyImageUploadSerializer)
+    def upload(self, request, upload_pk=None, **kwargs):
+        upload = get_object_or_404(PropertyImageUpload, pk=upload_pk, property__pk=self.kwargs.get('property_pk'))
+        if request.method == 'DELETE':
+            uploads.discard(upload)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        if request.method == 'PATCH':
+            try:
+                start = int(request.headers.get('Content-Range', 'bytes 0-').split()[1].split('-')[0])
+            except (IndexError, ValueError):
+                return Response({'error': 'Invalid Content-Range header.'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                uploads.append_chunk(upload, request.stream, start)
+            except uploads.UploadError as error:
+                return Response({'error': str(error), 'offset': uploads.get_offset(upload)}, status=status.HTTP_409_CONFLICT)
+        return Response(PropertyImageUploadSerializer(upload).data)
+
+    @action(detail=False, methods=['POST'], url_path='uploads/complete',
+            serializer_class=PropertyImageUploadCompleteSerializer)
+    def complete_uploads(self, request, **kwargs):
+        property_obj = get_object_or_404(Property, pk=self.kwargs.get('property_pk'))
+        serializer = PropertyImageUploadCompleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload_ids = serializer.validated_data['uploads']
+        pending = list(property_obj.image_uploads.filter(pk__in=upload_ids))
+        if len(pending) != len(set(upload_ids)):
+            return Response({'error': 'Unknown upload.'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            objs = uploads.complete(property_obj, pending)
+        except uploads.UploadGone as error:
+            return Response({'error': str(error)}, status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = PropertyImagesSerializer(objs, many=True, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['POST'])
     def set_primary(self, request, pk=None, **kwargs):
@@ -216,44 +324,57 @@ class GetInTouchViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixi
     serializer_class = GetInTouchSerializer
 
 
-class TestimonialViewSet(mixins.ListModelMixin, mixins.CreateModelMixin,
+class TestimonialViewSet(ReplicaReadMixin, mixins.ListModelMixin, mixins.CreateModelMixin,
                             mixins.RetrieveModelMixin, mixins.DestroyModelMixin,
                             viewsets.GenericViewSet):
     queryset = Testimonial.objects.all()
     serializer_class = TestimonialSerializer
+    replica_actions = ('list',)
 
 
-class SearchRentalViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
-    queryset = Property.objects.all()
-    serializer_class = RentalSearchSerializer
+class SearchRentalViewSet(ReplicaReadMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    # one row per property with the names it's shown with, see renting.listings
+    queryset = SearchListing.objects.all()
+    serializer_class = SearchListingSerializer
+    pagination_class = KeysetPagination
+    replica_actions = ('list', 'search')
 
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['get', 'post'])
     def search(self, request):
-        serializer = RentalSearchSerializer(data=request.data)
+        serializer = RentalSearchSerializer(data=request.query_params if request.method == 'GET' else request.data)
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
 
-        queryset = self.get_queryset()
-        if data.get('property_type'):
-            queryset = queryset.filter(property_type=data['property_type'])
-        if data.get('bedrooms'):
-            queryset = queryset.filter(bedrooms=data['bedrooms'])
-        if data.get('bathrooms'):
-            queryset = queryset.filter(bathrooms=data['bathrooms'])
-        if data.get('is_furnished'):
-            queryset = queryset.filter(is_furnished=data['is_furnished'])
-        if data.get('floors'):
-            queryset = queryset.filter(floors=data['floors'])
-        if data.get('plot_size'):
-            queryset = queryset.filter(plot_size=data['plot_size'])
-        if data.get('renting_price'):
-            queryset = queryset.filter(renting_price=data['renting_price'])
-        if data.get('district'):
-            queryset = queryset.filter(district=data['district'])
-        if data.get('sector'):
-            queryset = queryset.filter(sector=data['sector'])
-        if data.get('cell'):
-            queryset = queryset.filter(cell=data['cell'])
-
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        # anonymous searches repeat a lot, their results are cached until a property changes
+        cache_key = None
+        if not request.user.is_authenticated:
+            cache_key = cache.search_cache_key(request, data)
+            results = cache.get_search_results(cache_key)
+            if results is not None:
+                return self.search_response(request, Response(results))
+
+        # results going to the shared cache are read from the default database, a lagging
+        # replica's would be served to everyone until the next invalidation
+        with replica_reads(cache_key is None and getattr(self, 'replica_token', None) is not None):
+            queryset = filter_properties(self.get_queryset(), data)
+            queryset = queryset.order_by(*search_ordering(data['ordering']))
+
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                serializer = self.get_serializer(page, many=True)
+                response = self.get_paginated_response(serializer.data)
+            else:
+                serializer = self.get_serializer(queryset, many=True)
+                response = Response(serializer.data)
+
+            if data['facets'] and page is not None:
+                response.data['facets'] = property_facets(SearchListing.objects.all(), data, LISTING_FACET_NAMES)
+        if cache_key is not None:
+            cache.set_search_results(cache_key, response.data)
+        return self.search_response(request, response)
+
+    def search_response(self, request, response):
+        if request.method == 'GET':
+            # let HTTP caches and CDNs store GET searches for as long as the server does
+            patch_cache_control(response, public=True, max_age=settings.SEARCH_CACHE_TIMEOUT)
+        return response
@@ -3,6 +3,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
 from renting.admin import UserLocationInline
+from .models import OutboxEmail
 from . forms import UserRegisterForm, UserUpdateForm, UpdatePasswordForm
 
 
@@ -44,3 +45,13 @@ class UserAdmin(BaseUserAdmin):
     ordering = ('email','date_joined',)
     filter_horizontal = ('groups', 'user_permissions',)
     inlines = [UserLocationInline]
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt', 'created_date', 'sent_date',)
+    list_filter = ('status', 'created_date',)
+    list_per_page = 20
+    search_fields = ('subject',)
+    readonly_fields = ('attempts', 'last_error', 'created_date', 'sent_date',)
+    ordering = ('-created_date',)
@@ -0,0 +1,130 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+
+from rest_framework import authentication, exceptions
+
+import jwt
+
+User = get_user_model()
+
+
+# Access tokens live for JWT_AUTH['JWT_EXPIRATION_DELTA'] and are sent in an
+# ``Authorization: Bearer`` header or the ``jwt`` cookie; refresh tokens live for
+# JWT_AUTH['JWT_REFRESH_EXPIRATION_DELTA'] and can only be exchanged for a new
+# access token. Tokens carry a hash of the user's password, so changing it revokes
+# them. The user of a token is kept in the cache for a short while, and dropped when
+# the user is saved or deleted, so authenticating costs no query. Every process must
+# share the cache for a deactivated user to be refused by all of them, see CACHES.
+ACCESS_COOKIE = 'jwt'
+REFRESH_COOKIE = 'jwt-refresh'
+ACCESS = 'access'
+REFRESH = 'refresh'
+ALGORITHM = 'HS256'
+USER_CACHE_KEY = 'users:auth-user:{pk}'
+
+
+def expiration_delta(token_type):
+    key = 'JWT_REFRESH_EXPIRATION_DELTA' if token_type == REFRESH else 'JWT_EXPIRATION_DELTA'
+    return settings.JWT_AUTH[key]
+
+
+def encode_token(user, token_type=ACCESS):
+    now = datetime.utcnow()
+    payload = {
+        'user_id': user.pk,
+        'type': token_type,
+        'auth': user.get_session_auth_hash(),
+        'exp': now + expiration_delta(token_type),
+        'iat': now,
+    }
+    return jwt.encode(payload, settings.SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_token(token, token_type=ACCESS):
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise exceptions.AuthenticationFailed('Token has expired.')
+    except jwt.InvalidTokenError:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    # tokens issued before refresh tokens existed have no type and were access tokens
+    if payload.get('type', ACCESS) != token_type or 'user_id' not in payload:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    return payload
+
+
+def set_token_cookies(response, user):
+    """Issue a new access and refresh token pair as cookies, returns the tokens"""
+    tokens = {ACCESS: encode_token(user, ACCESS), REFRESH: encode_token(user, REFRESH)}
+    response.set_cookie(
+        key=ACCESS_COOKIE, value=tokens[ACCESS], httponly=True,
+        max_age=int(expiration_delta(ACCESS).total_seconds()),
+    )
+    response.set_cookie(
+        key=REFRESH_COOKIE, value=tokens[REFRESH], httponly=True,
+        max_age=int(expiration_delta(REFRESH).total_seconds()),
+    )
+    return tokens
+
+
+def get_user(pk):
+    """Return the user with the given pk, from the cache when possible"""
+    key = USER_CACHE_KEY.format(pk=pk)
+    user = cache.get(key)
+    if user is None:
+        user = User.objects.filter(pk=pk).first()
+        if user is not None:
+            cache.set(key, user, timeout=settings.JWT_AUTH.get('JWT_USER_CACHE_TIMEOUT', 60))
+    return user
+
+
+def invalidate_user(pk):
+    cache.delete(USER_CACHE_KEY.format(pk=pk))
+
+
+def get_token_user(payload):
+    """The active user a decoded token was issued to, unless their password changed since"""
+    user = get_user(payload['user_id'])
+    if user is None:
+        raise exceptions.AuthenticationFailed('User not found.')
+    if not user.is_active:
+        raise exceptions.AuthenticationFailed('User account is not active.')
+    # tokens issued before they carried the hash are let through until they expire
+    if 'auth' in payload and not constant_time_compare(payload['auth'], user.get_session_auth_hash()):
+        raise exceptions.AuthenticationFailed('Token has been revoked.')
+    return user
+
+
+class JWTAuthentication(authentication.BaseAuthentication):
+    """Authenticate requests with an access token in the Authorization header or the jwt cookie"""
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        header = authentication.get_authorization_header(request).split()
+        if header and header[0].lower() == self.keyword.lower().encode():
+            if len(header) != 2:
+                raise exceptions.AuthenticationFailed('Invalid token header.')
+            return self.authenticate_token(header[1].decode())
+
+        token = request.COOKIES.get(ACCESS_COOKIE)
+        if not token:
+            return None
+        try:
+            user, payload = self.authenticate_token(token)
+        except exceptions.AuthenticationFailed:
+            # a stale cookie shouldn't lock the browser out of the public endpoints
+            return None
+        # the browser sends cookies along with cross site requests
+        authentication.SessionAuthentication().enforce_csrf(request)
+        return user, payload
+
+    def authenticate_token(self, token):
+        payload = decode_token(token, ACCESS)
+        return get_token_user(payload), payload
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,50 @@
+import logging
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import connection as db_connection
+
+from users import outbox
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Send the emails waiting in the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE, help="Emails sent per transaction")
+        parser.add_argument('--max-attempts', type=int, default=outbox.MAX_ATTEMPTS, help="Attempts before an email is marked failed")
+        parser.add_argument('--loop', action='store_true', help="Keep polling the outbox instead of exiting once it is drained")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds between polls with --loop")
+        parser.add_argument('--stats', action='store_true', help="Only print the queue depth")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.write_stats()
+            return
+
+        # a single SMTP connection for the whole run, reopened only after a failure
+        connection = get_connection()
+        try:
+            while True:
+                sent, failed = outbox.drain(options['batch_size'], options['max_attempts'], connection)
+                if sent or failed:
+                    self.stdout.write(f"{sent} sent, {failed} failed")
+                    self.write_stats()
+                if not options['loop']:
+                    break
+                # don't keep a database connection open while idle
+                db_connection.close_if_unusable_or_obsolete()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+
+    def write_stats(self):
+        stats = outbox.stats()
+        logger.info("outbox queue depth", extra={'outbox': stats})
+        self.stdout.write(' '.join(f"{key}={value:g}" for key, value in stats.items()))
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 
 from .manager import UserManager
 # Create your models here.
@@ -23,4 +24,35 @@ class UserAccount(AbstractUser):
         swappable = 'AUTH_USER_MODEL'
     
     def __str__(self):
-        return '{} {}'.format(self.first_name,self.last_name)
\ No newline at end of file
+        return '{} {}'.format(self.first_name,self.last_name)
+
+class OutboxEmail(models.Model):
+    """An email written in the same transaction as the change that triggers it and
+    sent later by the send_outbox_emails command"""
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    created_date = models.DateTimeField(auto_now_add=True)
+    sent_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "Outbox Emails"
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='outbox_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return '{} to {}'.format(self.subject, ', '.join(self.to))
@@ -0,0 +1,119 @@
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from backend import metrics
+from .models import OutboxEmail
+
+
+# Emails are written to the outbox in the transaction of the change that triggers
+# them, so a request never waits on the mail relay and a rolled back signup sends
+# nothing. The send_outbox_emails command drains the outbox in batches over one
+# SMTP connection; a failed email is retried with exponential backoff until it runs
+# out of attempts.
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 60 * 60
+
+SENDS = metrics.Counter('outbox_email_sends_total', 'Attempts at sending outbox emails, by result', ['result'])
+
+
+def enqueue(subject, body, to, from_email=''):
+    """Add an email to the outbox, call it inside the transaction that triggers it"""
+    return OutboxEmail.objects.create(subject=subject, body=body, to=list(to), from_email=from_email or '')
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS))
+
+
+def send_batch(connection, batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS):
+    """Send the due emails of one batch over ``connection``, returns (sent, failed)"""
+    sent = failed = 0
+    with transaction.atomic():
+        # skip_locked lets several workers drain the outbox without sending twice
+        batch = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEmail.PENDING, next_attempt__lte=timezone.now())
+            .order_by('next_attempt', 'id')[:batch_size]
+        )
+        for email in batch:
+            message = EmailMessage(
+                subject=email.subject,
+                body=email.body,
+                from_email=email.from_email or None,
+                to=email.to,
+                connection=connection,
+            )
+            now = timezone.now()
+            email.attempts += 1
+            try:
+                # opened here rather than by send() so it stays open for the next email
+                connection.open()
+                message.send()
+            except Exception as error:
+                email.last_error = f'{type(error).__name__}: {error}'
+                if email.attempts >= max_attempts:
+                    email.status = OutboxEmail.FAILED
+                else:
+                    email.next_attempt = now + backoff(email.attempts)
+                failed += 1
+                SENDS.inc(result='failed')
+                # the connection may be broken, open a new one for the next email
+                connection.close()
+            else:
+                email.status = OutboxEmail.SENT
+                email.sent_date = now
+                email.last_error = ''
+                sent += 1
+                SENDS.inc(result='sent')
+        OutboxEmail.objects.bulk_update(
+            batch, ['status', 'attempts', 'last_error', 'next_attempt', 'sent_date'],
+        )
+    return sent, failed
+
+
+def drain(batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS, connection=None):
+    """Send every due email, batch after batch, returns (sent, failed). A connection
+    that is passed in is left open for the caller to reuse."""
+    own_connection = connection is None
+    connection = connection or get_connection()
+    sent = failed = 0
+    try:
+        while True:
+            batch_sent, batch_failed = send_batch(connection, batch_size, max_attempts)
+            sent += batch_sent
+            failed += batch_failed
+            if batch_sent + batch_failed < batch_size:
+                return sent, failed
+    finally:
+        if own_connection:
+            connection.close()
+
+
+def stats():
+    """Queue depth of the outbox: emails per status and the age of the oldest pending one"""
+    counts = dict.fromkeys([OutboxEmail.PENDING, OutboxEmail.SENT, OutboxEmail.FAILED], 0)
+    for row in OutboxEmail.objects.values('status').annotate(count=Count('id')).order_by():
+        counts[row['status']] = row['count']
+    oldest = OutboxEmail.objects.filter(status=OutboxEmail.PENDING).aggregate(oldest=Min('created_date'))['oldest']
+    return {
+        **counts,
+        'due': OutboxEmail.objects.filter(status=OutboxEmail.PENDING, next_attempt__lte=timezone.now()).count(),
+        'oldest_pending_seconds': (timezone.now() - oldest).total_seconds() if oldest else 0,
+    }
+
+
+@metrics.register_collector
+def queue_gauges():
+    queue = stats()
+    return [
+        ('outbox_emails', 'Emails in the outbox, by status',
+         [({'status': status}, queue[status]) for status in (OutboxEmail.PENDING, OutboxEmail.SENT, OutboxEmail.FAILED)]),
+        ('outbox_due_emails', 'Pending emails due to be sent', [({}, queue['due'])]),
+        ('outbox_oldest_pending_seconds', 'Age of the oldest pending email', [({}, queue['oldest_pending_seconds'])]),
+    ]
@@ -7,11 +7,11 @@ import jwt
 
 from rest_framework import serializers
 
-from renting.serializers import UserLocationSerializer, LandlordSerializer, ManagerSerializer
+from renting.serializers import SparseFieldsetsMixin, UserLocationSerializer, LandlordSerializer, ManagerSerializer
 
 User = get_user_model()
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     location = UserLocationSerializer(read_only=True)
     landlord_profile = LandlordSerializer(read_only=True)
     manager_profile = ManagerSerializer(read_only=True)
@@ -22,6 +22,8 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["id", "first_name", "last_name","email","is_manager","is_landlord","password","password_confirmation","manager_profile","landlord_profile","location"]
+        # the profiles are only included with ?expand=, a landlord profile lists every property
+        expandable_fields = ["manager_profile","landlord_profile","location"]
         extra_kwargs = {
             'password': {'write_only': True,'required': True},
             'password_confirmation': {'write_only': True,'required': True},
@@ -93,5 +95,9 @@ class UserPasswordResetConfirmSerializer(serializers.Serializer):
         return data
 
 
+class UserTokenRefreshSerializer(serializers.Serializer):
+    refresh = serializers.CharField(required=False, help_text="Defaults to the jwt-refresh cookie")
+
+
 class UserLogoutSerializer(serializers.Serializer):
     pass
\ No newline at end of file
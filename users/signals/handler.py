@@ -5,6 +5,7 @@ from django.contrib.auth import get_user_model
 User = get_user_model()
 
 from renting.models import Landlord, Manager, UserLocation
+from users.authentication import invalidate_user
 
 @receiver(post_save,sender=User)
 def create_manager_or_landlord(sender,**kwargs):
@@ -16,3 +17,9 @@ def create_manager_or_landlord(sender,**kwargs):
         elif user.is_landlord==True:
             Landlord.objects.create(user=user,gender="",phone_number="",profile_image="")
             UserLocation.objects.create(user=user,province=None,district=None,sector=None,cell=None)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
@@ -1,3 +1,183 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from renting.tests import EndpointQueryCountMixin, authenticate, create_rentals
+from . import outbox
+from .models import OutboxEmail
+
+User = get_user_model()
+
+
+# the admin pages link to static files that aren't collected in tests
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class UserAdminQueryCountTests(TestCase):
+    """The user admin runs the same number of queries however many users there are"""
+    CHANGELIST_BUDGET = 7
+    CHANGE_BUDGET = 12
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('Admin', 'User', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def test_query_counts(self):
+        for count in (2, 30):
+            for number in range(User.objects.count(), count):
+                User.objects.create_user('User', str(number), f'user{number}@example.com', 'password', is_landlord=True)
+            landlord = User.objects.filter(is_landlord=True).first()
+            with self.subTest(users=count):
+                self.assertLessEqual(self.count_queries(reverse('admin:users_useraccount_changelist')), self.CHANGELIST_BUDGET)
+                self.assertLessEqual(
+                    self.count_queries(reverse('admin:users_useraccount_change', args=[landlord.pk])), self.CHANGE_BUDGET,
+                )
+
+
+class UserEndpointQueryCountTests(EndpointQueryCountMixin, TestCase):
+    prefix = 'api/auth/'
+    skipped_routes = {
+        'image-complete-uploads': "completing an upload writes the image to the media storage",
+        'image-set-primary': "PropertyImages has no set_primary()",
+        'image-unset-primary': "PropertyImages has no unset_primary()",
+    }
+
+
+class JWTAuthenticationTests(TestCase):
+    """API requests are authenticated by tokens without querying the database"""
+    def setUp(self):
+        self.user = User.objects.create_user('Land', 'Lord', 'landlord@example.com', 'password', is_landlord=True)
+        self.url = reverse('user-list')
+
+    def test_login(self):
+        response = self.client.post(reverse('user-login'), {'email': self.user.email, 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Session.objects.exists())
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+
+        self.client.cookies.clear()
+        self.client.defaults['HTTP_AUTHORIZATION'] = f"Bearer {response.json()['token']}"
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertFalse([query for query in queries if 'users_useraccount' in query['sql'] or 'django_session' in query['sql']])
+
+    def test_revoked(self):
+        authenticate(self.client, self.user)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.user.set_password('a new password')
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+        authenticate(self.client, self.user)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+class SparseFieldsetsTests(TestCase):
+    """?fields= and ?expand= narrow responses, nested serializers get the selection under their name"""
+    def setUp(self):
+        create_rentals(1)
+        self.user = User.objects.get(is_landlord=True)
+        authenticate(self.client, self.user)
+
+    def get(self, url, params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_top_level(self):
+        url = reverse('user-list')
+        self.assertEqual(set(self.get(url, {})), {'id', 'first_name', 'last_name', 'email', 'is_manager', 'is_landlord'})
+        self.assertEqual(self.get(url, {'fields': 'id,email'}), {'id': self.user.pk, 'email': self.user.email})
+        # expandable fields only come when expanded, even when selected
+        self.assertEqual(self.get(url, {'fields': 'id,landlord_profile'}), {'id': self.user.pk})
+
+    def test_nested(self):
+        url = reverse('user-list')
+        data = self.get(url, {'fields': 'id,landlord_profile', 'expand': 'landlord_profile'})
+        self.assertEqual(set(data), {'id', 'landlord_profile'})
+        # without a selection of its own the profile has all its fields
+        self.assertEqual(set(data['landlord_profile']), {'id', 'user', 'gender', 'phone_number', 'profile_image', 'renditions', 'properties'})
+        data = self.get(url, {'fields': 'id,landlord_profile.properties.title', 'expand': 'landlord_profile'})
+        self.assertEqual(data['landlord_profile'], {'properties': [{'title': 'House 0'}]})
+
+    def test_list(self):
+        url = reverse('landlord-list', kwargs={'user_pk': self.user.pk})
+        landlord = self.user.landlord_profile
+        self.assertEqual(self.get(url, {'fields': 'id'}), [{'id': landlord.pk}])
+        data = self.get(url, {'fields': 'id,properties.title'})
+        self.assertEqual(data, [{'id': landlord.pk, 'properties': [{'title': 'House 0'}]}])
+        data = self.get(url, {'fields': 'properties'})
+        self.assertEqual(set(data[0]), {'properties'})
+        self.assertIn('renting_price', data[0]['properties'][0])
+
+
+class OutboxTests(TestCase):
+    """Account emails wait in the outbox until it is drained, failed ones are retried later"""
+    def test_drain(self):
+        response = self.client.post(reverse('user-register'), {
+            'first_name': 'New', 'last_name': 'User', 'email': 'new@example.com',
+            'password': 'password', 'password_confirmation': 'password',
+        })
+        self.assertEqual(response.status_code, 201, response.content)
+        # the signup doesn't wait on the mail relay
+        self.assertEqual(len(mail.outbox), 0)
+        for number in range(4):
+            outbox.enqueue('Hello', 'Body', [f'user{number}@example.com'])
+        # batch after batch
+        self.assertEqual(outbox.drain(batch_size=2), (5, 0))
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].subject, 'Activate your account')
+        self.assertEqual(mail.outbox[0].to, ['new@example.com'])
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.SENT, attempts=1).count(), 5)
+        # sent emails aren't sent again
+        self.assertEqual(outbox.drain(), (0, 0))
+
+    def test_retry(self):
+        email = outbox.enqueue('Hello', 'Body', ['user@example.com'])
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=OSError('relay down')):
+            self.assertEqual(outbox.drain(max_attempts=2), (0, 1))
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts, email.last_error), (OutboxEmail.PENDING, 1, 'OSError: relay down'))
+            self.assertAlmostEqual(email.next_attempt, timezone.now() + timedelta(seconds=30), delta=timedelta(seconds=5))
+            # not due yet
+            self.assertEqual(outbox.drain(max_attempts=2), (0, 0))
+            OutboxEmail.objects.update(next_attempt=timezone.now())
+            # out of attempts
+            self.assertEqual(outbox.drain(max_attempts=2), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.FAILED, 2))
+        self.assertEqual(outbox.drain(), (0, 0))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_retried_after_failure(self):
+        outbox.enqueue('Hello', 'Body', ['user@example.com'])
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=OSError('relay down')):
+            outbox.drain()
+        OutboxEmail.objects.update(next_attempt=timezone.now())
+        self.assertEqual(outbox.drain(), (1, 0))
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts, email.last_error), (OutboxEmail.SENT, 2, ''))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_backoff(self):
+        self.assertEqual(
+            [outbox.backoff(attempts).total_seconds() for attempts in (1, 2, 3, 8)], [30, 60, 120, 3600],
+        )
@@ -17,6 +17,7 @@ from .views import (
     UserPasswordResetConfirmView, 
     UserViewSet, 
     UserLogoutView,
+    UserTokenRefreshView,
     UserLocationViewSet
 )
 
@@ -42,6 +43,7 @@ urlpatterns = [
     path(r'register/', UserRegistrationView.as_view(), name='user-register'),
     path(r'activate/<uidb64>/<token>/', UserActivateView.as_view(), name='user-activate'),
     path(r'login/', UserLoginView.as_view(), name='user-login'),
+    path(r'token/refresh/', UserTokenRefreshView.as_view(), name='token-refresh'),
     path(r'logout/', UserLogoutView.as_view(), name='user-logout'),
     path(r'password_reset/', UserPasswordResetView.as_view(), name='password-reset'),
     path(r'password/reset/confirm/<uidb64>/<token>/', UserPasswordResetConfirmView.as_view(), name='password-reset-confirm'),
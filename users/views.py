@@ -1,21 +1,21 @@
-from django.contrib.auth import get_user_model, authenticate, login, logout
+from django.contrib.auth import get_user_model, authenticate, user_logged_in
 from django.contrib.auth.forms import SetPasswordForm
 from django.contrib.auth.tokens import default_token_generator
-from django.conf import settings
-from django.core.mail import EmailMessage
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 
 from rest_framework import status, viewsets, mixins, generics
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-import jwt
-from datetime import datetime, timedelta
-from .serializers import UserSerializer, LoginSerializer, UserPasswordResetSerializer, UserPasswordResetConfirmSerializer, UserLogoutSerializer
+from . import outbox
+from .authentication import ACCESS, ACCESS_COOKIE, REFRESH, REFRESH_COOKIE, decode_token, get_token_user, set_token_cookies
+from .serializers import UserSerializer, LoginSerializer, UserPasswordResetSerializer, UserPasswordResetConfirmSerializer, UserLogoutSerializer, UserTokenRefreshSerializer
 from renting.serializers import UserLocationSerializer
 from renting.models import UserLocation
 
@@ -31,22 +31,22 @@ class UserRegistrationView(generics.GenericAPIView):
             if User.objects.filter(email=user_email).exists():
                 return Response({"message": "This email is already registered."}, status=status.HTTP_400_BAD_REQUEST)
 
-            user = serializer.save()
-            user.is_active = False
-            user.save()
-
-            # Send email with activation link
-            activation_link = reverse('user-activate', kwargs={
-                'uidb64': urlsafe_base64_encode(force_bytes(user.pk)),
-                'token': default_token_generator.make_token(user),
-            })
-            activation_url = request.build_absolute_uri(activation_link)
-            message = EmailMessage(
-                subject='Activate your account',
-                body=f'Please click on this link to activate your account: {activation_url}',
-                to=[user.email],
-            )
-            message.send()
+            with transaction.atomic():
+                user = serializer.save()
+                user.is_active = False
+                user.save()
+
+                # Queue email with activation link, sent by the send_outbox_emails command
+                activation_link = reverse('user-activate', kwargs={
+                    'uidb64': urlsafe_base64_encode(force_bytes(user.pk)),
+                    'token': default_token_generator.make_token(user),
+                })
+                activation_url = request.build_absolute_uri(activation_link)
+                outbox.enqueue(
+                    subject='Activate your account',
+                    body=f'Please click on this link to activate your account: {activation_url}',
+                    to=[user.email],
+                )
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
@@ -88,13 +88,12 @@ class UserPasswordResetView(generics.GenericAPIView):
             })
             password_reset_url = request.build_absolute_uri(password_reset_link)
 
-            # Send email with password reset link
-            message = EmailMessage(
+            # Queue email with password reset link, sent by the send_outbox_emails command
+            outbox.enqueue(
                 subject='Password Reset Requested',
                 body=f'Please click on this link to reset your password: {password_reset_url}',
                 to=[email],
             )
-            message.send()
 
             return Response({'message': 'Password reset link has been sent to your email address.'}, status=status.HTTP_200_OK)
 
@@ -137,19 +136,15 @@ class UserLoginView(generics.GenericAPIView):
                 password=serializer.validated_data['password']
             )
             if user is not None:
-                login(request, user)
-                serializer = UserSerializer(user)
-                # Create JWT token
-                payload = {
-                    'user_id': user.pk,
-                    'exp': datetime.utcnow() + timedelta(days=1),
-                    'iat': datetime.utcnow(),
-                }
-                token = jwt.encode(payload, settings.SECRET_KEY, algorithm='HS256')
+                # the tokens replace the session, only the last login is recorded
+                user_logged_in.send(sender=user.__class__, request=request, user=user)
+                serializer = UserSerializer(user, context=self.get_serializer_context())
+                # Create JWT access and refresh tokens
                 response = Response({'message': 'Login successful.'}, status=status.HTTP_200_OK)
-                response.set_cookie(key='jwt', value=token, httponly=True)
+                tokens = set_token_cookies(response, user)
                 response.data = {
-                    'token': token,
+                    'token': tokens[ACCESS],
+                    'refresh': tokens[REFRESH],
                     'user': serializer.data,
                 }
                 return response
@@ -169,42 +164,22 @@ class UserViewSet(mixins.ListModelMixin,
     queryset = User.objects.all()
 
     def get_object(self):
-        token = self.request.COOKIES.get('jwt')
-        if not token:
-            return Response({'error': 'Unauthorized.'}, status=status.HTTP_401_UNAUTHORIZED)
-
-        try:
-            # Decode JWT token
-            token = self.request.COOKIES.get('jwt')
-            decoded_token = jwt.decode(token, settings.SECRET_KEY, algorithms='HS256')
-        except jwt.ExpiredSignatureError:
-            return Response({'error': 'Unauthorized.'}, status=status.HTTP_401_UNAUTHORIZED)
-
-        # Get user_id from the JWT token
-        user_id = decoded_token['user_id']
-
-        # Get user object from the user_id
-        user = self.queryset.filter(pk=user_id).first()
-
-        if not user:
-            return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
-        if not user.is_active:
-            return Response({'error': 'User account is not active.'}, status=status.HTTP_401_UNAUTHORIZED)
-        return user
+        # the user authenticated by the token, see users.authentication
+        return self.request.user
 
     def list(self, request):
         user = self.get_object()
-        serializer = UserSerializer(user)
+        serializer = self.get_serializer(user)
         return Response(serializer.data)
 
     def retrieve(self, request, pk=None):
         user = self.get_object()
-        serializer = UserSerializer(user)
+        serializer = self.get_serializer(user)
         return Response(serializer.data)
 
     def update(self, request, pk=None):
         user = self.get_object()
-        serializer = UserSerializer(user, data=request.data)
+        serializer = self.get_serializer(user, data=request.data)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
@@ -217,14 +192,35 @@ class UserViewSet(mixins.ListModelMixin,
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class UserTokenRefreshView(generics.GenericAPIView):
+    serializer_class = UserTokenRefreshSerializer
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token = serializer.validated_data.get('refresh') or request.COOKIES.get(REFRESH_COOKIE)
+        if not token:
+            return Response({'error': 'Refresh token is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        payload = decode_token(token, REFRESH)
+        try:
+            user = get_token_user(payload)
+        except AuthenticationFailed:
+            return Response({'error': 'Unauthorized.'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        response = Response(status=status.HTTP_200_OK)
+        tokens = set_token_cookies(response, user)
+        response.data = {'token': tokens[ACCESS], 'refresh': tokens[REFRESH]}
+        return response
+
+
 class UserLogoutView(generics.GenericAPIView):
     serializer_class = UserLogoutSerializer
     permission_classes = [IsAuthenticated]
     def post(self, request):
-        # Logout the user by removing the session data
-        logout(request)
+        # tokens kept outside the cookies stay valid until they expire or the password changes
         response = Response({"success": "User logged out successfully."}, status=status.HTTP_200_OK)
-        response.delete_cookie('jwt')
+        response.delete_cookie(ACCESS_COOKIE)
+        response.delete_cookie(REFRESH_COOKIE)
         return response
 
 